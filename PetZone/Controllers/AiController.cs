@@ -1,6 +1,7 @@
 using Microsoft.AspNetCore.Mvc;
 using Microsoft.EntityFrameworkCore;
 using PetZone.Models;
+using PetZone.Services;
 using System.Text.Json;
 
 namespace PetZone.Controllers
@@ -11,11 +12,13 @@ namespace PetZone.Controllers
     {
         private readonly PetZoneDbContext _context;
         private readonly ILogger<AiController> _logger;
+        private readonly IdempotencyStore _idempotency;
 
-        public AiController(PetZoneDbContext context, ILogger<AiController> logger)
+        public AiController(PetZoneDbContext context, ILogger<AiController> logger, IdempotencyStore idempotency)
         {
             _context = context;
             _logger = logger;
+            _idempotency = idempotency;
         }
 
         // ============ AI ALERT ENDPOINTS ============
@@ -32,19 +35,20 @@ namespace PetZone.Controllers
             _logger.LogInformation($"Message: {request.Message}");
             _logger.LogInformation($"Confidence: {request.Confidence:P}");
 
+            var key = IdempotencyStore.KeyFrom(Request, request.IdempotencyKey);
+            if (_idempotency.IsDuplicate(key))
+            {
+                return Ok(new { message = "Duplicate alert ignored", duplicate = true });
+            }
+
             try
             {
                 // Lưu alert vào database (có thể tạo bảng AiAlerts)
-                var alert = new AiDetection
-                {
-                    HasPet = request.SensorData?.PresenceEnergy > 0,
-                    ConfidenceScore = (decimal)request.Confidence,
-                    Note = $"[{request.AlertLevel}] {request.Message}",
-                    CreatedAt = DateTime.UtcNow
-                };
+                var alert = ToDetection(request);
 
                 _context.AiDetections.Add(alert);
                 await _context.SaveChangesAsync();
+                _idempotency.Remember(new[] { key });
 
                 _logger.LogInformation($"Alert saved with ID: {alert.Id}");
                 _logger.LogInformation("=======================================");
@@ -76,18 +80,19 @@ namespace PetZone.Controllers
             _logger.LogWarning($"Actions: {string.Join(", ", request.Actions ?? new List<string>())}");
             _logger.LogWarning("==========================================");
 
+            var key = IdempotencyStore.KeyFrom(Request, request.IdempotencyKey);
+            if (_idempotency.IsDuplicate(key))
+            {
+                return Ok(new { message = "Duplicate emergency alert ignored", duplicate = true });
+            }
+
             try
             {
-                var alert = new AiDetection
-                {
-                    HasPet = request.SensorData?.PresenceEnergy > 0,
-                    ConfidenceScore = (decimal)request.Confidence,
-                    Note = $"[EMERGENCY-{request.AlertLevel}] {request.Message} | Actions: {string.Join(", ", request.Actions ?? new List<string>())}",
-                    CreatedAt = DateTime.UtcNow
-                };
+                var alert = ToDetection(request);
 
                 _context.AiDetections.Add(alert);
                 await _context.SaveChangesAsync();
+                _idempotency.Remember(new[] { key });
 
                 // TODO: Send push notification, email, SMS, etc.
                 
@@ -104,6 +109,83 @@ namespace PetZone.Controllers
             }
         }
 
+        /// <summary>
+        /// Nhận nhiều alert trong một request (AI Service outbox)
+        /// POST: api/ai/alert/batch
+        /// </summary>
+        [HttpPost("alert/batch")]
+        public async Task<IActionResult> ReceiveAlertBatch([FromBody] List<AiAlertRequest> requests)
+        {
+            var fresh = requests.Where(r => !_idempotency.IsDuplicate(r.IdempotencyKey)).ToList();
+            _logger.LogInformation($"[AI] Alert batch: {fresh.Count} new, {requests.Count - fresh.Count} duplicate");
+
+            try
+            {
+                _context.AiDetections.AddRange(fresh.Select(ToDetection));
+                await _context.SaveChangesAsync();
+                _idempotency.Remember(fresh.Select(r => r.IdempotencyKey));
+
+                return Ok(new { accepted = fresh.Count, duplicates = requests.Count - fresh.Count });
+            }
+            catch (Exception ex)
+            {
+                _logger.LogError($"Error saving alert batch: {ex.Message}");
+                return StatusCode(500, new { error = "Failed to save alert batch" });
+            }
+        }
+
+        /// <summary>
+        /// Nhận nhiều emergency alert trong một request (AI Service outbox)
+        /// POST: api/ai/emergency/batch
+        /// </summary>
+        [HttpPost("emergency/batch")]
+        public async Task<IActionResult> ReceiveEmergencyBatch([FromBody] List<AiEmergencyRequest> requests)
+        {
+            var fresh = requests.Where(r => !_idempotency.IsDuplicate(r.IdempotencyKey)).ToList();
+            foreach (var request in fresh)
+            {
+                _logger.LogWarning($"🚨 EMERGENCY [{request.AlertLevel}] {request.Message}");
+            }
+
+            try
+            {
+                _context.AiDetections.AddRange(fresh.Select(ToDetection));
+                await _context.SaveChangesAsync();
+                _idempotency.Remember(fresh.Select(r => r.IdempotencyKey));
+
+                // TODO: Send push notification, email, SMS, etc.
+
+                return Ok(new { accepted = fresh.Count, duplicates = requests.Count - fresh.Count });
+            }
+            catch (Exception ex)
+            {
+                _logger.LogError($"Error saving emergency batch: {ex.Message}");
+                return StatusCode(500, new { error = "Failed to save emergency batch" });
+            }
+        }
+
+        private static AiDetection ToDetection(AiAlertRequest request)
+        {
+            return new AiDetection
+            {
+                HasPet = request.SensorData?.PresenceEnergy > 0,
+                ConfidenceScore = (decimal)request.Confidence,
+                Note = $"[{request.AlertLevel}] {request.Message}",
+                CreatedAt = DateTime.UtcNow
+            };
+        }
+
+        private static AiDetection ToDetection(AiEmergencyRequest request)
+        {
+            return new AiDetection
+            {
+                HasPet = request.SensorData?.PresenceEnergy > 0,
+                ConfidenceScore = (decimal)request.Confidence,
+                Note = $"[EMERGENCY-{request.AlertLevel}] {request.Message} | Actions: {string.Join(", ", request.Actions ?? new List<string>())}",
+                CreatedAt = DateTime.UtcNow
+            };
+        }
+
         /// <summary>
         /// Lấy danh sách alerts gần đây
         /// GET: api/ai/alerts
@@ -227,6 +309,7 @@ namespace PetZone.Controllers
         public SensorDataDto? SensorData { get; set; }
         public object? Reasoning { get; set; }
         public DateTime Timestamp { get; set; }
+        public string? IdempotencyKey { get; set; }
     }
 
     public class AiEmergencyRequest
@@ -239,6 +322,7 @@ namespace PetZone.Controllers
         public List<string>? Actions { get; set; }
         public object? Reasoning { get; set; }
         public DateTime Timestamp { get; set; }
+        public string? IdempotencyKey { get; set; }
     }
 
     public class AiStatusRequest
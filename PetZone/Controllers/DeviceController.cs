@@ -1,6 +1,7 @@
 using Microsoft.AspNetCore.Mvc;
 using Microsoft.EntityFrameworkCore;
 using PetZone.Models;
+using PetZone.Services;
 
 namespace PetZone.Controllers
 {
@@ -10,11 +11,13 @@ namespace PetZone.Controllers
     {
         private readonly PetZoneDbContext _context;
         private readonly ILogger<DeviceController> _logger;
+        private readonly IdempotencyStore _idempotency;
 
-        public DeviceController(PetZoneDbContext context, ILogger<DeviceController> logger)
+        public DeviceController(PetZoneDbContext context, ILogger<DeviceController> logger, IdempotencyStore idempotency)
         {
             _context = context;
             _logger = logger;
+            _idempotency = idempotency;
         }
 
         // ============ DEVICE ACTIVITY ENDPOINTS ============
@@ -31,20 +34,19 @@ namespace PetZone.Controllers
             _logger.LogInformation($"Action: {request.Action}");
             _logger.LogInformation($"Reason: {request.Reason}");
 
+            var key = IdempotencyStore.KeyFrom(Request, request.IdempotencyKey);
+            if (_idempotency.IsDuplicate(key))
+            {
+                return Ok(new { message = "Duplicate device activity ignored", duplicate = true });
+            }
+
             try
             {
-                var activity = new DeviceActivity
-                {
-                    DeviceType = request.DeviceType,
-                    Action = request.Action,
-                    Intensity = request.Intensity,
-                    Duration = request.Duration,
-                    Reason = request.Reason,
-                    Timestamp = request.Timestamp ?? DateTime.UtcNow
-                };
+                var activity = ToActivity(request);
 
                 _context.DeviceActivities.Add(activity);
                 await _context.SaveChangesAsync();
+                _idempotency.Remember(new[] { key });
 
                 _logger.LogInformation($"Device activity logged with ID: {activity.Id}");
                 _logger.LogInformation("=========================================");
@@ -63,6 +65,44 @@ namespace PetZone.Controllers
             }
         }
 
+        /// <summary>
+        /// Ghi nhiều log hoạt động thiết bị trong một request (AI Service outbox)
+        /// POST: api/device/activity/batch
+        /// </summary>
+        [HttpPost("activity/batch")]
+        public async Task<IActionResult> LogDeviceActivityBatch([FromBody] List<DeviceActivityRequest> requests)
+        {
+            var fresh = requests.Where(r => !_idempotency.IsDuplicate(r.IdempotencyKey)).ToList();
+            _logger.LogInformation($"Device activity batch: {fresh.Count} new, {requests.Count - fresh.Count} duplicate");
+
+            try
+            {
+                _context.DeviceActivities.AddRange(fresh.Select(ToActivity));
+                await _context.SaveChangesAsync();
+                _idempotency.Remember(fresh.Select(r => r.IdempotencyKey));
+
+                return Ok(new { accepted = fresh.Count, duplicates = requests.Count - fresh.Count });
+            }
+            catch (Exception ex)
+            {
+                _logger.LogError($"Error logging device activity batch: {ex.Message}");
+                return StatusCode(500, new { error = "Failed to log device activity batch" });
+            }
+        }
+
+        private static DeviceActivity ToActivity(DeviceActivityRequest request)
+        {
+            return new DeviceActivity
+            {
+                DeviceType = request.DeviceType,
+                Action = request.Action,
+                Intensity = request.Intensity,
+                Duration = request.Duration,
+                Reason = request.Reason,
+                Timestamp = request.Timestamp ?? DateTime.UtcNow
+            };
+        }
+
         /// <summary>
         /// Lấy lịch sử hoạt động thiết bị
         /// GET: api/device/activity
@@ -245,5 +285,6 @@ namespace PetZone.Controllers
         public int? Duration { get; set; }
         public string Reason { get; set; } = string.Empty;
         public DateTime? Timestamp { get; set; }
+        public string? IdempotencyKey { get; set; }
     }
 }
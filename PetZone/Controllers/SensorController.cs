@@ -9,10 +9,14 @@ namespace PetZone.Controllers
     public class SensorController : ControllerBase
     {
         private readonly PetZoneDbContext _context;
+        private readonly IHttpClientFactory _httpClientFactory;
+        private readonly IConfiguration _configuration;
 
-        public SensorController(PetZoneDbContext context)
+        public SensorController(PetZoneDbContext context, IHttpClientFactory httpClientFactory, IConfiguration configuration)
         {
             _context = context;
+            _httpClientFactory = httpClientFactory;
+            _configuration = configuration;
         }
 
         // 1. API NHẬN DỮ LIỆU TỪ ESP32 (POST: api/sensor)
@@ -54,9 +58,34 @@ namespace PetZone.Controllers
             }
 
             Console.WriteLine("========================================\n");
+
+            // Đẩy reading sang AI Service ngay (không chờ, không ảnh hưởng response cho ESP32)
+            if (_configuration.GetValue("AiService:ForwardReadings", true))
+            {
+                _ = ForwardToAiServiceAsync(data);
+            }
+
             return Ok(new { message = "Server đã nhận OK", id = data.Id });
         }
 
+        private async Task ForwardToAiServiceAsync(SensorReading data)
+        {
+            try
+            {
+                var client = _httpClientFactory.CreateClient("AiService");
+                var response = await client.PostAsJsonAsync("ingest", data);
+                if (!response.IsSuccessStatusCode)
+                {
+                    // 429: hàng đợi AI đầy (policy reject) - reading vẫn được lưu trong DB
+                    Console.WriteLine($"[WARN] AI Service ingest returned {(int)response.StatusCode}");
+                }
+            }
+            catch (Exception ex)
+            {
+                Console.WriteLine($"[WARN] Cannot push reading to AI Service: {ex.Message}");
+            }
+        }
+
         // 2. API LẤY DỮ LIỆU MỚI NHẤT (GET: api/sensor/latest)
         [HttpGet("latest")]
         public async Task<IActionResult> GetLatestData()
@@ -68,5 +97,39 @@ namespace PetZone.Controllers
             if (latest == null) return NotFound("Chưa có dữ liệu nào");
             return Ok(latest);
         }
+
+        // 3. API LẤY TẤT CẢ DỮ LIỆU MỚI SAU CURSOR (GET: api/sensor/since?afterId=123&limit=500)
+        // AI Service giữ cursor (id cuối đã xử lý) và lấy mọi reading mới trong một request
+        [HttpGet("since")]
+        public async Task<IActionResult> GetDataSince([FromQuery] int? afterId, [FromQuery] DateTime? after, [FromQuery] int limit = 500)
+        {
+            limit = Math.Clamp(limit, 1, 5000);
+
+            var query = _context.SensorReadings.AsNoTracking();
+            if (afterId.HasValue)
+            {
+                query = query.Where(x => x.Id > afterId.Value);
+            }
+            else if (after.HasValue)
+            {
+                query = query.Where(x => x.CreatedAt > after.Value);
+            }
+
+            // Lấy dư một bản ghi để biết còn dữ liệu phía sau hay không
+            var readings = await query
+                                .OrderBy(x => x.Id)
+                                .Take(limit + 1)
+                                .ToListAsync();
+
+            var hasMore = readings.Count > limit;
+            if (hasMore) readings.RemoveAt(readings.Count - 1);
+
+            return Ok(new
+            {
+                readings,
+                lastId = readings.Count > 0 ? readings[^1].Id : afterId,
+                hasMore
+            });
+        }
     }
 }
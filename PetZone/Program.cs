@@ -1,5 +1,6 @@
 ﻿using Microsoft.EntityFrameworkCore;
 using PetZone.Models;
+using PetZone.Services;
 
 var builder = WebApplication.CreateBuilder(args);
 
@@ -18,6 +19,16 @@ builder.Services.AddCors(options => {
     });
 });
 
+// AI Service nhận reading ngay khi ESP32 gửi lên (push /ingest thay vì đợi AI poll)
+builder.Services.AddHttpClient("AiService", client =>
+{
+    client.BaseAddress = new Uri(builder.Configuration["AiService:BaseUrl"] ?? "http://localhost:5001/");
+    client.Timeout = TimeSpan.FromSeconds(2);
+});
+
+// Chống ghi trùng event khi AI Service outbox gửi lại (idempotency key)
+builder.Services.AddSingleton<IdempotencyStore>();
+
 builder.Services.AddControllers();
 // Learn more about configuring Swagger/OpenAPI at https://aka.ms/aspnetcore/swashbuckle
 builder.Services.AddEndpointsApiExplorer();
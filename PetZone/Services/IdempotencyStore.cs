@@ -0,0 +1,50 @@
+using System.Collections.Concurrent;
+
+namespace PetZone.Services
+{
+    /// <summary>
+    /// Ghi nhớ idempotency key của các event từ AI Service outbox (alert, emergency,
+    /// device activity) trong 24 giờ, để event được gửi lại sau timeout/retry không bị lưu trùng.
+    /// </summary>
+    public class IdempotencyStore
+    {
+        private static readonly TimeSpan Ttl = TimeSpan.FromHours(24);
+        private static readonly TimeSpan SweepInterval = TimeSpan.FromMinutes(10);
+
+        private readonly ConcurrentDictionary<string, DateTime> _seen = new();
+        private DateTime _lastSweep = DateTime.UtcNow;
+
+        public static string? KeyFrom(HttpRequest request, string? bodyKey)
+        {
+            return !string.IsNullOrEmpty(bodyKey) ? bodyKey : request.Headers["Idempotency-Key"].FirstOrDefault();
+        }
+
+        public bool IsDuplicate(string? key)
+        {
+            return !string.IsNullOrEmpty(key)
+                && _seen.TryGetValue(key, out var seenAt)
+                && DateTime.UtcNow - seenAt < Ttl;
+        }
+
+        /// <summary>
+        /// Gọi sau khi SaveChanges thành công (lưu lỗi thì event vẫn được nhận lại khi retry)
+        /// </summary>
+        public void Remember(IEnumerable<string?> keys)
+        {
+            var now = DateTime.UtcNow;
+            foreach (var key in keys)
+            {
+                if (!string.IsNullOrEmpty(key)) _seen[key] = now;
+            }
+
+            if (now - _lastSweep > SweepInterval)
+            {
+                _lastSweep = now;
+                foreach (var entry in _seen)
+                {
+                    if (now - entry.Value >= Ttl) _seen.TryRemove(entry.Key, out _);
+                }
+            }
+        }
+    }
+}
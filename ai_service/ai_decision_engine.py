@@ -6,11 +6,27 @@ Sử dụng Fuzzy Logic và ML để ra quyết định thông minh thay vì if-
 
 import numpy as np
 from dataclasses import dataclass
-from typing import List, Dict, Tuple
+from typing import List, Dict, Iterator, Tuple, Optional
 from enum import Enum
 import json
+import time
 from datetime import datetime
 
+from fuzzy_rules import (
+    CompiledRuleSet,
+    RuleEvaluation,
+    RuleSetSource,
+    compile_rule_set,
+    DEFAULT_RULE_CONFIG,
+    DEFAULT_RULES_PATH
+)
+from trend_features import TrendFeatureStage, TrendConfig, BatchSlope
+from temperature_forecast import HoltForecaster, ForecastConfig
+from sensor_anomaly import SensorAnomalyDetector, AnomalyConfig, AnomalyReport
+from tracing import get_tracer
+
+tracer = get_tracer()
+
 
 class AlertLevel(Enum):
     """Mức độ cảnh báo"""
@@ -20,6 +36,14 @@ class AlertLevel(Enum):
     CRITICAL = "critical"
 
 
+# Alert level theo mã số trong rule set (fuzzy_rules.ALERT_LEVEL_ORDER)
+ALERT_LEVELS_BY_CODE = (AlertLevel.SAFE, AlertLevel.WARNING, AlertLevel.DANGER, AlertLevel.CRITICAL)
+
+
+# Cage mặc định (một nguồn cảm biến, tương thích với backend chưa có cageId)
+DEFAULT_CAGE_ID = "default"
+
+
 class ActionType(Enum):
     """Loại hành động cần thực hiện"""
     NONE = "none"
@@ -37,6 +61,8 @@ class SensorData:
     presence_energy: int
     movement_energy: int
     timestamp: datetime = None
+    cage_id: str = DEFAULT_CAGE_ID
+    trace_id: Optional[str] = None  # Gắn khi reading vào service (fetch, /ingest) - xem tracing.py
     
     def __post_init__(self):
         if self.timestamp is None:
@@ -52,6 +78,7 @@ class AIDecision:
     confidence: float  # 0.0 - 1.0
     reasoning: Dict[str, any]  # Giải thích tại sao ra quyết định này
     timestamp: datetime = None
+    trace_id: Optional[str] = None  # Trace của reading tạo ra decision
     
     def __post_init__(self):
         if self.timestamp is None:
@@ -64,55 +91,260 @@ class AIDecision:
             "message": self.message,
             "confidence": round(self.confidence, 3),
             "reasoning": self.reasoning,
+            "trace_id": self.trace_id,
             "timestamp": self.timestamp.isoformat()
         }
 
 
+# Compact records cho lịch sử lớn: __slots__, enum mã hoá số nguyên, timestamp epoch float
+ALERT_CODES = {level: code for code, level in enumerate(ALERT_LEVELS_BY_CODE)}
+ACTION_TYPES = tuple(ActionType)
+ACTION_CODES = {action: code for code, action in enumerate(ACTION_TYPES)}
+
+# Danh sách action được pack vào một số nguyên: mỗi action 3 bit (mã + 1, 0 = hết),
+# giữ nguyên thứ tự và phần tử trùng (NOTIFY có thể xuất hiện 2 lần)
+ACTION_BITS = 3
+MAX_ACTIONS = 5
+
+
+def encode_actions(actions: List[ActionType]) -> int:
+    if len(actions) > MAX_ACTIONS:
+        raise ValueError(f"Tối đa {MAX_ACTIONS} actions mỗi decision, nhận {len(actions)}")
+    packed = 0
+    for slot, action in enumerate(actions):
+        packed |= (ACTION_CODES[action] + 1) << (ACTION_BITS * slot)
+    return packed
+
+
+def decode_actions(packed: int) -> List[ActionType]:
+    actions = []
+    while packed:
+        actions.append(ACTION_TYPES[(packed & 0b111) - 1])
+        packed >>= ACTION_BITS
+    return actions
+
+
+class CompactSensorData:
+    """SensorData dạng gọn: 5 slot, timestamp epoch giây"""
+    __slots__ = ('temperature', 'humidity', 'presence_energy', 'movement_energy', 'timestamp')
+
+    def __init__(self, temperature: float, humidity: float, presence_energy: int,
+                 movement_energy: int, timestamp: float):
+        self.temperature = temperature
+        self.humidity = humidity
+        self.presence_energy = presence_energy
+        self.movement_energy = movement_energy
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_sensor_data(cls, data: SensorData) -> 'CompactSensorData':
+        return cls(data.temperature, data.humidity, data.presence_energy,
+                   data.movement_energy, data.timestamp.timestamp())
+
+    def to_sensor_data(self) -> SensorData:
+        return SensorData(
+            temperature=self.temperature,
+            humidity=self.humidity,
+            presence_energy=self.presence_energy,
+            movement_energy=self.movement_energy,
+            timestamp=datetime.fromtimestamp(self.timestamp)
+        )
+
+
+class CompactDecision:
+    """
+    AIDecision dạng gọn: chỉ giữ phần cần cho thống kê/lịch sử
+    (message và reasoning không được lưu - xem last_decision cho bản đầy đủ)
+    """
+    __slots__ = ('alert_code', 'actions_packed', 'confidence', 'combined_risk', 'timestamp')
+
+    def __init__(self, alert_code: int, actions_packed: int, confidence: float,
+                 combined_risk: float, timestamp: float):
+        self.alert_code = alert_code
+        self.actions_packed = actions_packed
+        self.confidence = confidence
+        self.combined_risk = combined_risk
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_decision(cls, decision: AIDecision) -> 'CompactDecision':
+        return cls(
+            ALERT_CODES[decision.alert_level],
+            encode_actions(decision.actions),
+            decision.confidence,
+            decision.reasoning.get('combined_risk_score', 0.0),
+            decision.timestamp.timestamp()
+        )
+
+    @property
+    def alert_level(self) -> AlertLevel:
+        return ALERT_LEVELS_BY_CODE[self.alert_code]
+
+    @property
+    def actions(self) -> List[ActionType]:
+        return decode_actions(self.actions_packed)
+
+    def to_dict(self) -> Dict:
+        return {
+            "alert_level": self.alert_level.value,
+            "actions": [a.value for a in self.actions],
+            "confidence": round(self.confidence, 3),
+            "combined_risk_score": round(self.combined_risk, 3),
+            "timestamp": datetime.fromtimestamp(self.timestamp).isoformat()
+        }
+
+
+class DecisionColumns:
+    """
+    Decision history dạng cột với dung lượng cố định (ring buffer):
+    mỗi decision ~30 bytes trong các mảng NumPy song song thay vì một AIDecision
+    với reasoning dict. Khi đầy, decision cũ nhất bị ghi đè.
+    """
+
+    COLUMNS = (
+        ('timestamp', np.float64),
+        ('alert_code', np.uint8),
+        ('actions', np.uint16),
+        ('confidence', np.float64),
+        ('combined_risk', np.float32),
+        ('temperature', np.float32),
+        ('humidity', np.float32),
+        ('presence_energy', np.int16),
+        ('movement_energy', np.int16),
+    )
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self._columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in self.COLUMNS}
+        self._next = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def append(self, decision: AIDecision, sensor_data: Optional[SensorData] = None):
+        i = self._next
+        cols = self._columns
+        cols['timestamp'][i] = decision.timestamp.timestamp()
+        cols['alert_code'][i] = ALERT_CODES[decision.alert_level]
+        cols['actions'][i] = encode_actions(decision.actions)
+        cols['confidence'][i] = decision.confidence
+        cols['combined_risk'][i] = decision.reasoning.get('combined_risk_score', 0.0)
+        if sensor_data is not None:
+            cols['temperature'][i] = sensor_data.temperature
+            cols['humidity'][i] = sensor_data.humidity
+            cols['presence_energy'][i] = sensor_data.presence_energy or 0
+            cols['movement_energy'][i] = sensor_data.movement_energy or 0
+        self._next = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def column(self, name: str) -> np.ndarray:
+        """Cột theo thứ tự thời gian (cũ → mới); là view khi buffer chưa quay vòng"""
+        data = self._columns[name]
+        if self._size < self.capacity:
+            return data[:self._size]
+        return np.concatenate([data[self._next:], data[:self._next]])
+
+    def __iter__(self) -> Iterator[CompactDecision]:
+        cols = {name: self.column(name).tolist() for name in
+                ('alert_code', 'actions', 'confidence', 'combined_risk', 'timestamp')}
+        for row in zip(cols['alert_code'], cols['actions'], cols['confidence'],
+                       cols['combined_risk'], cols['timestamp']):
+            yield CompactDecision(*row)
+
+    def clear(self):
+        self._next = 0
+        self._size = 0
+
+    def alert_counts(self) -> Dict[str, int]:
+        counts = np.bincount(self.column('alert_code'), minlength=len(ALERT_LEVELS_BY_CODE))
+        return {level.value: int(n) for level, n in zip(ALERT_LEVELS_BY_CODE, counts) if n}
+
+    def action_counts(self) -> Dict[str, int]:
+        packed = self.column('actions').astype(np.int64)
+        counts = np.zeros(len(ACTION_TYPES) + 1, dtype=np.int64)
+        for slot in range(MAX_ACTIONS):
+            counts += np.bincount((packed >> (ACTION_BITS * slot)) & 0b111, minlength=len(counts))
+        return {action.value: int(n) for action, n in zip(ACTION_TYPES, counts[1:]) if n}
+
+    def mean_confidence(self) -> float:
+        return float(self.column('confidence').mean()) if self._size else 0.0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(col.nbytes for col in self._columns.values())
+
+
+@dataclass
+class BatchDecisions:
+    """Kết quả analyze_batch - các mảng song song theo reading"""
+    evaluation: RuleEvaluation
+    temperature_rate: np.ndarray   # Slope nhiệt độ °C/phút (NaN nếu không có)
+    forecast: np.ndarray           # Nhiệt độ dự báo (NaN nếu không có)
+    turn_on_fan: np.ndarray        # bool
+    turn_off_fan: np.ndarray       # bool
+    fan_running: np.ndarray        # bool - trạng thái quạt sau mỗi reading
+    
+    def __len__(self):
+        return len(self.evaluation)
+    
+    @property
+    def alert_codes(self) -> np.ndarray:
+        return self.evaluation.alert_codes
+    
+    @property
+    def emergency(self) -> np.ndarray:
+        return self.evaluation.emergency
+    
+    @property
+    def notify(self) -> np.ndarray:
+        return self.evaluation.notify_risk | self.evaluation.notify_pet
+
+
+class ReplayState:
+    """
+    Trạng thái mang qua giữa các chunk khi replay một chuỗi readings
+    (trend slope, forecaster, trạng thái quạt) - tương đương trạng thái
+    mà analyze() giữ trong engine khi chạy live.
+    """
+    
+    def __init__(self, trend_config: TrendConfig = None, forecast_config: ForecastConfig = None):
+        trend_config = trend_config or TrendConfig()
+        self.slope = BatchSlope(trend_config.slope_window)
+        self.forecaster = HoltForecaster(forecast_config)
+        self.fan_running = False
+
+
 class FuzzyLogicEngine:
     """
     Fuzzy Logic Engine - Xử lý các giá trị mờ để ra quyết định thông minh
     Thay vì if-else cứng nhắc, fuzzy logic cho phép xử lý các trường hợp "gần giá trị"
+    Breakpoints lấy từ rule set (fuzzy_rules.json), không hardcode trong code.
     """
     
-    @staticmethod
-    def temperature_membership(temp: float) -> Dict[str, float]:
+    def __init__(self, rule_set: CompiledRuleSet = None):
+        self.rule_set = rule_set or compile_rule_set(DEFAULT_RULE_CONFIG)
+    
+    def temperature_membership(self, temp: float) -> Dict[str, float]:
         """
         Hàm membership cho nhiệt độ - trả về độ thuộc về mỗi tập mờ
         Ví dụ: 28°C có thể vừa thuộc "comfortable" (0.7) vừa "warm" (0.3)
         """
-        return {
-            'very_cold': FuzzyLogicEngine._trimf(temp, -10, 0, 10),
-            'cold': FuzzyLogicEngine._trimf(temp, 5, 10, 18),
-            'comfortable': FuzzyLogicEngine._trapmf(temp, 18, 22, 28, 32),
-            'warm': FuzzyLogicEngine._trimf(temp, 28, 32, 35),
-            'very_hot': FuzzyLogicEngine._trimf(temp, 32, 38, 45)
-        }
+        return self.rule_set.membership_dict(
+            'temperature', self.rule_set.temperature_membership(temp))
     
-    @staticmethod
-    def humidity_membership(humidity: float) -> Dict[str, float]:
+    def humidity_membership(self, humidity: float) -> Dict[str, float]:
         """Hàm membership cho độ ẩm"""
-        return {
-            'very_dry': FuzzyLogicEngine._trimf(humidity, 0, 20, 40),
-            'dry': FuzzyLogicEngine._trimf(humidity, 30, 45, 55),
-            'comfortable': FuzzyLogicEngine._trapmf(humidity, 50, 55, 75, 80),
-            'humid': FuzzyLogicEngine._trimf(humidity, 75, 82, 90),
-            'very_humid': FuzzyLogicEngine._trimf(humidity, 85, 92, 100)
-        }
+        return self.rule_set.membership_dict(
+            'humidity', self.rule_set.humidity_membership(humidity))
     
-    @staticmethod
-    def pet_presence_membership(presence: int, movement: int) -> Dict[str, float]:
+    def pet_presence_membership(self, presence: int, movement: int) -> Dict[str, float]:
         """Hàm membership cho trạng thái thú cưng"""
-        # Normalize energies to 0-1 range
-        p_norm = presence / 100.0 if presence else 0
-        m_norm = movement / 100.0 if movement else 0
-        
-        return {
-            'no_detection': 1.0 if presence == 0 else 0.0,
-            'empty_cage': max(0, min(1, p_norm)) * (1 - m_norm) if presence > 0 else 0,
-            'pet_sleeping': p_norm * (1 - m_norm) * 0.8,
-            'pet_active': p_norm * m_norm,
-            'pet_restless': p_norm * m_norm if (p_norm > 0.8 and m_norm > 0.8) else 0
-        }
+        return self.rule_set.membership_dict(
+            'pet_status', self.rule_set.pet_membership(presence or 0, movement or 0))
     
     @staticmethod
     def _trimf(x: float, a: float, b: float, c: float) -> float:
@@ -141,69 +373,127 @@ class IntelligentDecisionEngine:
     """
     AI Engine chính - sử dụng fuzzy logic và neural network concepts
     để ra quyết định thông minh
+    Rule set được load từ JSON, compile thành ma trận và hot-reload khi file thay đổi.
+    Trend features (EWMA, slope, min/max) được cập nhật streaming mỗi reading.
+    Quạt được điều khiển theo nhiệt độ dự báo (Holt) để tránh overshoot.
     """
     
-    def __init__(self):
-        self.fuzzy_engine = FuzzyLogicEngine()
-        self.decision_history = []
-        self.weight_matrix = self._initialize_weights()
+    def __init__(self, rules_path: Optional[str] = None, trend_config: TrendConfig = None,
+                 forecast_config: ForecastConfig = None, history_size: int = 100,
+                 anomaly_config: AnomalyConfig = None, rule_source: RuleSetSource = None):
+        # rule_source dùng chung giữa nhiều engine (mỗi cage một engine) để compile/reload một lần
+        self.rule_source = rule_source or RuleSetSource(rules_path)
+        self.anomaly_stage = SensorAnomalyDetector(anomaly_config)
+        self.trend_stage = TrendFeatureStage(trend_config)
+        self.forecaster = HoltForecaster(forecast_config)
+        self.fan_commanded_on = False  # Trạng thái quạt theo lệnh của chính engine
+        self.decision_history = DecisionColumns(history_size)
+    
+    @property
+    def rules(self) -> CompiledRuleSet:
+        """Rule set hiện tại (tự reload nếu file config thay đổi)"""
+        return self.rule_source.get()
     
-    def _initialize_weights(self) -> Dict:
+    @property
+    def weight_matrix(self) -> Dict:
         """
-        Initialize neural network-like weights cho decision making
-        Các trọng số này được học từ domain knowledge
+        Neural network-like weights cho decision making
+        Các trọng số này được học từ domain knowledge (xem fuzzy_rules.json)
         """
-        return {
-            'temperature_critical': 0.9,  # Nhiệt độ rất quan trọng
-            'humidity_critical': 0.7,
-            'pet_presence_critical': 0.8,
-            'combined_risk': 0.85
-        }
+        return self.rules.weight_matrix
     
-    def analyze(self, sensor_data: SensorData) -> AIDecision:
+    def reload_rules(self) -> CompiledRuleSet:
+        """Đọc lại rule config ngay lập tức"""
+        return self.rule_source.reload()
+    
+    def analyze(self, sensor_data: SensorData, update_state: bool = True) -> AIDecision:
         """
         Phân tích dữ liệu cảm biến và ra quyết định thông minh
         Sử dụng fuzzy logic + weighted scoring thay vì if-else
+        
+        update_state=False: đánh giá "thử" (test), không cập nhật trend, forecast,
+        trạng thái quạt và decision history của engine, và không đọc trạng thái đó:
+        chỉ kiểm tra dữ liệu không phụ thuộc lịch sử, quạt coi như đang tắt - cùng kết quả
+        với decide_batch và với engine mới.
         """
-        # 1. Fuzzy Logic Analysis
-        temp_fuzzy = self.fuzzy_engine.temperature_membership(sensor_data.temperature)
-        humidity_fuzzy = self.fuzzy_engine.humidity_membership(sensor_data.humidity)
-        pet_fuzzy = self.fuzzy_engine.pet_presence_membership(
-            sensor_data.presence_energy,
-            sensor_data.movement_energy
-        )
+        rules = self.rules
+        started = time.perf_counter()
         
-        # 2. Calculate risk scores cho từng khía cạnh
-        temp_risk = self._calculate_temperature_risk(temp_fuzzy, sensor_data.temperature)
-        humidity_risk = self._calculate_humidity_risk(humidity_fuzzy, sensor_data.humidity)
-        pet_risk = self._calculate_pet_status_risk(pet_fuzzy, sensor_data)
+        # 0. Data quality: reading bất thường không được đưa vào trend/forecast
+        if update_state:
+            anomaly = self.anomaly_stage.check(sensor_data)
+        else:
+            anomaly = self.anomaly_stage.check_stateless(sensor_data)
+        trusted = not any(f in ('out_of_range', 'zero', 'jump')
+                          for f in anomaly.flags.get('temperature', []))
+        
+        # Streaming trend features + forecast (O(1) mỗi reading)
+        if update_state and trusted:
+            trends = self.trend_stage.update(sensor_data)
+            temp_rate = self.trend_stage.temperature_rate()
+            self.forecaster.update(sensor_data.timestamp.timestamp(), sensor_data.temperature)
+            forecast = self.forecaster.predict(rules.forecast_horizon)
+        else:
+            trends, temp_rate, forecast = {}, None, None
+        
+        # 1. Fuzzy Logic Analysis + risk scores + weighted combination (matrix ops)
+        evaluation = rules.evaluate(
+            sensor_data.temperature,
+            sensor_data.humidity,
+            sensor_data.presence_energy or 0,
+            sensor_data.movement_energy or 0,
+            temperature_rate=temp_rate if temp_rate is not None else np.nan,
+            forecast_temperature=forecast if forecast is not None else np.nan
+        )
+        temp_fuzzy = rules.membership_dict('temperature', evaluation.temperature_membership[0])
+        humidity_fuzzy = rules.membership_dict('humidity', evaluation.humidity_membership[0])
+        pet_fuzzy = rules.membership_dict('pet_status', evaluation.pet_membership[0])
+        
+        # 2. Risk scores cho từng khía cạnh
+        temp_risk = self._calculate_temperature_risk(
+            temp_fuzzy, sensor_data.temperature,
+            evaluation.temperature_risk[0], evaluation.needs_cooling[0]
+        )
+        humidity_risk = self._calculate_humidity_risk(
+            humidity_fuzzy, sensor_data.humidity, evaluation.humidity_risk[0]
+        )
+        pet_risk = self._calculate_pet_status_risk(
+            pet_fuzzy, sensor_data, evaluation.pet_risk[0]
+        )
         
         # 3. Weighted combination - giống neural network output layer
-        combined_risk = (
-            temp_risk['score'] * self.weight_matrix['temperature_critical'] +
-            humidity_risk['score'] * self.weight_matrix['humidity_critical'] +
-            pet_risk['score'] * self.weight_matrix['pet_presence_critical']
-        ) / (self.weight_matrix['temperature_critical'] + 
-             self.weight_matrix['humidity_critical'] + 
-             self.weight_matrix['pet_presence_critical'])
+        combined_risk = float(evaluation.combined_risk[0])
         
         # 4. Determine actions based on fuzzy inference
-        actions = self._infer_actions(temp_risk, humidity_risk, pet_risk, temp_fuzzy)
-        
-        # 5. Determine alert level
+        fan_running = self.fan_commanded_on if update_state else False
+        actions = self._infer_actions(evaluation, 0, fan_running)
+        if anomaly.suppress_actuation:
+            actions = self._suppress_actuation(actions, keep_emergency=not anomaly.invalid_value)
+        if update_state:
+            if ActionType.TURN_ON_FAN in actions:
+                self.fan_commanded_on = True
+            elif ActionType.TURN_OFF_FAN in actions:
+                self.fan_commanded_on = False
+        
+        # 5. Determine alert level - giá trị không phải số đo thật chỉ báo WARNING (lỗi cảm biến);
+        # giá trị trong giới hạn (jump, stuck) giữ nguyên alert level
         alert_level = self._determine_alert_level(combined_risk)
+        if anomaly.invalid_value and alert_level != AlertLevel.SAFE:
+            alert_level = AlertLevel.WARNING
         
-        # 6. Generate intelligent message
+        # 6. Generate intelligent message - theo danh sách actions cuối cùng
         message = self._generate_contextual_message(
             temp_risk, humidity_risk, pet_risk,
-            sensor_data, temp_fuzzy, humidity_fuzzy, pet_fuzzy
+            sensor_data, temp_fuzzy, humidity_fuzzy, pet_fuzzy, actions
         )
         
         # 7. Calculate confidence score
         confidence = self._calculate_confidence(
             temp_risk, humidity_risk, pet_risk,
             sensor_data
-        )
+        ) * anomaly.quality
+        if not anomaly.ok:
+            message = self._anomaly_message(anomaly) + " | " + message
         
         # 8. Create reasoning explanation
         reasoning = {
@@ -215,153 +505,159 @@ class IntelligentDecisionEngine:
                 'temperature': {k: round(v, 3) for k, v in temp_fuzzy.items() if v > 0.1},
                 'humidity': {k: round(v, 3) for k, v in humidity_fuzzy.items() if v > 0.1},
                 'pet_status': {k: round(v, 3) for k, v in pet_fuzzy.items() if v > 0.1}
-            }
+            },
+            'trend_analysis': {
+                name: snapshot.to_dict() for name, snapshot in trends.items() if snapshot
+            },
+            'rule_set_version': rules.version,
+            'data_quality': anomaly.to_dict()
         }
+        if evaluation.trend_boost[0] > 0:
+            reasoning['trend_analysis']['hot_degree_boost'] = round(float(evaluation.trend_boost[0]), 3)
+        if forecast is not None:
+            reasoning['forecast'] = {
+                **self.forecaster.to_dict(rules.forecast_horizon),
+                'hot_degree_forecast': round(float(evaluation.hot_forecast[0]), 3)
+            }
         
         decision = AIDecision(
             alert_level=alert_level,
             actions=actions,
             message=message,
             confidence=confidence,
-            reasoning=reasoning
+            reasoning=reasoning,
+            trace_id=sensor_data.trace_id
         )
         
         # Store in history for learning
-        self.decision_history.append(decision)
-        if len(self.decision_history) > 100:
-            self.decision_history.pop(0)
-        
+        if update_state:
+            self.decision_history.append(decision, sensor_data)
+        
+        if sensor_data.trace_id is not None:
+            elapsed = time.perf_counter() - started
+            tracer.record(sensor_data.trace_id, 'analyze', time.time() - elapsed, elapsed * 1000.0,
+                          cage_id=sensor_data.cage_id, alert_level=alert_level.value,
+                          actions=[a.value for a in actions])
         return decision
     
-    def _calculate_temperature_risk(self, fuzzy_values: Dict[str, float], temp: float) -> Dict:
+    def _calculate_temperature_risk(self, fuzzy_values: Dict[str, float], temp: float,
+                                    risk_score: float, needs_cooling: bool) -> Dict:
         """Tính toán risk score cho nhiệt độ dựa trên fuzzy logic"""
-        # Risk scoring: higher value = more dangerous
-        risk_weights = {
-            'very_cold': 0.9,    # Rất nguy hiểm
-            'cold': 0.7,         # Nguy hiểm
-            'comfortable': 0.0,  # An toàn
-            'warm': 0.6,         # Cần chú ý
-            'very_hot': 1.0      # Cực kỳ nguy hiểm
-        }
-        
-        # Weighted average of fuzzy memberships
-        risk_score = sum(fuzzy_values[k] * risk_weights[k] 
-                        for k in fuzzy_values.keys())
-        
-        # Determine primary state
+        # Risk score = membership · risk weights (tính sẵn trong rule set)
         primary_state = max(fuzzy_values.items(), key=lambda x: x[1])
         
-        needs_fan = fuzzy_values['warm'] > 0.3 or fuzzy_values['very_hot'] > 0.1
-        
         return {
-            'score': risk_score,
+            'score': float(risk_score),
             'primary_state': primary_state[0],
             'membership_value': primary_state[1],
-            'needs_cooling': needs_fan,
+            'needs_cooling': bool(needs_cooling),
             'actual_value': temp
         }
     
-    def _calculate_humidity_risk(self, fuzzy_values: Dict[str, float], humidity: float) -> Dict:
+    def _calculate_humidity_risk(self, fuzzy_values: Dict[str, float], humidity: float,
+                                 risk_score: float) -> Dict:
         """Tính toán risk score cho độ ẩm"""
-        risk_weights = {
-            'very_dry': 0.8,
-            'dry': 0.6,
-            'comfortable': 0.0,
-            'humid': 0.6,
-            'very_humid': 0.9
-        }
-        
-        risk_score = sum(fuzzy_values[k] * risk_weights[k] 
-                        for k in fuzzy_values.keys())
-        
         primary_state = max(fuzzy_values.items(), key=lambda x: x[1])
         
         return {
-            'score': risk_score,
+            'score': float(risk_score),
             'primary_state': primary_state[0],
             'membership_value': primary_state[1],
             'actual_value': humidity
         }
     
     def _calculate_pet_status_risk(self, fuzzy_values: Dict[str, float], 
-                                   sensor_data: SensorData) -> Dict:
+                                   sensor_data: SensorData, risk_score: float) -> Dict:
         """Tính toán risk score cho trạng thái thú cưng"""
-        risk_weights = {
-            'no_detection': 0.9,      # Không phát hiện được - nguy hiểm
-            'empty_cage': 0.3,        # Chuồng trống - cần theo dõi
-            'pet_sleeping': 0.0,      # Ngủ - bình thường
-            'pet_active': 0.0,        # Hoạt động - khỏe mạnh
-            'pet_restless': 0.8       # Mất ngủ/stress - nguy hiểm
-        }
-        
-        risk_score = sum(fuzzy_values[k] * risk_weights[k] 
-                        for k in fuzzy_values.keys())
-        
         primary_state = max(fuzzy_values.items(), key=lambda x: x[1])
         
         return {
-            'score': risk_score,
+            'score': float(risk_score),
             'primary_state': primary_state[0],
             'membership_value': primary_state[1],
             'presence_energy': sensor_data.presence_energy,
             'movement_energy': sensor_data.movement_energy
         }
     
-    def _infer_actions(self, temp_risk: Dict, humidity_risk: Dict, 
-                      pet_risk: Dict, temp_fuzzy: Dict) -> List[ActionType]:
+    def _infer_actions(self, evaluation: RuleEvaluation, i: int,
+                       fan_running: bool = False) -> List[ActionType]:
         """
         Fuzzy inference system để quyết định hành động
-        Sử dụng fuzzy rules thay vì if-else
+        Sử dụng fuzzy rules thay vì if-else - các rule đã được đánh giá
+        vectorized trong rule set, ở đây chỉ ghép thành danh sách action
         """
         actions = []
         
-        # Rule 1: Temperature control với fuzzy logic
-        hot_degree = temp_fuzzy['warm'] * 0.5 + temp_fuzzy['very_hot'] * 1.0
-        if hot_degree > 0.4:  # Fuzzy threshold
+        # Rule 1: Temperature control với fuzzy logic - dùng max(hiện tại, dự báo),
+        # hysteresis: bật khi > fan_on_threshold, tắt khi < fan_off_threshold
+        if evaluation.fan_on[i]:
             actions.append(ActionType.TURN_ON_FAN)
-        elif hot_degree < 0.2 and ActionType.TURN_ON_FAN in actions:
+        elif evaluation.fan_off[i] and fan_running:
             actions.append(ActionType.TURN_OFF_FAN)
         
         # Rule 2: Emergency situations
-        if temp_risk['score'] > 0.8 or pet_risk['score'] > 0.8:
+        if evaluation.emergency[i]:
             actions.append(ActionType.EMERGENCY_ALERT)
-        elif temp_risk['score'] > 0.5 or humidity_risk['score'] > 0.5 or pet_risk['score'] > 0.5:
+        elif evaluation.notify_risk[i]:
             actions.append(ActionType.NOTIFY)
         
         # Rule 3: Pet-specific actions
-        if pet_risk['primary_state'] in ['no_detection', 'pet_restless']:
+        if evaluation.notify_pet[i]:
             actions.append(ActionType.NOTIFY)
         
         return actions if actions else [ActionType.NONE]
     
+    @staticmethod
+    def _suppress_actuation(actions: List[ActionType], keep_emergency: bool = False) -> List[ActionType]:
+        """
+        Dữ liệu nhiệt độ không đáng tin: không bật/tắt quạt.
+        Emergency hạ xuống notify chỉ khi giá trị không phải số đo thật (keep_emergency=False)
+        """
+        kept = []
+        for action in actions:
+            if action in (ActionType.TURN_ON_FAN, ActionType.TURN_OFF_FAN):
+                continue
+            if action == ActionType.EMERGENCY_ALERT and not keep_emergency:
+                action = ActionType.NOTIFY
+            if action not in kept:
+                kept.append(action)
+        if ActionType.NONE in kept and len(kept) > 1:
+            kept.remove(ActionType.NONE)
+        return kept or [ActionType.NOTIFY]
+    
+    @staticmethod
+    def _anomaly_message(anomaly: AnomalyReport) -> str:
+        details = ", ".join(f"{name}: {'/'.join(flags)}" for name, flags in anomaly.flags.items())
+        if anomaly.suppress_actuation:
+            return f"🛠️ Dữ liệu cảm biến không đáng tin ({details}) - AI tạm dừng điều khiển quạt, vui lòng kiểm tra cảm biến!"
+        return f"🛠️ Dữ liệu cảm biến bất thường ({details}) - độ tin cậy giảm."
+    
     def _determine_alert_level(self, combined_risk: float) -> AlertLevel:
         """Xác định mức độ cảnh báo từ risk score"""
-        if combined_risk >= 0.8:
-            return AlertLevel.CRITICAL
-        elif combined_risk >= 0.6:
-            return AlertLevel.DANGER
-        elif combined_risk >= 0.3:
-            return AlertLevel.WARNING
-        else:
-            return AlertLevel.SAFE
+        code = int(self.rules.alert_codes(combined_risk))
+        return ALERT_LEVELS_BY_CODE[code]
     
     def _generate_contextual_message(self, temp_risk: Dict, humidity_risk: Dict,
                                     pet_risk: Dict, sensor_data: SensorData,
                                     temp_fuzzy: Dict, humidity_fuzzy: Dict,
-                                    pet_fuzzy: Dict) -> str:
+                                    pet_fuzzy: Dict, actions: List[ActionType]) -> str:
         """
         Sinh message thông minh dựa trên context và fuzzy analysis
-        Không phải là if-else cứng nhắc mà là contextual reasoning
+        Không phải là if-else cứng nhắc mà là contextual reasoning.
+        Chỉ nói đã bật quạt khi actions (sau anomaly stage) thực sự có turn_on_fan
         """
         messages = []
+        fan_on = ActionType.TURN_ON_FAN in actions
         
         # Temperature contextual message
         if temp_risk['score'] > 0.6:
             temp = sensor_data.temperature
             if temp_fuzzy['very_hot'] > 0.5:
-                messages.append(f"🔥 CẢNH BÁO NGHIÊM TRỌNG: Nhiệt độ {temp}°C - Cực kỳ nóng! AI đã bật quạt khẩn cấp.")
+                action_text = "AI đã bật quạt khẩn cấp." if fan_on else "Vui lòng kiểm tra chuồng ngay!"
+                messages.append(f"🔥 CẢNH BÁO NGHIÊM TRỌNG: Nhiệt độ {temp}°C - Cực kỳ nóng! {action_text}")
             elif temp_fuzzy['warm'] > 0.4:
-                messages.append(f"⚠️ Nhiệt độ {temp}°C - Đang tăng cao, AI đã kích hoạt làm mát.")
+                action_text = ", AI đã kích hoạt làm mát." if fan_on else "."
+                messages.append(f"⚠️ Nhiệt độ {temp}°C - Đang tăng cao{action_text}")
             elif temp_fuzzy['very_cold'] > 0.5:
                 messages.append(f"❄️ CẢNH BÁO: Nhiệt độ {temp}°C - Quá lạnh cho thú cưng!")
             elif temp_fuzzy['cold'] > 0.4:
@@ -422,37 +718,125 @@ class IntelligentDecisionEngine:
         avg_confidence = (temp_confidence + humidity_confidence + pet_confidence) / 3.0
         return min(1.0, avg_confidence * data_quality)
     
+    def analyze_batch(self, temperature, humidity, presence, movement,
+                      timestamps=None, state: Optional[ReplayState] = None) -> BatchDecisions:
+        """
+        Đánh giá vectorized cho N readings (backtest, test hàng loạt).
+        Không tạo message/reasoning và không ghi vào decision_history.
+        
+        state=None: mỗi reading được đánh giá độc lập (không trend/forecast).
+        state=ReplayState: readings là chuỗi thời gian liên tiếp (timestamps tăng dần,
+        giây epoch); trend, forecast và hysteresis quạt được mang qua giữa các lần gọi.
+        """
+        rules = self.rules
+        temperature = np.asarray(temperature, dtype=float)
+        n = len(temperature)
+        
+        if state is not None:
+            timestamps = np.asarray(timestamps, dtype=float)
+            rate = state.slope.update(timestamps, temperature)
+            if rules.forecast_weight > 0:
+                forecast = state.forecaster.update_batch(timestamps, temperature, rules.forecast_horizon)
+            else:
+                forecast = np.full(n, np.nan)
+            fan_running = state.fan_running
+        else:
+            rate = forecast = np.full(n, np.nan)
+            fan_running = False
+        
+        evaluation = rules.evaluate(
+            temperature, humidity, presence, movement,
+            temperature_rate=rate, forecast_temperature=forecast
+        )
+        
+        # Hysteresis quạt: trạng thái = sự kiện bật/tắt gần nhất (forward fill)
+        turn_on = evaluation.fan_on
+        off_candidate = evaluation.fan_off & ~turn_on
+        events = np.where(turn_on, 1, np.where(off_candidate, 0, -1))
+        last_event = np.maximum.accumulate(np.where(events >= 0, np.arange(n), -1)) if n else events
+        running = np.where(last_event >= 0, events[np.maximum(last_event, 0)] == 1, fan_running)
+        previous = np.concatenate([[fan_running], running[:-1]]) if n else running
+        turn_off = off_candidate & previous
+        
+        if state is not None and n:
+            state.fan_running = bool(running[-1])
+        
+        return BatchDecisions(
+            evaluation=evaluation,
+            temperature_rate=rate,
+            forecast=forecast,
+            turn_on_fan=turn_on,
+            turn_off_fan=turn_off,
+            fan_running=running
+        )
+    
+    def decide_batch(self, temperature, humidity, presence, movement) -> List[Dict]:
+        """
+        Quyết định dạng gọn cho N readings độc lập (batch /test_analysis): cùng alert level,
+        actions và confidence như analyze(update_state=False) nhưng đánh giá vectorized,
+        không message/reasoning và không chạm vào decision_history, trend hay forecast.
+        Kiểm tra dữ liệu chỉ gồm phần không phụ thuộc lịch sử (out_of_range, zero).
+        """
+        columns = {
+            'temperature': np.asarray(temperature, dtype=float),
+            'humidity': np.asarray(humidity, dtype=float),
+            'presence_energy': np.asarray(presence, dtype=float),
+            'movement_energy': np.asarray(movement, dtype=float),
+        }
+        batch = self.analyze_batch(columns['temperature'], columns['humidity'],
+                                   columns['presence_energy'], columns['movement_energy'])
+        evaluation = batch.evaluation
+        # check_static chỉ có out_of_range/zero (không có lịch sử) → suppress luôn là giá trị hỏng
+        quality, suppress, flags = self.anomaly_stage.check_static(columns)
+        
+        codes = evaluation.alert_codes.copy()
+        codes[suppress & (codes > 0)] = ALERT_LEVELS_BY_CODE.index(AlertLevel.WARNING)
+        confidence = np.minimum(1.0, (evaluation.temperature_membership.max(axis=1) +
+                                      evaluation.humidity_membership.max(axis=1) +
+                                      evaluation.pet_membership.max(axis=1)) / 3.0) * quality
+        
+        results = []
+        risks = np.round(evaluation.risks, 3).tolist()
+        combined = np.round(evaluation.combined_risk, 3).tolist()
+        for i in range(len(codes)):
+            actions = self._infer_actions(evaluation, i)
+            if suppress[i]:
+                actions = self._suppress_actuation(actions)
+            results.append({
+                "alert_level": ALERT_LEVELS_BY_CODE[codes[i]].value,
+                "actions": [a.value for a in actions],
+                "confidence": round(float(confidence[i]), 3),
+                "combined_risk_score": combined[i],
+                "risk_scores": dict(zip(('temperature', 'humidity', 'pet_status'), risks[i])),
+                "data_quality": {
+                    "quality": round(float(quality[i]), 3),
+                    "flags": flags[i] or {},
+                    "suppress_actuation": bool(suppress[i])
+                }
+            })
+        return results
+    
     def get_statistics(self) -> Dict:
         """Lấy thống kê từ lịch sử quyết định - cho learning"""
         if not self.decision_history:
             return {"message": "No decision history yet"}
         
-        alert_counts = {}
-        action_counts = {}
-        
-        for decision in self.decision_history:
-            alert_counts[decision.alert_level.value] = alert_counts.get(decision.alert_level.value, 0) + 1
-            for action in decision.actions:
-                action_counts[action.value] = action_counts.get(action.value, 0) + 1
-        
-        avg_confidence = sum(d.confidence for d in self.decision_history) / len(self.decision_history)
-        
         return {
             "total_decisions": len(self.decision_history),
-            "alert_distribution": alert_counts,
-            "action_distribution": action_counts,
-            "average_confidence": round(avg_confidence, 3)
+            "alert_distribution": self.decision_history.alert_counts(),
+            "action_distribution": self.decision_history.action_counts(),
+            "average_confidence": round(self.decision_history.mean_confidence(), 3)
         }
 
 
 # Singleton instance
 _ai_engine = None
 
-def get_ai_engine() -> IntelligentDecisionEngine:
+def get_ai_engine(rules_path: Optional[str] = DEFAULT_RULES_PATH) -> IntelligentDecisionEngine:
     """Get hoặc tạo AI engine instance"""
     global _ai_engine
     if _ai_engine is None:
-        _ai_engine = IntelligentDecisionEngine()
+        _ai_engine = IntelligentDecisionEngine(rules_path)
     return _ai_engine
 
 
@@ -4,12 +4,18 @@ PetZone AI Service - Main Integrated Service
 Tích hợp: AI Decision Engine + IoT Controller + Backend Communication + Video Detection
 """
 
+import codecs
+import functools
+import hmac
+import itertools
+import signal
+import sys
 import time
 import requests
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from threading import Thread, Lock
-from flask import Flask, Response, jsonify, request
-from typing import Dict, Optional
+from flask import Flask, Response, g, jsonify, request, stream_with_context
+from typing import Dict, List, Optional, Tuple
 import json
 
 # Import our AI modules
@@ -18,42 +24,247 @@ from ai_decision_engine import (
     SensorData, 
     AIDecision, 
     AlertLevel, 
-    ActionType
+    ActionType,
+    DEFAULT_CAGE_ID
 )
-from iot_controller import get_iot_controller, DeviceType, DeviceState
+from iot_controller import get_iot_controller, IoTController, DeviceCommand, DeviceType, DeviceState
+from cage_registry import get_cage_registry, CageState
+from ingest_queue import IngestQueue, QueueFull
+from async_pipeline import AsyncIOPipeline, IOCall
+from http_client import get_http_client
+from outbox import Outbox
+from scheduler import FixedRateScheduler
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, get_metrics
+import profiler
+from tracing import get_tracer, new_trace_id
+from status_snapshot import SnapshotPublisher
+from event_stream import EventBroker, get_event_broker
+from shared_state import SharedState
+import prefork
+from timeseries_store import TimeSeriesStore, parse_step
+from alert_dedup import AlertDeduplicator, alert_fingerprint
+import fuzzy_rules
+from fuzzy_rules import DEFAULT_RULES_PATH, decision_surface
 
 # Configuration
 BACKEND_API_URL = "http://localhost:5019/api"
 ESP32_IP = "192.168.1.100"  # Thay đổi IP của ESP32 của bạn
-CHECK_INTERVAL = 5  # Kiểm tra mỗi 5 giây
-ALERT_COOLDOWN = 30  # Không gửi alert trùng trong 30s
+CHECK_INTERVAL = 5  # Kiểm tra mỗi 5 giây (lịch cố định theo deadline, không trôi)
+STATS_ROLLUP_INTERVAL = 60  # Giây giữa các lần tính tốc độ (decisions/s, readings/s...)
+DEVICE_RECONCILE_INTERVAL = 30  # Giây giữa các lần gửi lại trạng thái thiết bị ESP32 chưa nhận được
+STATUS_REFRESH_INTERVAL = 5  # Giây giữa các lần publish lại snapshot /status (circuit breaker, is_running)
+ALERT_DEDUP_WINDOW = 600  # Alert cùng fingerprint (level, trạng thái chính, actions) lặp lại trong khoảng này → gộp
+ALERT_DIGEST_INTERVAL = 900  # Giây giữa các digest alert của một burst đang kéo dài
+ALERT_DIGEST_CHECK_INTERVAL = 15  # Giây giữa các lần kiểm tra digest tới hạn / burst đã kết thúc
+RULES_PATH = DEFAULT_RULES_PATH  # Rule set fuzzy (JSON) - tự reload khi file thay đổi
+OVERRIDE_LOG_PATH = "manual_overrides.jsonl"  # Operator overrides - nhãn cho rule_optimizer.py
+TEST_BATCH_CHUNK = 500  # Số reading mỗi lần đánh giá/stream của batch /test_analysis
+CAGE_SHARDS = 16  # Số shard của cage registry (cage → shard theo crc32(cage_id))
+CAGE_WORKERS = 8  # Số worker đánh giá các shard song song mỗi tick
+CAGE_DEVICES = {}  # cage_id → IP ESP32 của cage đó; cage không có ở đây chỉ được cảnh báo
+SENSOR_BATCH_LIMIT = 500  # Số readings tối đa mỗi request /sensor/since (còn nữa → lấy tiếp ngay)
+INGEST_QUEUE_SIZE = 10000  # Số readings tối đa chờ trong hàng đợi /ingest
+INGEST_DROP_POLICY = "drop_oldest"  # Khi đầy: drop_oldest | drop_newest | reject (HTTP 429)
+INGEST_BATCH_MAX = 500  # Số readings tối đa lấy khỏi hàng đợi mỗi lần đánh giá
+POLL_FALLBACK_AFTER = 15  # Chỉ poll backend khi không có push nào trong khoảng này (giây)
+IO_WORKERS = 16  # Thread pool cho các I/O call chạy song song trong một tick
+HTTP_POOL_SIZE = 16  # Kết nối keep-alive tối đa mỗi host (backend, mỗi ESP32) - nên ≥ IO_WORKERS
+HTTP_TIMEOUT = (2.0, 5.0)  # (connect, read) giây cho mọi request ra ngoài
+BREAKER_FAILURE_THRESHOLD = 3  # Lỗi liên tiếp tới một host (backend, ESP32) → ngắt mạch, fail fast
+BREAKER_RESET_TIMEOUT = 30  # Giây ngắt mạch trước khi gửi request thử (half-open)
+IO_DEADLINES = {  # Deadline (giây) cho từng loại I/O call - tick không đợi quá call chậm nhất
+    'backend.fetch': 3.0,
+    'esp32': 2.0,
+    'backend.device_log': 3.0,
+    'backend.alert': 3.0,
+    'backend.emergency': 4.0,
+}
+OUTBOX_PATH = "outbox.db"  # SQLite outbox cho alert/emergency/log thiết bị (gửi lại khi backend down)
+OUTBOX_BATCH_SIZE = 100  # Số event tối đa mỗi request /batch tới backend
+OUTBOX_MAX_BACKOFF = 60  # Backoff tối đa (giây) giữa các lần retry khi backend lỗi
+ADMIN_TOKEN = None  # Nếu đặt: /admin/* yêu cầu header X-Admin-Token bằng giá trị này; không đặt: chỉ localhost
+ADMIN_LOOPBACK = ('127.0.0.1', '::1')  # Client được gọi /admin/* khi chưa đặt ADMIN_TOKEN
+SPAN_LOG_PATH = "tick_spans.log"  # File span log mỗi tick (bật qua POST /admin/span_log)
+SPAN_LOG_MAX_BYTES = 5 * 1024 * 1024  # Xoay vòng span log khi vượt kích thước này
+SPAN_LOG_BACKUPS = 3  # Số file span log cũ giữ lại
+EVENT_CLIENT_QUEUE = 64  # Event tối đa chờ gửi cho mỗi client /events (đầy → ngắt client chậm)
+EVENT_MAX_CLIENTS = 100  # Số client /events đồng thời tối đa (mỗi client giữ một thread Flask)
+EVENT_HEARTBEAT = 15  # Giây im lặng trước khi gửi comment keepalive (giữ kết nối qua proxy)
+EVENT_ALLOW_ORIGIN = "*"  # Access-Control-Allow-Origin của /events (frontend chạy ở origin khác)
+HTTP_WORKERS = 1  # > 1: N worker process phục vụ HTTP, monitoring chạy ở một process riêng (prefork.py)
+INTERNAL_PORT = 5002  # Port (127.0.0.1) của process monitoring - worker proxy các route không chia sẻ tới đây
+SHARED_STATE_CAPACITY = 1024 * 1024  # Bytes tối đa mỗi slot shared memory (status, stats, command_history)
+SHARED_PUBLISH_INTERVAL = 1  # Giây giữa các lần publish /stats và /command_history cho worker
+HISTORY_DIR = "history"  # Thư mục time-series store (readings + decisions, rollup 1m/1h); None → tắt
+HISTORY_RAW_SEGMENTS = 16  # Số segment raw giữ lại (65536 readings mỗi segment)
+HISTORY_ROLLUP_SEGMENTS = 64  # Số segment rollup giữ lại cho mỗi độ phân giải
+HISTORY_FLUSH_INTERVAL = 60  # Giây giữa các lần ghi rollup của bucket đã hết giờ + flush mmap
+HISTORY_MAX_POINTS = 1000  # Số điểm tối đa mỗi response /history
 
 # Flask app
 app = Flask(__name__)
 
+# /events: decision, trạng thái thiết bị, alert - serialize một lần, fan-out tới mọi client
+events = get_event_broker()
+
+# Trace ID mỗi reading: span fetch/ingest → analyze → ESP32/log → alert (xem tracing.py)
+tracer = get_tracer()
+
+# Metrics cho /metrics (ghi nhận trong hot path: một bisect + vài phép cộng)
+metrics = get_metrics()
+STAGE_SECONDS = metrics.histogram(
+    'petzone_stage_duration_seconds', 'Thời gian mỗi stage của tick (fetch, analyze, execute, alert, log)',
+    ('stage',))
+
 # Global state
 ai_engine = None
 iot_controller = None
 last_decision = None
 last_sensor_data = None
-last_alert_time = {}
 state_lock = Lock()
 is_running = False
+shared_state: Optional[SharedState] = None  # Chỉ có ở process monitoring khi HTTP_WORKERS > 1
+
+
+def _status_state() -> Dict:
+    """Nội dung /status (phía writer - monitoring loop, manual control)"""
+    with state_lock:
+        decision, sensor_data = last_decision, last_sensor_data
+    return {
+        "ai_service": {
+            "is_running": ai_service.is_running if ai_service else False,
+            "last_decision": decision.to_dict() if decision else None,
+            "last_sensor_data": {
+                "temperature": sensor_data.temperature,
+                "humidity": sensor_data.humidity,
+                "presence_energy": sensor_data.presence_energy,
+                "movement_energy": sensor_data.movement_energy,
+                "timestamp": sensor_data.timestamp.isoformat()
+            } if sensor_data else None
+        },
+        "iot_devices": iot_controller.get_all_device_states() if iot_controller else {},
+        "circuit_breakers": ai_service.http.breaker_states() if ai_service else {}
+    }
+
+
+def publish_status():
+    """Serialize và swap snapshot /status (chỉ tăng version khi nội dung đổi)"""
+    snapshot = status_snapshot.publish(_status_state())
+    if shared_state is not None:
+        # Worker trả bytes này nguyên vẹn: "<etag>\n<body>"
+        shared_state.publish('status', snapshot.etag.encode('ascii') + b'\n' + snapshot.body, snapshot.version)
+    return snapshot
+
+
+def publish_shared_state():
+    """Serialize /stats và /command_history một lần cho mọi worker (chế độ HTTP_WORKERS > 1)"""
+    if shared_state is None or not ai_service:
+        return
+    shared_state.publish('stats', app.json.dumps(ai_service.get_stats()).encode('utf-8'))
+    shared_state.publish('command_history', app.json.dumps(
+        {"history": iot_controller.get_command_history(20)}).encode('utf-8'))
+
+
+# /status trả snapshot đã serialize sẵn - request không lấy lock, không encode JSON
+status_snapshot = SnapshotPublisher()
 
 
 class AIService:
     """Main AI Service orchestrator"""
     
     def __init__(self):
-        self.ai_engine = get_ai_engine()
-        self.iot_controller = get_iot_controller(ESP32_IP, BACKEND_API_URL)
+        self.ai_engine = get_ai_engine(RULES_PATH)
+        # Mọi request ra ngoài (backend, ESP32) dùng chung session có keep-alive pool
+        self.http = get_http_client(pool_maxsize=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT,
+                                    breaker_threshold=BREAKER_FAILURE_THRESHOLD,
+                                    breaker_reset=BREAKER_RESET_TIMEOUT)
+        # Alert/emergency/log thiết bị ghi vào outbox trước, gửi batch khi backend sẵn sàng
+        self.outbox = Outbox(OUTBOX_PATH, BACKEND_API_URL, self.http,
+                             batch_size=OUTBOX_BATCH_SIZE, max_backoff=OUTBOX_MAX_BACKOFF)
+        # Lịch sử readings + decisions (memmap, rollup 1m/1h) cho /history
+        self.history = TimeSeriesStore(HISTORY_DIR, raw_segments=HISTORY_RAW_SEGMENTS,
+                                       rollup_segments=HISTORY_ROLLUP_SEGMENTS) if HISTORY_DIR else None
+        self.iot_controller = get_iot_controller(ESP32_IP, BACKEND_API_URL, self.http, self.outbox)
+        # Mỗi cage một engine riêng, dùng chung rule set với engine mặc định
+        self.registry = get_cage_registry(
+            self.ai_engine.rule_source,
+            shards=CAGE_SHARDS,
+            workers=CAGE_WORKERS,
+            controller_factory=self._controller_for_cage
+        )
+        self.registry.register(DEFAULT_CAGE_ID, self.ai_engine, self.iot_controller)
+        # Alert/emergency trùng điều kiện chỉ gửi lần đầu, phần lặp lại gộp thành digest
+        self.alerts = AlertDeduplicator(ALERT_DEDUP_WINDOW, ALERT_DIGEST_INTERVAL)
+        self._stats_lock = Lock()
         self.is_running = False
         self.stats = {
             'decisions_made': 0,
             'actions_executed': 0,
             'alerts_sent': 0,
+            'readings_fetched': 0,
+            'empty_polls': 0,
             'started_at': None
         }
+        # Cursor ingestion: id (hoặc createdAt) của reading mới nhất đã xử lý
+        self.cursor = {'last_id': None, 'last_created_at': None, 'has_more': False}
+        self._since_supported = True
+        self._cursor_lock = Lock()
+        self._push_gap: Optional[int] = None  # Id nhỏ nhất bị drop ở /ingest - cursor dừng trước nó
+        self._latest_in_batch: Dict[str, SensorData] = {}
+        # Push ingestion (/ingest); polling backend chỉ là fallback
+        self.ingest_queue = IngestQueue(INGEST_QUEUE_SIZE, INGEST_DROP_POLICY)
+        # I/O của mỗi tick (fetch, ESP32, log, alert) chạy song song với deadline
+        self.io = AsyncIOPipeline(IO_WORKERS)
+        self._pending_io: List[IOCall] = []
+        # Các tác vụ định kỳ chạy theo lịch fixed-rate trên monitoring thread
+        self.rates: Dict[str, float] = {}
+        self._rollup_prev: Optional[Tuple[float, Dict[str, int]]] = None
+        self.scheduler = FixedRateScheduler()
+        self.scheduler.add('sensor', CHECK_INTERVAL, self._sensor_tick, overrun='skip')
+        self.scheduler.add('ingest', CHECK_INTERVAL, self._ingest_tick, overrun='skip')
+        self.scheduler.add('stats_rollup', STATS_ROLLUP_INTERVAL, self._rollup_stats, overrun='merge')
+        self.scheduler.add('device_reconcile', DEVICE_RECONCILE_INTERVAL, self._reconcile_devices,
+                           overrun='skip', start_delay=DEVICE_RECONCILE_INTERVAL)
+        self.scheduler.add('alert_digest', ALERT_DIGEST_CHECK_INTERVAL, self._flush_alert_digests,
+                           overrun='merge')
+        self.scheduler.add('status_snapshot', STATUS_REFRESH_INTERVAL, publish_status, overrun='skip')
+        if self.history is not None:
+            self.scheduler.add('history_flush', HISTORY_FLUSH_INTERVAL,
+                               lambda: self.history.flush_stale(time.time()), overrun='merge')
+        if shared_state is not None:
+            self.scheduler.add('shared_state', SHARED_PUBLISH_INTERVAL, publish_shared_state, overrun='skip')
+        self._register_metrics()
+    
+    def _register_metrics(self):
+        """Metrics lấy giá trị lúc scrape: bộ đếm, độ sâu hàng đợi, cache hit/miss"""
+        metrics.callback('petzone_events_total', 'Bộ đếm của AI service',
+                         lambda: [((key,), value) for key, value in self.stats.items()
+                                  if isinstance(value, int)],
+                         ('event',), kind='counter')
+        metrics.callback('petzone_queue_depth', 'Số phần tử đang chờ trong các hàng đợi',
+                         lambda: [(('ingest',), len(self.ingest_queue)),
+                                  (('outbox',), self.outbox.pending())], ('queue',))
+        metrics.callback('petzone_ingest_dropped_total', 'Readings bị bỏ bởi drop policy của /ingest',
+                         lambda: [((policy,), self.ingest_queue.stats[key]) for policy, key in
+                                  (('drop_oldest', 'dropped_oldest'), ('drop_newest', 'dropped_newest'),
+                                   ('reject', 'rejected'))],
+                         ('policy',), kind='counter')
+        metrics.callback('petzone_outbox_dead_events', 'Event outbox bị backend từ chối (dead)',
+                         lambda: [((), self.outbox.stats['dead'])])
+        metrics.callback('petzone_cache_requests_total', 'Lookup cache của engine theo kết quả',
+                         lambda: [((cache, result), stats[result])
+                                  for cache, stats in (('compiled_rules', fuzzy_rules.cache_stats),
+                                                       ('decision_surface', fuzzy_rules.surface_cache_stats))
+                                  for result in ('hits', 'misses')],
+                         ('cache', 'result'), kind='counter')
+        metrics.callback('petzone_circuit_open', 'Circuit breaker đang mở (1) theo downstream host',
+                         lambda: [((host,), int(state['state'] != 'closed'))
+                                  for host, state in self.http.breaker_states().items()], ('host',))
+        metrics.callback('petzone_alerts_total', 'Alert/emergency theo kết quả dedup',
+                         lambda: [((result,), self.alerts.stats[result])
+                                  for result in ('sent', 'suppressed', 'digests')],
+                         ('result',), kind='counter')
+        metrics.callback('petzone_cages', 'Số cage đang theo dõi', lambda: [((), len(self.registry))])
     
     def start(self):
         """Start AI service"""
@@ -64,9 +275,16 @@ class AIService:
         print("="*70)
         print(f"Backend API: {BACKEND_API_URL}")
         print(f"ESP32 IP: {ESP32_IP}")
-        print(f"Check Interval: {CHECK_INTERVAL}s")
+        print(f"Check Interval: {CHECK_INTERVAL}s (stats rollup {STATS_ROLLUP_INTERVAL}s, "
+              f"device reconcile {DEVICE_RECONCILE_INTERVAL}s)")
+        print(f"Cage Shards: {CAGE_SHARDS} ({CAGE_WORKERS} workers)")
+        print(f"Ingest Queue: {INGEST_QUEUE_SIZE} ({INGEST_DROP_POLICY}), poll fallback after {POLL_FALLBACK_AFTER}s")
+        print(f"Outbox: {OUTBOX_PATH} ({self.outbox.pending()} pending)")
         print("="*70 + "\n")
         
+        self.outbox.start()
+        publish_status()
+        
         # Start monitoring thread
         monitor_thread = Thread(target=self._monitoring_loop, daemon=True)
         monitor_thread.start()
@@ -74,74 +292,200 @@ class AIService:
     def stop(self):
         """Stop AI service"""
         self.is_running = False
+        self.scheduler.stop()
+        self.registry.shutdown()
+        self.io.shutdown()
+        self.outbox.close()
+        if self.history is not None:
+            self.history.close()
+        publish_status()
         print("\n🛑 AI Service stopped")
     
     def _monitoring_loop(self):
         """Main monitoring loop - đây là trái tim của AI system"""
+        # Mỗi task chạy tại start + k * interval (không cộng dồn thời gian xử lý);
+        # lỗi trong task được scheduler bắt và ghi nhận, không dừng vòng lặp
+        self.scheduler.run(lambda: self.is_running)
+    
+    def _sensor_tick(self):
+        """Fallback: poll backend khi không có push nào gần đây"""
+        if self.ingest_queue.idle_for() < POLL_FALLBACK_AFTER:
+            return
+        self.poll_once()
+        
+        # Còn readings tồn đọng (sau khi mất kết nối...) → lấy tiếp ngay
+        if self.cursor['has_more']:
+            self.scheduler.trigger('sensor')
+    
+    def _ingest_tick(self):
+        """Đánh giá readings được push tới /ingest (/ingest trigger task này ngay khi có dữ liệu)"""
+        pushed = self.ingest_queue.drain(INGEST_BATCH_MAX, timeout=0)
+        if pushed:
+            self.process_readings(pushed)
+        if len(self.ingest_queue):
+            self.scheduler.trigger('ingest')
+    
+    def _rollup_stats(self):
+        """Tính tốc độ (mỗi giây) của các bộ đếm kể từ lần rollup trước"""
+        now = time.monotonic()
+        with self._stats_lock:
+            counters = {key: self.stats[key] for key in
+                        ('decisions_made', 'actions_executed', 'alerts_sent', 'readings_fetched')}
+        counters['readings_pushed'] = self.ingest_queue.stats['drained']
+        if self._rollup_prev:
+            prev_time, prev = self._rollup_prev
+            elapsed = now - prev_time
+            self.rates = {f"{key}_per_s": round((value - prev[key]) / elapsed, 3)
+                          for key, value in counters.items()}
+        self._rollup_prev = (now, counters)
+    
+    def _reconcile_devices(self):
+        """Gửi lại trạng thái mong muốn tới các ESP32 chưa nhận được lệnh gần nhất"""
+        controllers = {id(cage.iot_controller): cage.iot_controller
+                       for cage in self.registry.cages() if cage.iot_controller}
+        calls = [self._io_call(name, fn) for controller in controllers.values()
+                 for name, fn in controller.reconcile_calls()]
+        if calls:
+            print(f"🔁 Reconciling {len(calls)} device state(s)")
+            self.io.run(calls)
+    
+    def poll_once(self) -> int:
+        """
+        Một vòng poll: lấy mọi reading mới kể từ cursor và phân tích cả batch.
+        Không có gì mới → không chạy engine. Trả về số readings đã xử lý.
+        """
+        # 1. Fetch new sensor data from backend (một hoặc nhiều cage), có deadline
+        fetch_start = time.time()
+        fetched = self.io.call('backend.fetch', self._request_readings, IO_DEADLINES['backend.fetch'])
+        STAGE_SECONDS.labels('fetch').observe(fetched.elapsed_ms / 1000.0)
+        readings = self._accept_readings(fetched.value if fetched.ok else None)
+        for reading in readings:
+            tracer.record(reading.trace_id, 'fetch', fetch_start, fetched.elapsed_ms,
+                          cage_id=reading.cage_id, batch=len(readings))
+        
+        if not readings:
+            self.stats['empty_polls'] += 1
+            if self.cursor['last_id'] is None and self.cursor['last_created_at'] is None:
+                print("⚠️ No sensor data available, waiting...")
+            return 0
+        
+        return self.process_readings(readings)
+    
+    def process_readings(self, readings: List[SensorData]) -> int:
+        """
+        Phân tích một batch readings (poll hoặc push): mỗi cage theo thứ tự thời gian trên
+        worker của shard; actions/alert chỉ thực thi cho reading mới nhất của mỗi cage.
+        Decide (đồng bộ, không I/O) rồi mới chạy mọi I/O call của batch song song.
+        """
+        started = time.perf_counter()
+        self._latest_in_batch = {r.cage_id: r for r in readings}
+        self._pending_io = []
+        results = self.registry.evaluate(readings, self._handle_decision)
+        analyzed = time.perf_counter()
+        STAGE_SECONDS.labels('analyze').observe(analyzed - started)
+        self.ingest_queue.record_throughput(len(readings), analyzed - started)
+        
+        calls, self._pending_io = self._pending_io, []
+        if calls:
+            self.io.run(calls)
+            STAGE_SECONDS.labels('execute').observe(time.perf_counter() - analyzed)
+        # Một lần serialize mỗi tick (sau khi lệnh thiết bị đã chạy), không phải mỗi request /status
+        publish_status()
+        if profiler.span_log_enabled():
+            profiler.log_span('tick', readings=len(readings), cages=len(self._latest_in_batch),
+                              analyze_ms=round((analyzed - started) * 1000.0, 3),
+                              execute_ms=round((time.perf_counter() - analyzed) * 1000.0, 3),
+                              io_calls=len(calls))
+        
+        if len(readings) > 1:
+            tick = self.registry.tick_stats
+            print(f"🐾 Evaluated {len(results)} readings "
+                  f"({len(self._latest_in_batch)} cages) in {tick['last_tick_ms']} ms")
+        return len(results)
+    
+    def _handle_decision(self, cage: CageState, sensor_data: SensorData, decision: AIDecision):
+        """Xử lý decision của một cage (chạy trên worker của shard chứa cage)"""
         global last_decision, last_sensor_data
+        self._count('decisions_made', cage=None)
+        if self.history is not None:
+            self.history.append(sensor_data, decision)
         
-        while self.is_running:
-            try:
-                # 1. Fetch latest sensor data from backend
-                sensor_data = self._fetch_sensor_data()
-                
-                if sensor_data is None:
-                    print("⚠️ No sensor data available, waiting...")
-                    time.sleep(CHECK_INTERVAL)
-                    continue
-                
-                # 2. AI analyze sensor data
-                decision = self.ai_engine.analyze(sensor_data)
-                self.stats['decisions_made'] += 1
-                
-                # 3. Execute actions based on AI decision
-                self._execute_decision(decision, sensor_data)
-                
-                # 4. Send alert to backend if needed
-                if decision.alert_level != AlertLevel.SAFE:
-                    self._send_alert(decision, sensor_data)
-                
-                # 5. Update global state
-                with state_lock:
-                    last_decision = decision
-                    last_sensor_data = sensor_data
-                
-                # 6. Log decision
-                self._log_decision(decision, sensor_data)
-                
-                # Wait before next check
-                time.sleep(CHECK_INTERVAL)
-                
-            except Exception as e:
-                print(f"❌ Error in monitoring loop: {e}")
-                import traceback
-                traceback.print_exc()
-                time.sleep(CHECK_INTERVAL)
-    
-    def _fetch_sensor_data(self) -> Optional[SensorData]:
-        """Lấy dữ liệu cảm biến mới nhất từ backend"""
-        try:
-            response = requests.get(
-                f"{BACKEND_API_URL}/sensor/latest",
-                timeout=5
-            )
+        # Reading cũ hơn trong cùng batch: chỉ cập nhật state của engine (trend, history)
+        if self._latest_in_batch.get(cage.cage_id, sensor_data) is not sensor_data:
+            return
+        
+        # 3. Plan actions based on AI decision (chạy sau, song song với các cage khác)
+        calls = self._plan_actions(decision, sensor_data, cage)
+        
+        # 4. Send alert to backend if needed
+        if decision.alert_level != AlertLevel.SAFE:
+            calls.append(self._io_call('backend.alert', self._send_alert, decision, sensor_data, cage))
+        self._pending_io.extend(calls)
+        
+        events.publish('decision', {
+            **decision.to_dict(),
+            'cage_id': cage.cage_id,
+            'sensor_data': {
+                'temperature': sensor_data.temperature,
+                'humidity': sensor_data.humidity,
+                'presence_energy': sensor_data.presence_energy,
+                'movement_energy': sensor_data.movement_energy,
+                'timestamp': sensor_data.timestamp.isoformat()
+            }
+        })
+        
+        # 5. Update global state (/status hiển thị cage mặc định)
+        if cage.cage_id == DEFAULT_CAGE_ID or len(self.registry) == 1:
+            with state_lock:
+                last_decision = decision
+                last_sensor_data = sensor_data
             
-            if response.status_code == 200:
-                data = response.json()
-                
-                sensor_data = SensorData(
-                    temperature=float(data.get('temperature', 0)),
-                    humidity=float(data.get('humidity', 0)),
-                    presence_energy=int(data.get('presenceEnergy', 0)),
-                    movement_energy=int(data.get('movementEnergy', 0)),
-                    timestamp=datetime.fromisoformat(data['createdAt'].replace('Z', '+00:00'))
-                        if 'createdAt' in data else datetime.now()
+            # 6. Log decision
+            self._log_decision(decision, sensor_data)
+    
+    def _count(self, key: str, cage: Optional[CageState]):
+        """Tăng thống kê của service (và của cage nếu có) - gọi từ nhiều worker"""
+        with self._stats_lock:
+            self.stats[key] += 1
+        if cage is not None:
+            cage.stats[key] += 1
+    
+    def _controller_for_cage(self, cage_id: str) -> Optional[IoTController]:
+        """Controller thiết bị cho cage mới (None nếu cage chưa gắn ESP32)"""
+        if cage_id in CAGE_DEVICES:
+            return IoTController(CAGE_DEVICES[cage_id], BACKEND_API_URL, self.http, self.outbox)
+        return None
+    
+    def _request_readings(self) -> Optional[Tuple[List[Dict], bool]]:
+        """
+        Request readings mới kể từ cursor bằng /sensor/since (chỉ I/O, không dời cursor).
+        Lần đầu (chưa có cursor) hoặc backend chưa có /sensor/since: dùng /sensor/latest
+        (object hoặc list readings có cageId). Trả về (items, has_more), None khi lỗi.
+        """
+        try:
+            if self.cursor['last_id'] is not None and self._since_supported:
+                response = self.http.get(
+                    f"{BACKEND_API_URL}/sensor/since",
+                    params={'afterId': self.cursor['last_id'], 'limit': SENSOR_BATCH_LIMIT}
                 )
-                
-                return sensor_data
-            else:
+                if response.status_code == 200:
+                    page = response.json()
+                    return page.get('readings', []), bool(page.get('hasMore'))
+                elif response.status_code == 404:
+                    print("⚠️ Backend has no /sensor/since - falling back to /sensor/latest")
+                    self._since_supported = False
+                else:
+                    print(f"⚠️ Backend returned {response.status_code}")
+                    return None
+            
+            response = self.http.get(f"{BACKEND_API_URL}/sensor/latest")
+            if response.status_code == 404:
+                return [], False  # Chưa có dữ liệu nào
+            if response.status_code != 200:
                 print(f"⚠️ Backend returned {response.status_code}")
                 return None
+            data = response.json()
+            return (data if isinstance(data, list) else [data]), False
                 
         except requests.exceptions.ConnectionError:
             print(f"⚠️ Cannot connect to backend at {BACKEND_API_URL}")
@@ -150,12 +494,94 @@ class AIService:
             print(f"❌ Error fetching sensor data: {e}")
             return None
     
-    def _execute_decision(self, decision: AIDecision, sensor_data: SensorData):
-        """Execute actions từ AI decision"""
+    def _accept_readings(self, page: Optional[Tuple[List[Dict], bool]]) -> List[SensorData]:
+        """Dời cursor qua các item mới và parse thành SensorData (chỉ khi request hoàn tất)"""
+        items, self.cursor['has_more'] = page or ([], False)
+        if not items:
+            return []
+        with self._cursor_lock:
+            items = self._advance_cursor(items)
+        readings = []
+        for item in items:
+            try:
+                readings.append(self._parse_reading(item))
+            except (ValueError, TypeError, KeyError) as e:
+                print(f"⚠️ Skipping invalid reading {item.get('id')}: {e}")
+        self.stats['readings_fetched'] += len(readings)
+        return readings
+    
+    def _fetch_readings(self) -> List[SensorData]:
+        """Lấy readings mới kể từ cursor (đồng bộ, không deadline)"""
+        return self._accept_readings(self._request_readings())
+    
+    def _advance_cursor(self, items: List[Dict]) -> List[Dict]:
+        """Giữ các reading sau cursor (theo id, hoặc createdAt nếu backend không trả id) và dời cursor"""
+        cursor = self.cursor
+        last_id, last_created_at = cursor['last_id'], cursor['last_created_at']
+        fresh = []
+        for item in items:
+            item_id, created_at = item.get('id'), item.get('createdAt')
+            if item_id is not None:
+                if last_id is not None and item_id <= last_id:
+                    continue
+                cursor['last_id'] = max(item_id, cursor['last_id'] or item_id)
+            elif not created_at or (last_created_at is not None and created_at <= last_created_at):
+                continue
+            if created_at and (cursor['last_created_at'] is None or created_at > cursor['last_created_at']):
+                cursor['last_created_at'] = created_at
+            fresh.append(item)
+        if self._push_gap is not None and (cursor['last_id'] or 0) >= self._push_gap:
+            self._push_gap = None  # Poll fallback đã lấy lại readings bị drop
+        return fresh
+    
+    def note_pushed(self, items: List[Dict], dropped: List[Dict] = ()):
+        """
+        Readings push từ backend (có id) đã vào hàng đợi dời cursor để poll fallback không
+        xử lý lại. Reading bị drop giữ cursor trước id của nó để poll fallback lấy lại được.
+        """
+        ids = [item['id'] for item in items if isinstance(item.get('id'), int)]
+        dropped_ids = [item['id'] for item in dropped if isinstance(item.get('id'), int)]
+        with self._cursor_lock:
+            if dropped_ids:
+                self._push_gap = min(dropped_ids + ([self._push_gap] if self._push_gap is not None else []))
+            if ids:
+                last_id = max(ids)
+                if self._push_gap is not None:
+                    last_id = min(last_id, self._push_gap - 1)
+                self.cursor['last_id'] = max(last_id, self.cursor['last_id'] or 0)
+    
+    @staticmethod
+    def _parse_reading(data: Dict) -> SensorData:
+        return SensorData(
+            temperature=float(data.get('temperature', 0)),
+            humidity=float(data.get('humidity', 0)),
+            presence_energy=int(data.get('presenceEnergy', data.get('presence_energy', 0))),
+            movement_energy=int(data.get('movementEnergy', data.get('movement_energy', 0))),
+            timestamp=datetime.fromisoformat(data['createdAt'].replace('Z', '+00:00'))
+                if data.get('createdAt') else datetime.now(),
+            cage_id=str(data.get('cageId') or data.get('cage_id') or DEFAULT_CAGE_ID),
+            trace_id=str(data.get('traceId') or data.get('trace_id') or new_trace_id())
+        )
+    
+    def _plan_actions(self, decision: AIDecision, sensor_data: SensorData,
+                      cage: Optional[CageState] = None) -> List[IOCall]:
+        """Chuyển actions thành các I/O call (ESP32, log backend, emergency) - không tự gọi mạng"""
+        controller = cage.iot_controller if cage else self.iot_controller
+        calls = []
         for action in decision.actions:
+            if action in (ActionType.TURN_ON_FAN, ActionType.TURN_OFF_FAN) and controller is None:
+                print(f"\n📢 Cage {sensor_data.cage_id}: {action.value} (chưa gắn thiết bị)")
+                continue
+            
             if action == ActionType.TURN_ON_FAN:
-                # Tính fan intensity dựa trên nhiệt độ (AI adaptive control)
+                # Tính fan intensity dựa trên nhiệt độ (AI adaptive control),
+                # dùng nhiệt độ dự báo nếu cao hơn để quạt chạy đủ mạnh từ sớm
                 temp = sensor_data.temperature
+                reason = f"Temperature {temp}°C - AI auto control"
+                predicted = decision.reasoning.get('forecast', {}).get('predicted_temperature')
+                if predicted is not None and predicted > temp:
+                    temp = predicted
+                    reason = f"Temperature {sensor_data.temperature}°C (forecast {predicted}°C) - AI auto control"
                 if temp >= 35:
                     intensity = 100
                 elif temp >= 32:
@@ -164,98 +590,111 @@ class AIService:
                     intensity = 60
                 
                 print(f"\n🌀 AI Decision: Turn ON fan (intensity={intensity}%)")
-                result = self.iot_controller.turn_on_fan(
-                    intensity=intensity,
-                    reason=f"Temperature {temp}°C - AI auto control"
-                )
-                self.stats['actions_executed'] += 1
+                command = DeviceCommand(DeviceType.FAN, DeviceState.ON, intensity=intensity, reason=reason,
+                                        trace_id=decision.trace_id)
+                calls.extend(self._io_call(name, fn) for name, fn in controller.command_calls(command))
+                self._count('actions_executed', cage)
                 
             elif action == ActionType.TURN_OFF_FAN:
                 print(f"\n❄️ AI Decision: Turn OFF fan")
-                result = self.iot_controller.turn_off_fan(
-                    reason="Temperature normalized - AI auto control"
-                )
-                self.stats['actions_executed'] += 1
+                command = DeviceCommand(DeviceType.FAN, DeviceState.OFF,
+                                        reason="Temperature normalized - AI auto control",
+                                        trace_id=decision.trace_id)
+                calls.extend(self._io_call(name, fn) for name, fn in controller.command_calls(command))
+                self._count('actions_executed', cage)
                 
             elif action == ActionType.EMERGENCY_ALERT:
                 print(f"\n🚨 AI Decision: EMERGENCY ALERT!")
-                self._send_emergency_alert(decision, sensor_data)
-                self.stats['alerts_sent'] += 1
+                calls.append(self._io_call('backend.emergency', self._send_emergency_alert, decision, sensor_data))
+                self._count('alerts_sent', cage)
                 
             elif action == ActionType.NOTIFY:
                 print(f"\n📢 AI Decision: Send notification")
-                self.stats['alerts_sent'] += 1
+                self._count('alerts_sent', cage)
+        return calls
+    
+    @staticmethod
+    def _io_call(name: str, fn, *args) -> IOCall:
+        return IOCall(name, functools.partial(fn, *args) if args else fn, IO_DEADLINES.get(name, 3.0))
     
-    def _send_alert(self, decision: AIDecision, sensor_data: SensorData):
-        """Gửi alert tới backend với cooldown để tránh spam"""
-        alert_key = f"{decision.alert_level.value}"
+    def _send_alert(self, decision: AIDecision, sensor_data: SensorData,
+                    cage: Optional[CageState] = None):
+        """Gửi alert tới backend; alert trùng điều kiện với burst đang mở được gộp vào digest"""
+        payload = {
+            "alertLevel": decision.alert_level.value,
+            "message": decision.message,
+            "confidence": decision.confidence,
+            "sensorData": {
+                "temperature": sensor_data.temperature,
+                "humidity": sensor_data.humidity,
+                "presenceEnergy": sensor_data.presence_energy,
+                "movementEnergy": sensor_data.movement_energy
+            },
+            "reasoning": decision.reasoning,
+            "cageId": sensor_data.cage_id,
+            "traceId": decision.trace_id,
+            "timestamp": datetime.now().isoformat()
+        }
         
-        # Check cooldown
-        if alert_key in last_alert_time:
-            time_since_last = (datetime.now() - last_alert_time[alert_key]).total_seconds()
-            if time_since_last < ALERT_COOLDOWN:
-                return  # Skip alert due to cooldown
+        if not self._admit_alert("ai/alert", decision, sensor_data, payload):
+            return
         
-        try:
-            payload = {
-                "alertLevel": decision.alert_level.value,
-                "message": decision.message,
-                "confidence": decision.confidence,
-                "sensorData": {
-                    "temperature": sensor_data.temperature,
-                    "humidity": sensor_data.humidity,
-                    "presenceEnergy": sensor_data.presence_energy,
-                    "movementEnergy": sensor_data.movement_energy
-                },
-                "reasoning": decision.reasoning,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            response = requests.post(
-                f"{BACKEND_API_URL}/ai/alert",
-                json=payload,
-                timeout=5
-            )
-            
-            if response.status_code in [200, 201]:
-                print(f"✅ Alert sent to backend")
-                last_alert_time[alert_key] = datetime.now()
-            else:
-                print(f"⚠️ Failed to send alert: {response.status_code}")
-                
-        except Exception as e:
-            print(f"❌ Error sending alert: {e}")
+        # Outbox đảm bảo alert tới backend (retry nếu backend down)
+        with tracer.span(decision.trace_id, 'alert.enqueue', alert_level=decision.alert_level.value):
+            self.outbox.enqueue("ai/alert", payload)
+        events.publish('alert', payload)
+        print(f"✅ Alert queued for backend")
     
     def _send_emergency_alert(self, decision: AIDecision, sensor_data: SensorData):
-        """Gửi emergency alert (không có cooldown)"""
-        try:
-            payload = {
-                "alertType": "EMERGENCY",
-                "alertLevel": decision.alert_level.value,
-                "message": decision.message,
-                "confidence": decision.confidence,
-                "sensorData": {
-                    "temperature": sensor_data.temperature,
-                    "humidity": sensor_data.humidity,
-                    "presenceEnergy": sensor_data.presence_energy,
-                    "movementEnergy": sensor_data.movement_energy
-                },
-                "actions": [a.value for a in decision.actions],
-                "reasoning": decision.reasoning,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            response = requests.post(
-                f"{BACKEND_API_URL}/ai/emergency",
-                json=payload,
-                timeout=5
-            )
-            
-            if response.status_code in [200, 201]:
-                print(f"🚨 Emergency alert sent!")
-            
-        except Exception as e:
-            print(f"❌ Error sending emergency: {e}")
+        """Gửi emergency alert (ngay lập tức, trừ khi trùng điều kiện với burst đang mở)"""
+        payload = {
+            "alertType": "EMERGENCY",
+            "alertLevel": decision.alert_level.value,
+            "message": decision.message,
+            "confidence": decision.confidence,
+            "sensorData": {
+                "temperature": sensor_data.temperature,
+                "humidity": sensor_data.humidity,
+                "presenceEnergy": sensor_data.presence_energy,
+                "movementEnergy": sensor_data.movement_energy
+            },
+            "actions": [a.value for a in decision.actions],
+            "reasoning": decision.reasoning,
+            "cageId": sensor_data.cage_id,
+            "traceId": decision.trace_id,
+            "timestamp": datetime.now().isoformat()
+        }
+        
+        if not self._admit_alert("ai/emergency", decision, sensor_data, payload):
+            return
+        
+        # urgent: sender gửi ngay, không đợi gom batch
+        with tracer.span(decision.trace_id, 'emergency.enqueue'):
+            self.outbox.enqueue("ai/emergency", payload, urgent=True)
+        events.publish('emergency', payload)
+        print(f"🚨 Emergency alert queued!")
+    
+    def _admit_alert(self, kind: str, decision: AIDecision, sensor_data: SensorData,
+                     payload: Dict) -> bool:
+        """True → gửi ngay; False → lặp lại của burst đang mở (đã gộp, sẽ gửi trong digest)"""
+        fingerprint = alert_fingerprint(kind, sensor_data.cage_id, decision)
+        # Tín hiệu ngoài fingerprint chỉ được theo dõi qua min/max của digest
+        values = {"temperature": sensor_data.temperature, "humidity": sensor_data.humidity,
+                  "presenceEnergy": sensor_data.presence_energy,
+                  "movementEnergy": sensor_data.movement_energy}
+        if self.alerts.admit(kind, fingerprint, payload, values):
+            return True
+        tracer.record(decision.trace_id, 'alert.suppressed', time.time(), 0.0, reason='duplicate')
+        return False
+    
+    def _flush_alert_digests(self):
+        """Gửi digest của các burst tới hạn (số lần lặp, khoảng thời gian, min/max)"""
+        for digest in self.alerts.due_digests():
+            # Digest là bản tóm tắt - không cần gửi gấp, để sender gom batch
+            self.outbox.enqueue(digest.kind, digest.payload)
+            events.publish('alert_digest', digest.payload)
+            print(f"📨 Alert digest queued: {digest.payload['digest']['count']} repeats "
+                  f"({digest.payload['cageId']}, {digest.payload['alertLevel']})")
     
     def _log_decision(self, decision: AIDecision, sensor_data: SensorData):
         """Log AI decision ra console"""
@@ -285,12 +724,33 @@ class AIService:
             **self.stats,
             'uptime': uptime,
             'is_running': self.is_running,
+            'rule_set': self.ai_engine.rule_source.info(),
+            'sensor_anomalies': self.ai_engine.anomaly_stage.stats(),
+            'cages': self.registry.stats(),
+            'rates': self.rates,
+            'scheduler': self.scheduler.stats(),
+            'tracing': tracer.stats(),
+            'status_snapshot': status_snapshot.to_dict(),
+            'event_stream': events.to_dict(),
+            'alert_dedup': self.alerts.to_dict(),
+            'history': self.history.to_dict() if self.history is not None else None,
+            'serving': {
+                'http_workers': HTTP_WORKERS if shared_state is not None else 1,
+                'shared_state': shared_state.to_dict() if shared_state is not None else None
+            },
+            'ingest_cursor': dict(self.cursor),
+            'ingest_mode': 'poll' if self.ingest_queue.idle_for() >= POLL_FALLBACK_AFTER else 'push',
+            'ingest_queue': self.ingest_queue.to_dict(),
+            'io_pipeline': self.io.stats(),
+            'http_client': self.http.stats(),
+            'outbox': self.outbox.to_dict(),
             'ai_engine_stats': self.ai_engine.get_statistics()
         }
 
 
 # Initialize service
 ai_service = None
+publish_status()  # /status trước khi service khởi tạo: is_running False, chưa có decision
 
 
 # ============ FLASK ROUTES ============
@@ -306,23 +766,45 @@ def health():
 
 @app.route('/status')
 def get_status():
-    """Lấy trạng thái hiện tại của AI và IoT"""
-    with state_lock:
-        return jsonify({
-            "ai_service": {
-                "is_running": ai_service.is_running if ai_service else False,
-                "last_decision": last_decision.to_dict() if last_decision else None,
-                "last_sensor_data": {
-                    "temperature": last_sensor_data.temperature,
-                    "humidity": last_sensor_data.humidity,
-                    "presence_energy": last_sensor_data.presence_energy,
-                    "movement_energy": last_sensor_data.movement_energy,
-                    "timestamp": last_sensor_data.timestamp.isoformat()
-                } if last_sensor_data else None
-            },
-            "iot_devices": iot_controller.get_all_device_states() if iot_controller else {},
-            "timestamp": datetime.now().isoformat()
-        })
+    """
+    Lấy trạng thái hiện tại của AI và IoT - snapshot publish bởi monitoring loop.
+    ETag theo version snapshot: If-None-Match khớp → 304 không body.
+    """
+    snapshot = status_snapshot.current()
+    if request.if_none_match.contains(snapshot.etag):
+        response = Response(status=304)
+    else:
+        response = Response(snapshot.body, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Status-Version'] = str(snapshot.version)
+    return response
+
+
+@app.route('/events')
+def event_stream():
+    """
+    Server-sent events: status (snapshot lúc kết nối), decision, device_state, alert, emergency.
+    Header Last-Event-ID (EventSource tự gửi khi kết nối lại) → replay các event đã lỡ.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscription = events.subscribe(last_event_id, EVENT_CLIENT_QUEUE, EVENT_MAX_CLIENTS)
+    if subscription is None:
+        return jsonify({"error": "Too many event stream clients"}), 503
+    
+    def stream():
+        # Retry 3s; client mới nhận trạng thái hiện tại trước (bytes snapshot có sẵn)
+        yield b'retry: 3000\n\n'
+        if not last_event_id:
+            yield EventBroker.frame(None, 'status', status_snapshot.current().body)
+        yield from subscription.stream(EVENT_HEARTBEAT)
+    
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    if EVENT_ALLOW_ORIGIN:
+        response.headers['Access-Control-Allow-Origin'] = EVENT_ALLOW_ORIGIN
+    return response
 
 
 @app.route('/stats')
@@ -333,6 +815,233 @@ def get_stats():
     return jsonify({"error": "AI service not initialized"}), 500
 
 
+@app.before_request
+def _begin_profile_section():
+    # Chỉ có tác dụng khi đang có phiên cProfile (POST /admin/profile?mode=cprofile)
+    if not request.path.startswith('/admin'):
+        g.profile = profiler.begin_section()
+
+
+@app.teardown_request
+def _end_profile_section(exc=None):
+    profiler.end_section(g.pop('profile', None))
+
+
+def _client_addr() -> str:
+    """
+    Địa chỉ client thật: request từ loopback có X-Forwarded-For là do prefork worker proxy
+    tới (worker luôn ghi đè header này bằng địa chỉ client của nó)
+    """
+    remote = request.remote_addr
+    forwarded = request.headers.get('X-Forwarded-For')
+    if remote in ADMIN_LOOPBACK and forwarded:
+        return forwarded.split(',')[-1].strip()
+    return remote
+
+
+def _admin_denied():
+    """
+    Response 403 nếu không được phép gọi /admin/*: ADMIN_TOKEN được đặt → header X-Admin-Token
+    phải khớp; chưa đặt → chỉ client localhost (service bind 0.0.0.0)
+    """
+    if ADMIN_TOKEN:
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+            return jsonify({"error": "Admin token required"}), 403
+        return None
+    if _client_addr() not in ADMIN_LOOPBACK:
+        return jsonify({"error": "Admin endpoints chỉ mở cho localhost khi chưa đặt ADMIN_TOKEN"}), 403
+    return None
+
+
+@app.route('/admin/profile', methods=['POST'])
+def admin_profile():
+    """
+    Profile service đang chạy trong `seconds` giây (block tới khi xong):
+    mode=sample (mặc định) → collapsed stacks (text/plain, dùng cho flamegraph/speedscope);
+    mode=cprofile → báo cáo pstats của các tick scheduler và request Flask trong khoảng đó
+    """
+    denied = _admin_denied()
+    if denied:
+        return denied
+    args = request.args
+    mode = args.get('mode', 'sample')
+    seconds = args.get('seconds', 10.0, type=float)
+    try:
+        if mode == 'sample':
+            result = profiler.sample_stacks(seconds, args.get('interval', profiler.SAMPLE_INTERVAL, type=float),
+                                            args.get('thread'))
+            body, count = result['collapsed'], result['samples']
+        elif mode == 'cprofile':
+            result = profiler.run_cprofile(seconds, args.get('sort', 'cumulative'), args.get('limit', 40, type=int))
+            body, count = result['report'], result['sections']
+        else:
+            return jsonify({"error": "mode phải là sample hoặc cprofile"}), 400
+    except profiler.ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+    response = Response(body, mimetype='text/plain')
+    response.headers['X-Profile-Count'] = str(count)
+    return response
+
+
+@app.route('/admin/span_log', methods=['GET', 'POST'])
+def admin_span_log():
+    """Bật/tắt span log mỗi tick vào SPAN_LOG_PATH: POST {"enabled": true}"""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if data.get('enabled', True):
+            profiler.enable_span_log(SPAN_LOG_PATH, SPAN_LOG_MAX_BYTES, SPAN_LOG_BACKUPS)
+        else:
+            profiler.disable_span_log()
+    return jsonify(profiler.status())
+
+
+@app.route('/traces')
+def export_traces():
+    """Span dạng JSON lines (?trace_id= lọc một trace, ?limit= số span mới nhất)"""
+    lines = tracer.export(request.args.get('trace_id'), request.args.get('limit', type=int))
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+
+@app.route('/traces/<trace_id>')
+def get_trace(trace_id):
+    """Các span của một trace theo thời gian + độ trễ phản ứng end-to-end"""
+    trace = tracer.trace(trace_id)
+    if trace is None:
+        return jsonify({"error": f"Trace {trace_id} not found"}), 404
+    return jsonify(trace)
+
+
+@app.route('/metrics')
+def get_metrics_text():
+    """Metrics theo Prometheus text exposition format"""
+    return Response(metrics.render(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    """
+    Nhận readings push từ backend/ESP32: một object, list, hoặc {"readings": [...]}
+    (field theo backend - presenceEnergy, cageId... - hoặc snake_case).
+    202: đã vào hàng đợi; 429 + Retry-After: hàng đợi đầy (policy reject).
+    """
+    if not ai_service:
+        return jsonify({"error": "AI service not initialized"}), 500
+    
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify({"error": "Body phải là JSON"}), 400
+    items = data['readings'] if isinstance(data, dict) and 'readings' in data else data
+    items = items if isinstance(items, list) else [items]
+    try:
+        readings = [AIService._parse_reading(item) for item in items]
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        return jsonify({"error": f"Invalid sensor data: {e}"}), 400
+    received = time.time()
+    for reading in readings:
+        tracer.record(reading.trace_id, 'ingest', received, 0.0, cage_id=reading.cage_id)
+    
+    queue = ai_service.ingest_queue
+    try:
+        accepted, dropped = queue.put_many(readings)
+    except QueueFull as e:
+        response = jsonify({"error": str(e), "queue_depth": e.depth, "retry_after": e.retry_after})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    
+    # Cursor chỉ dời qua readings thực sự vào hàng đợi (phần bị drop để poll fallback lấy lại)
+    ai_service.note_pushed(*queue.split_accepted(items, accepted))
+    ai_service.scheduler.trigger('ingest')
+    return jsonify({
+        "accepted": accepted,
+        "dropped": dropped,
+        "queue_depth": len(queue),
+        "policy": queue.policy
+    }), 202
+
+
+def _parse_time(value: str) -> float:
+    """Epoch giây hoặc ISO 8601 (không có múi giờ → giờ local)"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+@app.route('/history')
+def history():
+    """
+    Chuỗi thời gian từ rollup: ?from=&to= (epoch hoặc ISO, mặc định 24h gần nhất),
+    ?step= (giây hoặc 5m/1h/1d, bội số của 60; mặc định tự chọn), ?cage_id=
+    """
+    if not ai_service or ai_service.history is None:
+        return jsonify({"error": "History store not enabled"}), 503
+    args = request.args
+    try:
+        end = _parse_time(args['to']) if args.get('to') else time.time()
+        start = _parse_time(args['from']) if args.get('from') else end - 86400
+        step = parse_step(args['step']) if args.get('step') else None
+        result = ai_service.history.query(start, end, step, args.get('cage_id'), HISTORY_MAX_POINTS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    for point in result['points']:
+        point['time'] = datetime.fromtimestamp(point['t'], timezone.utc).isoformat()
+    return jsonify(result)
+
+
+@app.route('/cages')
+def list_cages():
+    """Thống kê tổng hợp và trạng thái ngắn của mọi cage"""
+    if not ai_service:
+        return jsonify({"error": "AI service not initialized"}), 500
+    registry = ai_service.registry
+    return jsonify({
+        "aggregate": registry.stats(),
+        "cages": sorted((cage.summary() for cage in registry.cages()), key=lambda c: c["cage_id"])
+    })
+
+
+@app.route('/cages/<cage_id>')
+def cage_status(cage_id):
+    """Trạng thái đầy đủ của một cage"""
+    if not ai_service:
+        return jsonify({"error": "AI service not initialized"}), 500
+    stats = ai_service.registry.cage_stats(cage_id)
+    if stats is None:
+        return jsonify({"error": f"Unknown cage: {cage_id}"}), 404
+    return jsonify(stats)
+
+
+def _record_override(device: str, action: str, intensity):
+    """Ghi operator override kèm sensor data lúc đó (JSONL, append-only)"""
+    if not OVERRIDE_LOG_PATH:
+        return
+    with state_lock:
+        sensor_data = last_sensor_data
+    record = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),  # Cùng mốc UTC với SensorReadings.CreatedAt
+        "device": device,
+        "action": action,
+        "intensity": intensity,
+    }
+    if sensor_data is not None:
+        record["sensor"] = {
+            "timestamp": sensor_data.timestamp.isoformat(),
+            "temperature": sensor_data.temperature,
+            "humidity": sensor_data.humidity,
+            "presence_energy": sensor_data.presence_energy,
+            "movement_energy": sensor_data.movement_energy,
+        }
+    try:
+        with open(OVERRIDE_LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"⚠️ Không ghi được override log: {e}")
+
+
 @app.route('/manual_control', methods=['POST'])
 def manual_control():
     """Manual control cho IoT devices (override AI)"""
@@ -364,37 +1073,219 @@ def manual_control():
         else:
             return jsonify({"error": f"Unknown device: {device}"}), 400
         
+        _record_override(device, action, intensity)
+        publish_status()
         return jsonify(result)
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/test_analysis', methods=['POST'])
-def test_analysis():
-    """Test AI analysis với custom sensor data"""
-    data = request.get_json()
-    
-    sensor_data = SensorData(
+READ_SIZE = 64 * 1024
+MAX_RECORD_BYTES = 64 * 1024
+
+
+def _iter_json_array(chunks):
+    """
+    Parse JSON array từng phần tử từ các chunk bytes (không giữ cả body trong bộ nhớ):
+    buffer chỉ chứa phần chưa parse, tối đa cỡ một chunk + một record.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buffer, pos, opened, eof = '', 0, False, False
+    chunks = iter(chunks)
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer):
+            if not opened:
+                if buffer[pos] != '[':
+                    raise ValueError("Body phải là JSON object, JSON array hoặc NDJSON")
+                opened, pos = True, pos + 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+                yield record
+                continue
+            except json.JSONDecodeError:
+                if eof or len(buffer) - pos > MAX_RECORD_BYTES:
+                    raise ValueError(f"JSON không hợp lệ gần ký tự {pos}")
+        elif eof:
+            raise ValueError("JSON array chưa đóng")
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buffer = buffer[pos:] + text.decode(b'', final=True)
+        else:
+            buffer = buffer[pos:] + text.decode(chunk)
+        pos = 0
+
+
+def _iter_ndjson(chunks):
+    """Parse NDJSON từng dòng từ các chunk bytes"""
+    pending = b''
+    for chunk in itertools.chain(chunks, [b'\n']):
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        if len(pending) > MAX_RECORD_BYTES:
+            raise ValueError("Dòng NDJSON quá dài")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _reading_from_json(data: Dict) -> SensorData:
+    return SensorData(
         temperature=float(data.get('temperature', 25)),
         humidity=float(data.get('humidity', 60)),
         presence_energy=int(data.get('presence_energy', 0)),
         movement_energy=int(data.get('movement_energy', 0))
     )
+
+
+def _sensor_dict(sensor_data: SensorData) -> Dict:
+    return {
+        "temperature": sensor_data.temperature,
+        "humidity": sensor_data.humidity,
+        "presence_energy": sensor_data.presence_energy,
+        "movement_energy": sensor_data.movement_energy
+    }
+
+
+def _stream_batch_decisions(records, ndjson: bool, full_detail: bool):
+    """
+    Đánh giá batch theo từng chunk TEST_BATCH_CHUNK readings và stream kết quả:
+    bộ nhớ server chỉ phụ thuộc kích thước chunk, không phụ thuộc số reading.
+    """
+    engine = ai_service.ai_engine
+    separator = "\n" if ndjson else ","
+    first = True
+    if not ndjson:
+        yield "["
+    index = 0
+    try:
+        while True:
+            chunk = [_reading_from_json(r) for r in itertools.islice(records, TEST_BATCH_CHUNK)]
+            if not chunk:
+                break
+            if full_detail:
+                decisions = [engine.analyze(r, update_state=False).to_dict() for r in chunk]
+            else:
+                decisions = engine.decide_batch(
+                    [r.temperature for r in chunk], [r.humidity for r in chunk],
+                    [r.presence_energy for r in chunk], [r.movement_energy for r in chunk])
+            lines = []
+            for reading, decision in zip(chunk, decisions):
+                lines.append(json.dumps({
+                    "index": index,
+                    "sensor_data": _sensor_dict(reading),
+                    "decision": decision
+                }, ensure_ascii=False, separators=(',', ':')))
+                index += 1
+            yield ("" if ndjson or first else separator) + separator.join(lines) + ("\n" if ndjson else "")
+            first = False
+    except (ValueError, TypeError, AttributeError) as e:
+        # Header 200 đã gửi: báo lỗi bằng record cuối cùng
+        error = json.dumps({"error": str(e), "index": index}, ensure_ascii=False)
+        yield ("" if ndjson or first else separator) + error + ("\n" if ndjson else "")
+    if not ndjson:
+        yield "]"
+
+
+@app.route('/test_analysis', methods=['POST'])
+def test_analysis():
+    """
+    Test AI analysis với custom sensor data.
+    - JSON object: một reading, trả về decision đầy đủ (như trước)
+    - JSON array / NDJSON (Content-Type: application/x-ndjson): nhiều readings,
+      đánh giá batch vectorized và stream kết quả theo chunk (cùng định dạng với input).
+      ?detail=full để có message/reasoning (chậm hơn, đánh giá từng reading)
+    Không ảnh hưởng decision history, trend hay forecast của engine.
+    """
+    if not ai_service:
+        return jsonify({"error": "AI service not initialized"}), 500
     
-    decision = ai_service.ai_engine.analyze(sensor_data)
+    stream = request.stream
+    ndjson = request.mimetype in ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+    head = b'' if ndjson else stream.read(READ_SIZE)
+    
+    if not ndjson and head.lstrip()[:1] != b'[':
+        # Một reading (JSON object)
+        try:
+            data = json.loads(head + stream.read())
+            sensor_data = _reading_from_json(data)
+        except (ValueError, TypeError, AttributeError) as e:
+            return jsonify({"error": f"Invalid sensor data: {e}"}), 400
+        
+        decision = ai_service.ai_engine.analyze(sensor_data, update_state=False)
+        return jsonify({
+            "sensor_data": _sensor_dict(sensor_data),
+            "decision": decision.to_dict()
+        })
     
+    chunks = itertools.chain([head], iter(lambda: stream.read(READ_SIZE), b''))
+    records = _iter_ndjson(chunks) if ndjson else _iter_json_array(chunks)
+    full_detail = request.args.get('detail') == 'full'
+    body = _stream_batch_decisions(records, ndjson, full_detail)
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(stream_with_context(body), mimetype=mimetype)
+
+
+@app.route('/rules')
+def get_rules():
+    """Lấy rule set fuzzy đang chạy"""
+    if not ai_service:
+        return jsonify({"error": "AI service not initialized"}), 500
+    rules = ai_service.ai_engine.rules
     return jsonify({
-        "sensor_data": {
-            "temperature": sensor_data.temperature,
-            "humidity": sensor_data.humidity,
-            "presence_energy": sensor_data.presence_energy,
-            "movement_energy": sensor_data.movement_energy
-        },
-        "decision": decision.to_dict()
+        **ai_service.ai_engine.rule_source.info(),
+        "config": rules.config
     })
 
 
+@app.route('/rules/reload', methods=['POST'])
+def reload_rules():
+    """Reload rule set từ file ngay (không cần restart service)"""
+    if not ai_service:
+        return jsonify({"error": "AI service not initialized"}), 500
+    ai_service.ai_engine.reload_rules()
+    info = ai_service.ai_engine.rule_source.info()
+    if info['last_error']:
+        return jsonify(info), 400
+    return jsonify(info)
+
+
+@app.route('/decision_surface')
+def get_decision_surface():
+    """
+    Decision surface cho heatmap: alert level, combined risk và flags trên lưới
+    nhiệt độ x độ ẩm với presence/movement cố định (cache theo rule set version)
+    """
+    if not ai_service:
+        return jsonify({"error": "AI service not initialized"}), 500
+    args = request.args
+    try:
+        body, hit = decision_surface(
+            ai_service.ai_engine.rules,
+            temperature=(args.get('t_min', 0.0, type=float), args.get('t_max', 45.0, type=float),
+                         args.get('t_steps', 200, type=int)),
+            humidity=(args.get('h_min', 0.0, type=float), args.get('h_max', 100.0, type=float),
+                      args.get('h_steps', 200, type=int)),
+            presence=args.get('presence_energy', 100.0, type=float),
+            movement=args.get('movement_energy', 20.0, type=float),
+            encoding=args.get('encoding', 'base64')
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    response = Response(body, mimetype='application/json')
+    response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 @app.route('/command_history')
 def command_history():
     """Lấy lịch sử lệnh IoT"""
@@ -419,6 +1310,24 @@ def initialize_service():
     ai_service.start()
 
 
+def run_primary(shared: SharedState):
+    """
+    Process monitoring của chế độ nhiều worker: AIService + Flask app đầy đủ trên
+    127.0.0.1:INTERNAL_PORT (worker proxy tới), publish state vào shared memory
+    """
+    global shared_state
+    shared_state = shared
+    # SIGTERM từ supervisor → thoát qua finally (đóng outbox, dừng scheduler)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    initialize_service()
+    try:
+        app.run(host='127.0.0.1', port=INTERNAL_PORT, threaded=True, debug=False)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ai_service.stop()
+
+
 if __name__ == "__main__":
     print("="*70)
     print("🐾 PETZONE INTELLIGENT AI SERVICE")
@@ -431,21 +1340,42 @@ if __name__ == "__main__":
     print("  ✅ Emergency Alert System")
     print("="*70)
     
-    # Initialize service
-    initialize_service()
+    prefork_mode = HTTP_WORKERS > 1 and prefork.supports_prefork()
+    if HTTP_WORKERS > 1 and not prefork_mode:
+        print("⚠️ HTTP_WORKERS > 1 cần os.fork (Linux/macOS) - chạy một process")
+    
+    # Initialize service (chế độ nhiều worker: khởi tạo trong process monitoring sau khi fork)
+    if not prefork_mode:
+        initialize_service()
     
     print("\n📡 API Endpoints:")
     print(f"   → http://localhost:5001/status    (AI & IoT status)")
     print(f"   → http://localhost:5001/stats     (AI statistics)")
+    print(f"   → http://localhost:5001/events    (Server-sent events: decision, device, alert)")
+    print(f"   → http://localhost:5001/metrics   (Prometheus metrics)")
+    print(f"   → http://localhost:5001/traces    (Trace spans - JSON lines)")
+    print(f"   → http://localhost:5001/admin/profile (POST - sampling profiler / cProfile)")
     print(f"   → http://localhost:5001/manual_control (Manual device control)")
     print(f"   → http://localhost:5001/test_analysis (Test AI with custom data)")
     print(f"   → http://localhost:5001/command_history (IoT command history)")
+    print(f"   → http://localhost:5001/rules (Fuzzy rule set, POST /rules/reload)")
+    print(f"   → http://localhost:5001/decision_surface (Heatmap alert level / risk)")
+    print(f"   → http://localhost:5001/cages (Per-cage & aggregate stats)")
+    print(f"   → http://localhost:5001/history?from=&to=&step= (Rollup 1m/1h readings & decisions)")
+    print(f"   → http://localhost:5001/ingest (POST readings - push ingestion)")
     print("\n⏹️  Press Ctrl+C to stop\n")
     
-    try:
-        app.run(host='0.0.0.0', port=5001, threaded=True, debug=False)
-    except KeyboardInterrupt:
-        print("\n\n👋 Stopping AI Service...")
-        if ai_service:
-            ai_service.stop()
+    if prefork_mode:
+        # Fork trước khi có thread nào (AIService chỉ khởi tạo trong process monitoring)
+        shared = SharedState({name: SHARED_STATE_CAPACITY for name in prefork.SHARED_ROUTES})
+        prefork.serve('0.0.0.0', 5001, HTTP_WORKERS, shared, f"http://127.0.0.1:{INTERNAL_PORT}",
+                      functools.partial(run_primary, shared))
         print("✅ AI Service stopped!")
+    else:
+        try:
+            app.run(host='0.0.0.0', port=5001, threaded=True, debug=False)
+        except KeyboardInterrupt:
+            print("\n\n👋 Stopping AI Service...")
+            if ai_service:
+                ai_service.stop()
+            print("✅ AI Service stopped!")
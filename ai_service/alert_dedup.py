@@ -0,0 +1,155 @@
+"""
+PetZone Alert Dedup - Gộp alert trùng theo nội dung, gửi digest trong lúc sự cố kéo dài
+======================================================================================
+Cooldown cũ chỉ theo alert level và emergency không có cooldown: cage kẹt ở 36°C gửi
+một emergency mỗi tick (5s) → 720 POST/giờ cho cùng một sự cố.
+
+Mỗi alert có fingerprint theo điều kiện: loại (alert/emergency), cage, alert level và
+trạng thái fuzzy của tín hiệu gây ra alert (membership lớn nhất của nhiệt độ, hoặc của pet
+khi pet risk cao hơn). Các tín hiệu khác (độ ẩm dao động quanh ranh giới humid/comfortable
+trong đợt nóng) không tách burst, chỉ được ghi min/max trong digest.
+
+- Lần đầu của fingerprint (hoặc sau khi burst trước đã kết thúc) → gửi ngay
+- Lặp lại trong burst → không gửi, chỉ cộng vào burst (số lần, min/max giá trị)
+- Mỗi `digest_interval` giây, burst có alert bị gộp → một digest alert (số lần,
+  khoảng thời gian, min/max); burst im lặng quá `window` giây → digest cuối, đóng burst
+- Điều kiện đổi (level khác, trạng thái của tín hiệu gây alert khác) → fingerprint khác → gửi ngay
+"""
+
+import time
+from datetime import datetime
+from threading import Lock
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+# Tín hiệu có thể gây alert: (membership, key risk trong reasoning)
+DRIVER_SIGNALS = (('temperature', 'temperature_analysis'), ('pet_status', 'pet_status_analysis'))
+
+
+def alert_driver(decision) -> str:
+    """Tín hiệu gây ra alert: nhiệt độ, trừ khi pet risk cao hơn (pet emergency)"""
+    scores = {name: (decision.reasoning.get(key) or {}).get('score', 0.0) for name, key in DRIVER_SIGNALS}
+    return 'pet_status' if scores['pet_status'] > scores['temperature'] else 'temperature'
+
+
+def alert_fingerprint(kind: str, cage_id: str, decision) -> str:
+    """'ai/emergency|default|critical|temperature=very_hot'"""
+    driver = alert_driver(decision)
+    degrees = decision.reasoning.get('fuzzy_memberships', {}).get(driver) or {}
+    state = max(degrees, key=degrees.get) if degrees else '-'
+    return f"{kind}|{cage_id}|{decision.alert_level.value}|{driver}={state}"
+
+
+class Digest(NamedTuple):
+    kind: str
+    payload: Dict
+
+
+class _Burst:
+    __slots__ = ('fingerprint', 'kind', 'payload', 'first_seen', 'last_seen', 'last_emit',
+                 'occurrences', 'pending', 'mins', 'maxs')
+
+    def __init__(self, fingerprint: str, kind: str, payload: Dict, now: float):
+        self.fingerprint = fingerprint
+        self.kind = kind
+        self.payload = payload
+        self.first_seen = self.last_seen = self.last_emit = now
+        self.occurrences = 1
+        self.pending = 0  # Lần lặp chưa được báo trong digest nào
+        self.mins: Dict[str, float] = {}
+        self.maxs: Dict[str, float] = {}
+
+    def fold(self, payload: Dict, values: Dict[str, float], now: float):
+        self.payload = payload
+        self.last_seen = now
+        self.occurrences += 1
+        self.pending += 1
+        for name, value in values.items():
+            if value is None:
+                continue
+            self.mins[name] = min(self.mins.get(name, value), value)
+            self.maxs[name] = max(self.maxs.get(name, value), value)
+
+    def digest(self, now: float, final: bool) -> Digest:
+        """Alert tổng hợp từ lần gần nhất, kèm số lần lặp và min/max kể từ digest trước"""
+        minutes = max(1, round((self.last_seen - self.last_emit) / 60))
+        payload = {
+            **self.payload,
+            "message": f"{self.payload.get('message', '')} "
+                       f"(lặp lại {self.pending} lần trong {minutes} phút)",
+            "digest": {
+                "fingerprint": self.fingerprint,
+                "count": self.pending,
+                "occurrences": self.occurrences,
+                "since": _iso(self.last_emit),
+                "until": _iso(self.last_seen),
+                "burstStartedAt": _iso(self.first_seen),
+                "final": final,
+                **{name: {"min": round(self.mins[name], 2), "max": round(self.maxs[name], 2)}
+                   for name in self.mins}
+            },
+            "timestamp": _iso(now)
+        }
+        self.pending = 0
+        self.mins, self.maxs = {}, {}
+        self.last_emit = now
+        return Digest(self.kind, payload)
+
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch).isoformat()
+
+
+class AlertDeduplicator:
+    """Burst theo fingerprint, thread-safe (alert gửi từ các I/O worker)"""
+
+    def __init__(self, window: float = 600.0, digest_interval: float = 900.0,
+                 clock: Callable[[], float] = time.time):
+        self.window = window  # Burst kết thúc sau chừng này giây không lặp lại
+        self.digest_interval = digest_interval
+        self.clock = clock
+        self._bursts: Dict[str, _Burst] = {}
+        self._lock = Lock()
+        self.stats = {
+            'sent': 0,
+            'suppressed': 0,
+            'digests': 0
+        }
+
+    def admit(self, kind: str, fingerprint: str, payload: Dict,
+              values: Optional[Dict[str, float]] = None) -> bool:
+        """True → gửi alert này ngay; False → đã gộp vào burst đang mở (sẽ có trong digest)"""
+        now = self.clock()
+        with self._lock:
+            burst = self._bursts.get(fingerprint)
+            if burst is not None and now - burst.last_seen < self.window:
+                burst.fold(payload, values or {}, now)
+                self.stats['suppressed'] += 1
+                return False
+            self._bursts[fingerprint] = _Burst(fingerprint, kind, payload, now)
+            self.stats['sent'] += 1
+            return True
+
+    def due_digests(self) -> List[Digest]:
+        """Digest tới hạn; burst đã im lặng quá window → digest cuối (nếu còn lần lặp) và đóng"""
+        now = self.clock()
+        digests = []
+        with self._lock:
+            for fingerprint, burst in list(self._bursts.items()):
+                ended = now - burst.last_seen >= self.window
+                if burst.pending and (ended or now - burst.last_emit >= self.digest_interval):
+                    digests.append(burst.digest(now, final=ended))
+                if ended:
+                    del self._bursts[fingerprint]
+            self.stats['digests'] += len(digests)
+        return digests
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            pending = sum(b.pending for b in self._bursts.values())
+            return {
+                'window_s': self.window,
+                'digest_interval_s': self.digest_interval,
+                'open_bursts': len(self._bursts),
+                'pending_repeats': pending,
+                **self.stats
+            }
@@ -0,0 +1,131 @@
+"""
+PetZone Async Pipeline - Chạy các I/O call của một tick song song có deadline
+============================================================================
+Fetch sensor, lệnh ESP32, log hoạt động thiết bị, alert/emergency tới backend đều là
+HTTP blocking (requests). Thay vì gọi tuần tự (mỗi call tới 5s timeout → một tick có
+thể >25s khi mạng kém), mỗi call chạy trong thread pool qua asyncio
+(run_in_executor + wait_for) với deadline riêng và được gather cùng lúc:
+thời gian I/O của tick ≈ call chậm nhất, không phải tổng các call.
+
+Phần quyết định (engine.analyze) vẫn đồng bộ và không có I/O; pipeline chỉ nhận danh
+sách IOCall đã được lên kế hoạch từ các decision.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import get_metrics
+
+_call_seconds = get_metrics().histogram(
+    'petzone_io_call_duration_seconds', 'Thời gian mỗi I/O call theo loại (tới khi xong hoặc hết deadline)',
+    ('call',))
+_call_results = get_metrics().counter(
+    'petzone_io_calls_total', 'Số I/O call theo loại và kết quả (ok, timeout, error)', ('call', 'status'))
+
+
+@dataclass
+class IOCall:
+    """Một I/O call blocking cần chạy với deadline"""
+    name: str                 # Loại call (thống kê theo tên): esp32, backend.alert...
+    fn: Callable[[], Any]
+    deadline: float = 3.0     # Giây; quá hạn → bỏ kết quả, tick không đợi thêm
+
+
+@dataclass
+class IOResult:
+    """Kết quả của một IOCall"""
+    name: str
+    status: str               # ok | timeout | error
+    value: Any = None
+    error: Optional[str] = None
+    elapsed_ms: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 'ok'
+
+
+class AsyncIOPipeline:
+    """
+    Event loop riêng cho mỗi thread gọi run() (thường chỉ monitoring thread) + thread pool
+    chung cho các call blocking. Call quá deadline vẫn chạy tới khi timeout của requests
+    kết thúc nhưng không giữ tick lại; pool bounded nên số call treo cũng bounded.
+    """
+
+    def __init__(self, max_workers: int = 16):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="io")
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.call_stats: Dict[str, Dict] = {}
+        self.last_run: Optional[Dict] = None
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        loop = getattr(self._local, 'loop', None)
+        if loop is None or loop.is_closed():
+            loop = asyncio.new_event_loop()
+            self._local.loop = loop
+        return loop
+
+    def run(self, calls: List[IOCall]) -> List[IOResult]:
+        """Chạy mọi call song song, trả về kết quả theo đúng thứ tự của calls"""
+        if not calls:
+            return []
+        started = time.perf_counter()
+        results = self._event_loop().run_until_complete(self._gather(calls))
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        self._record(results, elapsed_ms)
+        return results
+
+    def call(self, name: str, fn: Callable[[], Any], deadline: float) -> IOResult:
+        """Chạy một call với deadline"""
+        return self.run([IOCall(name, fn, deadline)])[0]
+
+    async def _gather(self, calls: List[IOCall]) -> List[IOResult]:
+        return await asyncio.gather(*(self._run_call(call) for call in calls))
+
+    async def _run_call(self, call: IOCall) -> IOResult:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            value = await asyncio.wait_for(loop.run_in_executor(self._executor, call.fn), call.deadline)
+            result = IOResult(call.name, 'ok', value)
+        except asyncio.TimeoutError:
+            result = IOResult(call.name, 'timeout', error=f"deadline {call.deadline}s exceeded")
+            print(f"⏱️ {call.name} exceeded deadline {call.deadline}s")
+        except Exception as e:
+            result = IOResult(call.name, 'error', error=str(e))
+            print(f"❌ {call.name} failed: {e}")
+        result.elapsed_ms = round((time.perf_counter() - started) * 1000.0, 3)
+        return result
+
+    def _record(self, results: List[IOResult], elapsed_ms: float):
+        with self._stats_lock:
+            for result in results:
+                _call_seconds.labels(result.name).observe(result.elapsed_ms / 1000.0)
+                _call_results.labels(result.name, result.status).inc()
+                stats = self.call_stats.setdefault(
+                    result.name, {'ok': 0, 'timeout': 0, 'error': 0, 'last_ms': None, 'max_ms': 0.0})
+                stats[result.status] += 1
+                stats['last_ms'] = result.elapsed_ms
+                stats['max_ms'] = max(stats['max_ms'], result.elapsed_ms)
+            self.last_run = {
+                'calls': len(results),
+                'elapsed_ms': round(elapsed_ms, 3),
+                'slowest_call_ms': max(r.elapsed_ms for r in results),
+                'sum_call_ms': round(sum(r.elapsed_ms for r in results), 3),
+                'timeouts': sum(1 for r in results if r.status == 'timeout')
+            }
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                'calls': {name: dict(s) for name, s in self.call_stats.items()},
+                'last_run': dict(self.last_run) if self.last_run else None
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,333 @@
+"""
+PetZone Backtest - Replay lịch sử SensorReadings qua Decision Engine
+====================================================================
+So sánh các rule set (fuzzy_rules.json) trên cùng dữ liệu lịch sử: mỗi rule set
+sẽ bật/tắt quạt bao nhiêu lần, gửi bao nhiêu alert và emergency.
+
+- Đọc CSV/NPY theo chunk (bộ nhớ cố định theo --chunk-size)
+- Đánh giá qua đường vectorized IntelligentDecisionEngine.analyze_batch()
+- Nhiều rule set chạy song song trên nhiều process
+
+Cách dùng:
+    python backtest.py readings.csv --rules fuzzy_rules.json candidate.json --output report.json
+
+Định dạng input:
+    CSV: export bảng SensorReadings (CreatedAt, Temperature, Humidity,
+         PresenceEnergy, MovementEnergy). CreatedAt là ISO 8601 hoặc epoch giây.
+    NPY: structured array cùng tên cột, hoặc mảng (N, 5) theo thứ tự
+         [timestamp, temperature, humidity, presence_energy, movement_energy].
+"""
+
+import argparse
+import bisect
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from ai_decision_engine import IntelligentDecisionEngine, ReplayState
+from fuzzy_rules import ALERT_LEVEL_ORDER, DEFAULT_RULES_PATH, RuleSetSource, load_rule_config
+
+DEFAULT_CHUNK_SIZE = 65536
+DEFAULT_ALERT_COOLDOWN = 30  # Cooldown theo alert level (xấp xỉ đơn giản của alert_dedup.py)
+
+COLUMNS = ('timestamp', 'temperature', 'humidity', 'presence_energy', 'movement_energy')
+
+# Tên cột chấp nhận được (so sánh không phân biệt hoa thường, bỏ "_")
+COLUMN_ALIASES = {
+    'timestamp': ('createdat', 'timestamp', 'time', 'ts'),
+    'temperature': ('temperature', 'temp'),
+    'humidity': ('humidity',),
+    'presence_energy': ('presenceenergy', 'presence'),
+    'movement_energy': ('movementenergy', 'movement'),
+}
+
+
+def _normalize(name: str) -> str:
+    return name.strip().lower().replace('_', '')
+
+
+def _resolve_columns(names: List[str]) -> Dict[str, int]:
+    normalized = [_normalize(n) for n in names]
+    mapping = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in normalized:
+                mapping[column] = normalized.index(alias)
+                break
+        else:
+            raise ValueError(f"Input thiếu cột '{column}' (chấp nhận: {', '.join(aliases)})")
+    return mapping
+
+
+def _parse_float(values: List[str]) -> np.ndarray:
+    return np.array([float(v) if v not in ('', 'NULL', 'null') else np.nan for v in values])
+
+
+def _parse_timestamps(values: List[str]) -> np.ndarray:
+    """Epoch giây; nhận epoch số hoặc ISO 8601 (vectorized khi không có timezone offset)"""
+    try:
+        return np.array(values, dtype=float)
+    except ValueError:
+        pass
+    cleaned = [v[:-1] if v.endswith('Z') else v for v in values]
+    try:
+        parsed = np.array(cleaned, dtype='datetime64[us]')
+        return parsed.astype('int64') / 1e6
+    except ValueError:
+        return np.array([datetime.fromisoformat(v.replace('Z', '+00:00')).timestamp() for v in values])
+
+
+def _iter_csv(path: str, chunk_size: int) -> Iterator[Dict[str, np.ndarray]]:
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        mapping = _resolve_columns(next(reader))
+        indexes = [mapping[c] for c in COLUMNS]
+        while True:
+            rows = [row for _, row in zip(range(chunk_size), reader)]
+            if not rows:
+                return
+            columns = [[row[i] for row in rows] for i in indexes]
+            yield {
+                'timestamp': _parse_timestamps(columns[0]),
+                'temperature': _parse_float(columns[1]),
+                'humidity': _parse_float(columns[2]),
+                'presence_energy': _parse_float(columns[3]),
+                'movement_energy': _parse_float(columns[4]),
+            }
+
+
+def _iter_npy(path: str, chunk_size: int) -> Iterator[Dict[str, np.ndarray]]:
+    data = np.load(path, mmap_mode='r')
+    if data.dtype.names:
+        mapping = _resolve_columns(list(data.dtype.names))
+        fields = {c: data.dtype.names[i] for c, i in mapping.items()}
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            yield {c: np.asarray(chunk[fields[c]], dtype=float) for c in COLUMNS}
+    else:
+        if data.ndim != 2 or data.shape[1] < len(COLUMNS):
+            raise ValueError(f"NPY cần structured array hoặc mảng (N, {len(COLUMNS)})")
+        for start in range(0, len(data), chunk_size):
+            chunk = np.asarray(data[start:start + chunk_size], dtype=float)
+            yield {c: chunk[:, i] for i, c in enumerate(COLUMNS)}
+
+
+def iter_chunks(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Dict[str, np.ndarray]]:
+    """Đọc file readings theo chunk, mỗi chunk là dict các cột numpy"""
+    if path.endswith('.npy'):
+        return _iter_npy(path, chunk_size)
+    return _iter_csv(path, chunk_size)
+
+
+def iter_clean_chunks(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE
+                      ) -> Iterator[Tuple[Optional[Dict[str, np.ndarray]], int]]:
+    """
+    Như iter_chunks nhưng lọc giống live: bỏ reading thiếu nhiệt độ/độ ẩm hoặc
+    không mới hơn reading trước; presence/movement thiếu → 0 (như .get(..., 0)).
+    Trả về (chunk đã lọc hoặc None nếu rỗng, số reading bị bỏ).
+    """
+    last_t = None
+    for chunk in iter_chunks(path, chunk_size):
+        t = chunk['timestamp']
+        running_max = np.maximum.accumulate(np.concatenate(
+            [[-np.inf if last_t is None else last_t], np.nan_to_num(t, nan=-np.inf)]))
+        keep = (~np.isnan(chunk['temperature']) & ~np.isnan(chunk['humidity']) &
+                ~np.isnan(t) & (t > running_max[:-1]))
+        dropped = int(len(t) - keep.sum())
+        if not keep.any():
+            yield None, dropped
+            continue
+        cleaned = {c: chunk[c][keep] for c in COLUMNS}
+        cleaned['presence_energy'] = np.nan_to_num(cleaned['presence_energy'])
+        cleaned['movement_energy'] = np.nan_to_num(cleaned['movement_energy'])
+        last_t = cleaned['timestamp'][-1]
+        yield cleaned, dropped
+
+
+class _AlertCooldown:
+    """Đếm alert gửi với cooldown theo alert level (so sánh rule set, không mô phỏng digest)"""
+
+    def __init__(self, cooldown: float):
+        self.cooldown = cooldown
+        self.last_sent = {}
+
+    def count(self, timestamps: np.ndarray, codes: np.ndarray) -> int:
+        sent = 0
+        for code in np.unique(codes[codes > 0]).tolist():
+            times = timestamps[codes == code].tolist()
+            last = self.last_sent.get(code)
+            i = 0 if last is None else bisect.bisect_left(times, last + self.cooldown)
+            while i < len(times):
+                last = times[i]
+                sent += 1
+                i = bisect.bisect_left(times, last + self.cooldown, i + 1)
+            if last is not None:
+                self.last_sent[code] = last
+        return sent
+
+
+def load_rules_strict(rules_path: str) -> RuleSetSource:
+    """
+    Rule set cố định từ file cho backtest. Khác RuleSetSource(path) của service (in lỗi và
+    giữ rule mặc định), file thiếu/lỗi ở đây raise - không báo cáo nhầm kết quả rule mặc định.
+    """
+    source = RuleSetSource()
+    source.set_config(load_rule_config(rules_path))
+    return source
+
+
+def run_backtest(input_path: str, rules_path: str = DEFAULT_RULES_PATH,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 alert_cooldown: float = DEFAULT_ALERT_COOLDOWN) -> Dict:
+    """Replay toàn bộ file qua một rule set, trả về summary"""
+    started = time.perf_counter()
+    engine = IntelligentDecisionEngine(rule_source=load_rules_strict(rules_path))
+    rules = engine.rules
+    state = ReplayState()
+    cooldown = _AlertCooldown(alert_cooldown)
+
+    readings = skipped = 0
+    first_t = last_t = None
+    alert_counts = np.zeros(len(ALERT_LEVEL_ORDER), dtype=np.int64)
+    totals = {
+        'alerts_sent': 0,
+        'emergency_alerts': 0,
+        'emergency_episodes': 0,
+        'notifications': 0,
+        'fan_on_commands': 0,
+        'fan_off_commands': 0,
+        'fan_toggles': 0,
+    }
+    fan_on_seconds = 0.0
+    prev_emergency = False
+    prev_fan = False
+
+    for chunk, dropped in iter_clean_chunks(input_path, chunk_size):
+        skipped += dropped
+        if chunk is None:
+            continue
+        t = chunk['timestamp']
+        batch = engine.analyze_batch(
+            chunk['temperature'],
+            chunk['humidity'],
+            chunk['presence_energy'],
+            chunk['movement_energy'],
+            timestamps=t,
+            state=state
+        )
+
+        codes = batch.alert_codes
+        alert_counts += np.bincount(codes, minlength=len(ALERT_LEVEL_ORDER))
+        totals['alerts_sent'] += cooldown.count(t, codes)
+
+        emergency = batch.emergency
+        totals['emergency_alerts'] += int(emergency.sum())
+        totals['emergency_episodes'] += int((emergency & ~np.concatenate([[prev_emergency], emergency[:-1]])).sum())
+        totals['notifications'] += int(batch.notify.sum())
+        totals['fan_on_commands'] += int(batch.turn_on_fan.sum())
+        totals['fan_off_commands'] += int(batch.turn_off_fan.sum())
+
+        fan = batch.fan_running
+        totals['fan_toggles'] += int((fan != np.concatenate([[prev_fan], fan[:-1]])).sum())
+        # Quạt chạy từ reading này tới reading kế tiếp
+        next_t = np.concatenate([t[1:], [t[-1]]])
+        fan_on_seconds += float(((next_t - t) * fan).sum())
+        if last_t is not None and prev_fan:
+            fan_on_seconds += float(t[0] - last_t)
+
+        readings += len(t)
+        first_t = t[0] if first_t is None else first_t
+        last_t = t[-1]
+        prev_emergency = bool(emergency[-1])
+        prev_fan = bool(fan[-1])
+
+    elapsed = time.perf_counter() - started
+    duration = float(last_t - first_t) if readings else 0.0
+    return {
+        'rule_set': rules.name,
+        'rules_path': rules_path,
+        'version': rules.version,
+        'readings': readings,
+        'skipped': skipped,
+        'duration_hours': round(duration / 3600, 2),
+        'alert_distribution': {level: int(n) for level, n in zip(ALERT_LEVEL_ORDER, alert_counts)},
+        **totals,
+        'fan_on_fraction': round(fan_on_seconds / duration, 4) if duration > 0 else 0.0,
+        'elapsed_seconds': round(elapsed, 3),
+        'readings_per_second': int(readings / elapsed) if elapsed > 0 else None,
+    }
+
+
+def _run_one(args) -> Dict:
+    return run_backtest(*args)
+
+
+def run_backtests(input_path: str, rules_paths: List[str], chunk_size: int = DEFAULT_CHUNK_SIZE,
+                  alert_cooldown: float = DEFAULT_ALERT_COOLDOWN,
+                  workers: Optional[int] = None) -> List[Dict]:
+    """Chạy nhiều rule set song song (mỗi rule set một process, mỗi process tự stream file)"""
+    jobs = [(input_path, path, chunk_size, alert_cooldown) for path in rules_paths]
+    workers = workers or min(len(jobs), os.cpu_count() or 1)
+    if workers <= 1 or len(jobs) == 1:
+        return [_run_one(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_one, jobs))
+
+
+def print_report(results: List[Dict]):
+    """In bảng so sánh các rule set"""
+    columns = [
+        ('rule set', lambda r: f"{r['rule_set']} ({r['version'][:8]})"),
+        ('readings', lambda r: r['readings']),
+        ('fan toggles', lambda r: r['fan_toggles']),
+        ('fan on %', lambda r: f"{r['fan_on_fraction']:.1%}"),
+        ('alerts', lambda r: r['alerts_sent']),
+        ('emergencies', lambda r: r['emergency_alerts']),
+        ('episodes', lambda r: r['emergency_episodes']),
+        ('time (s)', lambda r: r['elapsed_seconds']),
+    ]
+    rows = [[str(fn(r)) for _, fn in columns] for r in results]
+    widths = [max(len(name), *(len(row[i]) for row in rows)) for i, (name, _) in enumerate(columns)]
+    print("  ".join(name.ljust(w) for (name, _), w in zip(columns, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  ".join(cell.ljust(w) for cell, w in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest rule sets của PetZone Decision Engine")
+    parser.add_argument('input', help="File readings (.csv hoặc .npy)")
+    parser.add_argument('--rules', nargs='+', default=[DEFAULT_RULES_PATH],
+                        help="Các file rule set JSON cần so sánh")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--alert-cooldown', type=float, default=DEFAULT_ALERT_COOLDOWN)
+    parser.add_argument('--workers', type=int, default=None, help="Số process (mặc định = số rule set)")
+    parser.add_argument('--output', help="Ghi summary JSON vào file")
+    args = parser.parse_args()
+
+    # Kiểm tra mọi rule set trước khi stream dữ liệu
+    for path in args.rules:
+        try:
+            load_rules_strict(path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            parser.exit(1, f"❌ Rule set không hợp lệ ({path}): {e}\n")
+
+    print(f"🔁 Backtesting {len(args.rules)} rule set(s) trên {args.input}\n")
+    results = run_backtests(args.input, args.rules, args.chunk_size,
+                            args.alert_cooldown, args.workers)
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, separators=(',', ':'))
+        print(f"\n💾 Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+PetZone Cage Registry - Engine state riêng cho từng chuồng
+===========================================================
+Mỗi cage có IntelligentDecisionEngine riêng (decision history, trend features,
+forecast, anomaly baseline, trạng thái quạt); rule set
+compile một lần và dùng chung cho mọi cage.
+
+Cage được chia vào các shard cố định theo crc32(cage_id). Mỗi tick, readings được
+gom theo shard và mỗi shard chạy trên một worker của pool: readings của cùng một
+cage luôn xử lý tuần tự đúng thứ tự, các shard khác nhau chạy song song. Handler
+chỉ ghi nhận decision và lên kế hoạch actions/alert; I/O tới ESP32/backend chạy
+sau tick trên async pipeline (async_pipeline.py), không chạy trên worker của shard.
+"""
+
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from ai_decision_engine import (
+    IntelligentDecisionEngine,
+    SensorData,
+    AIDecision,
+    AlertLevel,
+    DEFAULT_CAGE_ID
+)
+from fuzzy_rules import RuleSetSource
+
+
+class CageState:
+    """State của một cage: engine, thiết bị và thống kê"""
+
+    def __init__(self, cage_id: str, engine: IntelligentDecisionEngine, iot_controller=None):
+        self.cage_id = cage_id
+        self.engine = engine
+        self.iot_controller = iot_controller  # None = chỉ cảnh báo, không điều khiển thiết bị
+        self.last_decision: Optional[AIDecision] = None
+        self.last_sensor_data: Optional[SensorData] = None
+        self.stats = {
+            'decisions_made': 0,
+            'actions_executed': 0,
+            'alerts_sent': 0,
+            'errors': 0
+        }
+
+    def summary(self) -> Dict:
+        """Tóm tắt ngắn (dùng cho danh sách cage)"""
+        decision, sensor = self.last_decision, self.last_sensor_data
+        return {
+            "cage_id": self.cage_id,
+            "alert_level": decision.alert_level.value if decision else None,
+            "temperature": sensor.temperature if sensor else None,
+            "humidity": sensor.humidity if sensor else None,
+            "last_seen": sensor.timestamp.isoformat() if sensor else None,
+            "has_devices": self.iot_controller is not None,
+            **self.stats
+        }
+
+    def to_dict(self) -> Dict:
+        """Trạng thái đầy đủ của cage"""
+        sensor = self.last_sensor_data
+        return {
+            **self.summary(),
+            "last_decision": self.last_decision.to_dict() if self.last_decision else None,
+            "last_sensor_data": {
+                "temperature": sensor.temperature,
+                "humidity": sensor.humidity,
+                "presence_energy": sensor.presence_energy,
+                "movement_energy": sensor.movement_energy,
+                "timestamp": sensor.timestamp.isoformat()
+            } if sensor else None,
+            "fan_commanded_on": self.engine.fan_commanded_on,
+            "sensor_anomalies": self.engine.anomaly_stage.stats(),
+            "ai_engine_stats": self.engine.get_statistics()
+        }
+
+
+# handler(cage, sensor_data, decision): ghi nhận decision, lên kế hoạch actions/alert (không I/O),
+# chạy trên worker của shard
+DecisionHandler = Callable[[CageState, SensorData, AIDecision], None]
+
+
+class CageRegistry:
+    """
+    Registry cage → CageState, chia shard và đánh giá song song theo shard.
+    Cage mới được tạo tự động khi có reading đầu tiên.
+    """
+
+    def __init__(self, rule_source: RuleSetSource = None, rules_path: Optional[str] = None,
+                 shards: int = 16, workers: int = 8, history_size: int = 100,
+                 controller_factory: Callable[[str], object] = None):
+        if shards < 1 or workers < 1:
+            raise ValueError("shards và workers phải >= 1")
+        self.rule_source = rule_source or RuleSetSource(rules_path)
+        self.history_size = history_size
+        self.controller_factory = controller_factory
+        self._shards: List[Dict[str, CageState]] = [{} for _ in range(shards)]
+        # Giữ trong suốt lúc xử lý shard: hai tick chồng nhau không chạy cùng cage song song
+        self._shard_locks = [Lock() for _ in range(shards)]
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cage-shard")
+        self.workers = workers
+        self._stats_lock = Lock()
+        self.tick_stats = {
+            'ticks': 0,
+            'readings_evaluated': 0,
+            'last_tick_ms': None,
+            'max_tick_ms': 0.0,
+            'total_tick_ms': 0.0
+        }
+
+    # ---------- registry ----------
+
+    def shard_of(self, cage_id: str) -> int:
+        """Shard cố định của cage (crc32 - ổn định giữa các lần chạy, khác hash())"""
+        return zlib.crc32(cage_id.encode('utf-8')) % len(self._shards)
+
+    def register(self, cage_id: str, engine: IntelligentDecisionEngine = None,
+                 iot_controller=None) -> CageState:
+        """Đăng ký cage với engine/thiết bị có sẵn (ví dụ cage mặc định của service)"""
+        cage = CageState(cage_id, engine or self._new_engine(),
+                         iot_controller if iot_controller is not None else self._new_controller(cage_id))
+        self._shards[self.shard_of(cage_id)][cage_id] = cage
+        return cage
+
+    def get(self, cage_id: str) -> Optional[CageState]:
+        return self._shards[self.shard_of(cage_id)].get(cage_id)
+
+    def get_or_create(self, cage_id: str) -> CageState:
+        shard = self._shards[self.shard_of(cage_id)]
+        cage = shard.get(cage_id)
+        if cage is None:
+            cage = shard.setdefault(cage_id, CageState(cage_id, self._new_engine(),
+                                                       self._new_controller(cage_id)))
+        return cage
+
+    def cages(self) -> List[CageState]:
+        return [cage for shard in self._shards for cage in list(shard.values())]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def __contains__(self, cage_id: str):
+        return self.get(cage_id) is not None
+
+    def _new_engine(self) -> IntelligentDecisionEngine:
+        return IntelligentDecisionEngine(rule_source=self.rule_source, history_size=self.history_size)
+
+    def _new_controller(self, cage_id: str):
+        return self.controller_factory(cage_id) if self.controller_factory else None
+
+    # ---------- evaluation ----------
+
+    def evaluate(self, readings: Iterable[SensorData],
+                 handler: DecisionHandler = None) -> List[Tuple[CageState, AIDecision]]:
+        """
+        Đánh giá một tick: readings gom theo shard, mỗi shard một task trên pool.
+        Trả về (cage, decision) theo thứ tự hoàn thành của từng shard.
+        """
+        started = time.perf_counter()
+        by_shard: Dict[int, List[SensorData]] = {}
+        count = 0
+        for reading in readings:
+            by_shard.setdefault(self.shard_of(reading.cage_id), []).append(reading)
+            count += 1
+
+        if len(by_shard) <= 1:
+            # Một shard: chạy luôn trên thread hiện tại, không tốn chi phí pool
+            results = [r for shard, batch in by_shard.items()
+                       for r in self._run_shard(shard, batch, handler)]
+        else:
+            futures = [self._pool.submit(self._run_shard, shard, batch, handler)
+                       for shard, batch in by_shard.items()]
+            results = [r for future in futures for r in future.result()]
+
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        with self._stats_lock:
+            stats = self.tick_stats
+            stats['ticks'] += 1
+            stats['readings_evaluated'] += count
+            stats['last_tick_ms'] = round(elapsed_ms, 3)
+            stats['max_tick_ms'] = round(max(stats['max_tick_ms'], elapsed_ms), 3)
+            stats['total_tick_ms'] += elapsed_ms
+        return results
+
+    def _run_shard(self, shard: int, readings: List[SensorData],
+                   handler: Optional[DecisionHandler]) -> List[Tuple[CageState, AIDecision]]:
+        results = []
+        with self._shard_locks[shard]:
+            for sensor_data in readings:
+                cage = self.get_or_create(sensor_data.cage_id)
+                try:
+                    decision = cage.engine.analyze(sensor_data)
+                    cage.stats['decisions_made'] += 1
+                    cage.last_decision = decision
+                    cage.last_sensor_data = sensor_data
+                    if handler:
+                        handler(cage, sensor_data, decision)
+                    results.append((cage, decision))
+                except Exception as e:
+                    # Lỗi của một cage không làm hỏng cả shard
+                    cage.stats['errors'] += 1
+                    print(f"❌ Error evaluating cage {cage.cage_id}: {e}")
+        return results
+
+    # ---------- stats ----------
+
+    def cage_stats(self, cage_id: str) -> Optional[Dict]:
+        cage = self.get(cage_id)
+        return cage.to_dict() if cage else None
+
+    def stats(self) -> Dict:
+        """Thống kê tổng hợp trên mọi cage"""
+        cages = self.cages()
+        totals = {'decisions_made': 0, 'actions_executed': 0, 'alerts_sent': 0, 'errors': 0}
+        levels = {level.value: 0 for level in AlertLevel}
+        alerting = []
+        for cage in cages:
+            for key in totals:
+                totals[key] += cage.stats[key]
+            if cage.last_decision:
+                level = cage.last_decision.alert_level
+                levels[level.value] += 1
+                if level != AlertLevel.SAFE:
+                    alerting.append(cage.cage_id)
+
+        with self._stats_lock:
+            ticks = dict(self.tick_stats)
+        total_ms = ticks.pop('total_tick_ms')
+        ticks['mean_tick_ms'] = round(total_ms / ticks['ticks'], 3) if ticks['ticks'] else None
+        return {
+            "cages": len(cages),
+            "shards": len(self._shards),
+            "workers": self.workers,
+            "shard_sizes": [len(shard) for shard in self._shards],
+            "current_alert_levels": levels,
+            "cages_alerting": sorted(alerting),
+            **totals,
+            **ticks,
+            "rule_set": self.rule_source.info()
+        }
+
+    def shutdown(self):
+        """Dừng pool; nếu đây là singleton thì bỏ nó để get_cage_registry() tạo registry mới"""
+        global _cage_registry
+        self._pool.shutdown(wait=False)
+        if _cage_registry is self:
+            _cage_registry = None
+
+
+# Singleton instance
+_cage_registry = None
+
+def get_cage_registry(rule_source: RuleSetSource = None, **kwargs) -> CageRegistry:
+    """Get hoặc tạo cage registry"""
+    global _cage_registry
+    if _cage_registry is None:
+        _cage_registry = CageRegistry(rule_source, **kwargs)
+    return _cage_registry
+
+
+if __name__ == "__main__":
+    import random
+
+    registry = CageRegistry(shards=16, workers=8)
+    cage_ids = [f"cage-{i:03d}" for i in range(200)]
+    for tick in range(5):
+        readings = [SensorData(random.uniform(20, 38), random.uniform(40, 90),
+                               random.randint(0, 100), random.randint(0, 100), cage_id=cid)
+                    for cid in cage_ids]
+        registry.evaluate(readings)
+    stats = registry.stats()
+    print(f"🐾 {stats['cages']} cages, {stats['readings_evaluated']} readings, "
+          f"mean tick {stats['mean_tick_ms']} ms")
+    print(f"   Alert levels: {stats['current_alert_levels']}")
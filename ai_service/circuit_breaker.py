@@ -0,0 +1,104 @@
+"""
+PetZone Circuit Breaker - Ngắt mạch cho từng endpoint (backend, mỗi ESP32, ...)
+===============================================================================
+Khi ESP32 offline, mỗi lệnh phải đợi hết connect timeout; backend down thì mọi fetch/
+alert cũng vậy. Circuit breaker theo dõi lỗi liên tiếp của từng host:
+
+- closed:     gửi request bình thường, đếm lỗi liên tiếp (lỗi kết nối, timeout, 5xx)
+- open:       sau `failure_threshold` lỗi liên tiếp → từ chối ngay (CircuitOpen, vài µs)
+- half_open:  hết `reset_timeout` → cho một request thử; thành công → closed, lỗi → open lại
+"""
+
+import time
+from threading import Lock
+from typing import Dict
+
+import requests
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Cấu hình mặc định
+BREAKER_FAILURE_THRESHOLD = 3  # Số lỗi liên tiếp để mở mạch
+BREAKER_RESET_TIMEOUT = 30.0   # Giây ở trạng thái open trước khi cho request thử (half-open)
+
+
+class CircuitOpen(requests.exceptions.ConnectionError):
+    """Request bị từ chối vì mạch tới host đang mở (code bắt RequestException xử lý như lỗi kết nối)"""
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"Circuit open for {host} (retry in {retry_in:.1f}s)")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Breaker của một endpoint, thread-safe (nhiều I/O worker gọi cùng host)"""
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT, half_open_max: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max  # Số request thử đồng thời ở half-open
+        self.state = CLOSED
+        self._lock = Lock()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self.stats = {
+            'opened': 0,
+            'short_circuited': 0,
+            'last_failure': None
+        }
+
+    def allow(self) -> bool:
+        """True nếu request được gửi; False → caller fail fast"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.stats['short_circuited'] += 1
+                    return False
+                self.state = HALF_OPEN
+                self._probes = 0
+            if self._probes < self.half_open_max:
+                self._probes += 1
+                return True
+            self.stats['short_circuited'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self._failures = 0
+
+    def record_failure(self, reason: str = None):
+        with self._lock:
+            self._failures += 1
+            self.stats['last_failure'] = reason
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.stats['opened'] += 1
+                    print(f"🔌 Circuit open: {self.name} ({self._failures} consecutive failures)")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def retry_in(self) -> float:
+        """Số giây tới lần thử half-open (0 nếu không ở trạng thái open)"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            failures = self._failures
+            stats = dict(self.stats)
+        return {
+            'state': self.state,
+            'consecutive_failures': failures,
+            'retry_in_s': round(self.retry_in(), 1),
+            **stats
+        }
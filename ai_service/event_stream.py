@@ -0,0 +1,150 @@
+"""
+PetZone Event Stream - Server-sent events cho decision, trạng thái thiết bị, alert
+=================================================================================
+Frontend poll /status tốn request và trễ tới một chu kỳ poll. /events đẩy mỗi event
+ngay khi xảy ra:
+
+- Mỗi event serialize MỘT lần thành frame SSE (bytes), rồi fan-out cùng bytes đó tới
+  mọi subscriber
+- Mỗi client có hàng đợi bounded; client chậm làm đầy hàng đợi bị ngắt (không chặn
+  publisher, không giữ bộ nhớ vô hạn) - EventSource tự kết nối lại
+- Replay buffer nhỏ: client kết nối lại với Last-Event-ID nhận các event đã lỡ
+  (nếu còn trong buffer)
+
+Event id dạng "<instance>-<seq>": id của lần chạy trước (service restart) → replay cả buffer.
+"""
+
+import json
+import queue
+import uuid
+from collections import deque
+from threading import Lock
+from typing import Dict, Iterator, List, Optional
+
+EVENT_REPLAY_SIZE = 256  # Số event gần nhất giữ lại cho Last-Event-ID
+
+
+class Subscription:
+    """Một client SSE: hàng đợi frame bounded, None = stream kết thúc (bị ngắt/đóng)"""
+
+    def __init__(self, broker: 'EventBroker', maxsize: int):
+        self.broker = broker
+        self.queue = queue.Queue(maxsize)
+        self.dropped = False
+
+    def _drop(self):
+        """Ngắt client chậm: bỏ backlog và báo stream kết thúc (gọi khi đã rời broker)"""
+        self.dropped = True
+        with self.queue.mutex:
+            self.queue.queue.clear()
+        self.queue.put_nowait(None)
+
+    def stream(self, heartbeat: float) -> Iterator[bytes]:
+        """Frame SSE cho response; comment keepalive khi im lặng `heartbeat` giây"""
+        try:
+            while True:
+                try:
+                    frame = self.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield b': keepalive\n\n'
+                    continue
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    """Fan-out frame SSE tới các subscriber, thread-safe (shard worker, I/O worker cùng publish)"""
+
+    def __init__(self, replay_size: int = EVENT_REPLAY_SIZE):
+        self._instance = uuid.uuid4().hex[:8]
+        self._lock = Lock()
+        self._seq = 0
+        self._replay = deque(maxlen=replay_size)  # (seq, frame)
+        self._subscribers: List[Subscription] = []
+        self.stats = {
+            'published': 0,
+            'delivered': 0,
+            'dropped_clients': 0,
+            'replayed': 0,
+            'rejected_clients': 0
+        }
+
+    @staticmethod
+    def frame(event_id: Optional[str], event: str, data: bytes) -> bytes:
+        head = f"id: {event_id}\nevent: {event}\n" if event_id else f"event: {event}\n"
+        return head.encode('utf-8') + b'data: ' + data + b'\n\n'
+
+    def publish(self, event: str, data: Dict) -> str:
+        """Serialize một lần, lưu vào replay buffer và đẩy tới mọi subscriber; trả về event id"""
+        body = json.dumps(data, ensure_ascii=False, default=str).encode('utf-8')
+        with self._lock:
+            self._seq += 1
+            event_id = f"{self._instance}-{self._seq}"
+            frame = self.frame(event_id, event, body)
+            self._replay.append((self._seq, frame))
+            self.stats['published'] += 1
+            slow = []
+            for subscription in self._subscribers:
+                try:
+                    subscription.queue.put_nowait(frame)
+                    self.stats['delivered'] += 1
+                except queue.Full:
+                    slow.append(subscription)
+            for subscription in slow:
+                self._subscribers.remove(subscription)
+                self.stats['dropped_clients'] += 1
+        for subscription in slow:
+            subscription._drop()
+        if slow:
+            print(f"⚠️ Dropped {len(slow)} slow event stream client(s)")
+        return event_id
+
+    def subscribe(self, last_event_id: Optional[str] = None, maxsize: int = 64,
+                  max_clients: Optional[int] = None) -> Optional[Subscription]:
+        """
+        Đăng ký client mới (None nếu đã đủ max_clients). Có last_event_id → các event sau id
+        đó trong replay buffer được xếp vào hàng đợi trước (đăng ký và replay cùng một lock
+        nên không lỡ/trùng event nào).
+        """
+        subscription = Subscription(self, maxsize)
+        with self._lock:
+            if max_clients is not None and len(self._subscribers) >= max_clients:
+                self.stats['rejected_clients'] += 1
+                return None
+            if last_event_id:
+                instance, _, seq = last_event_id.partition('-')
+                after = int(seq) if instance == self._instance and seq.isdigit() else 0
+                missed = [frame for event_seq, frame in self._replay if event_seq > after]
+                for frame in missed[-maxsize:]:
+                    subscription.queue.put_nowait(frame)
+                self.stats['replayed'] += len(missed[-maxsize:])
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'buffered_events': len(self._replay),
+                'last_event_id': f"{self._instance}-{self._seq}" if self._seq else None,
+                **self.stats
+            }
+
+
+# Singleton instance
+_event_broker = None
+
+def get_event_broker(replay_size: int = EVENT_REPLAY_SIZE) -> EventBroker:
+    """Get hoặc tạo event broker dùng chung (replay_size chỉ có hiệu lực ở lần gọi đầu)"""
+    global _event_broker
+    if _event_broker is None:
+        _event_broker = EventBroker(replay_size)
+    return _event_broker
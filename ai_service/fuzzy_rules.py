@@ -0,0 +1,635 @@
+"""
+PetZone Fuzzy Rule Base - Declarative rules compiled to matrix operations
+=========================================================================
+Rule set (membership breakpoints, risk weights, weight matrix, ngưỡng suy luận)
+được khai báo trong file JSON và compile thành các ma trận NumPy.
+Một lần đánh giá = vài phép nhân ma trận, dùng chung cho 1 reading và cho batch.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+TEMPERATURE_SETS = ('very_cold', 'cold', 'comfortable', 'warm', 'very_hot')
+HUMIDITY_SETS = ('very_dry', 'dry', 'comfortable', 'humid', 'very_humid')
+PET_STATUS_SETS = ('no_detection', 'empty_cage', 'pet_sleeping', 'pet_active', 'pet_restless')
+TEMPERATURE_RATE_SETS = ('falling', 'stable', 'rising', 'rising_fast')
+
+# Thứ tự alert level theo mã số (dùng cho kết quả vectorized)
+ALERT_LEVEL_ORDER = ('safe', 'warning', 'danger', 'critical')
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fuzzy_rules.json')
+
+# Rule set mặc định - trùng với các giá trị domain knowledge ban đầu của engine
+DEFAULT_RULE_CONFIG = {
+    "name": "default",
+    "temperature": {
+        "sets": {
+            "very_cold": {"shape": "trimf", "params": [-10, 0, 10], "risk": 0.9},
+            "cold": {"shape": "trimf", "params": [5, 10, 18], "risk": 0.7},
+            "comfortable": {"shape": "trapmf", "params": [18, 22, 28, 32], "risk": 0.0},
+            "warm": {"shape": "trimf", "params": [28, 32, 35], "risk": 0.6},
+            "very_hot": {"shape": "trimf", "params": [32, 38, 45], "risk": 1.0}
+        },
+        "needs_cooling": {"warm": 0.3, "very_hot": 0.1}
+    },
+    "humidity": {
+        "sets": {
+            "very_dry": {"shape": "trimf", "params": [0, 20, 40], "risk": 0.8},
+            "dry": {"shape": "trimf", "params": [30, 45, 55], "risk": 0.6},
+            "comfortable": {"shape": "trapmf", "params": [50, 55, 75, 80], "risk": 0.0},
+            "humid": {"shape": "trimf", "params": [75, 82, 90], "risk": 0.6},
+            "very_humid": {"shape": "trimf", "params": [85, 92, 100], "risk": 0.9}
+        }
+    },
+    "pet_status": {
+        "risk": {
+            "no_detection": 0.9,
+            "empty_cage": 0.3,
+            "pet_sleeping": 0.0,
+            "pet_active": 0.0,
+            "pet_restless": 0.8
+        },
+        "sleeping_factor": 0.8,
+        "restless_threshold": 0.8
+    },
+    "weights": {
+        "temperature_critical": 0.9,
+        "humidity_critical": 0.7,
+        "pet_presence_critical": 0.8,
+        "combined_risk": 0.85
+    },
+    "inference": {
+        "hot_degree": {"warm": 0.5, "very_hot": 1.0},
+        "fan_on_threshold": 0.4,
+        "fan_off_threshold": 0.2,
+        "emergency_threshold": 0.8,
+        "notify_threshold": 0.5,
+        "notify_pet_states": ["no_detection", "pet_restless"]
+    },
+    "trend": {
+        "temperature_rate": {
+            "sets": {
+                "falling": {"shape": "trapmf", "params": [-100, -100, -0.6, -0.2]},
+                "stable": {"shape": "trimf", "params": [-0.4, 0, 0.4]},
+                "rising": {"shape": "trapmf", "params": [0.2, 0.6, 1.0, 1.5]},
+                "rising_fast": {"shape": "trapmf", "params": [0.8, 1.5, 100, 100]}
+            }
+        },
+        "hot_degree": {"rising": 0.3, "rising_fast": 0.6},
+        "gate": [26, 30]
+    },
+    "forecast": {
+        "horizon_seconds": 120,
+        "weight": 1.0
+    },
+    "alert_levels": {"warning": 0.3, "danger": 0.6, "critical": 0.8}
+}
+
+
+class RuleConfigError(ValueError):
+    """Rule config không hợp lệ"""
+
+
+def trapmf_vec(x: np.ndarray, params: np.ndarray) -> np.ndarray:
+    """
+    Trapezoidal membership vectorized.
+    x có shape (...,), params có shape (..., 4) với cột (a, b, c, d) - broadcast tự do,
+    ví dụ x[:, None] với params (S, 4) cho ra ma trận (N, S).
+    Triangular (a, b, c) được biểu diễn là trapezoid (a, b, b, c).
+    Cùng quy ước biên với FuzzyLogicEngine._trimf/_trapmf.
+    """
+    a, b, c, d = params[..., 0], params[..., 1], params[..., 2], params[..., 3]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Cạnh lên / cạnh xuống; cạnh thẳng đứng (b == a, d == c) cho ±inf
+        # và được loại ở bước min/clip, NaN tại x == a bị loại ở bước where cuối
+        m = np.minimum((x - a) / (b - a), (d - x) / (d - c))
+    np.clip(m, 0.0, 1.0, out=m)
+    return np.where((x <= a) | (x >= d), 0.0, m)
+
+
+def ordered_dot(m: np.ndarray, w: np.ndarray) -> np.ndarray:
+    """
+    m @ w với thứ tự cộng cố định từ trái sang phải (không FMA/pairwise của BLAS),
+    để kết quả trùng bit với bản tính scalar - quan trọng khi risk nằm đúng ngưỡng.
+    """
+    total = m[..., 0] * w[..., 0]
+    for k in range(1, m.shape[-1]):
+        total = total + m[..., k] * w[..., k]
+    return total
+
+
+def _set_params(name: str, spec: Dict) -> Tuple[float, float, float, float]:
+    shape = spec.get('shape', 'trimf')
+    params = [float(v) for v in spec.get('params', [])]
+    if shape == 'trimf' and len(params) == 3:
+        a, b, c = params
+        params = [a, b, b, c]
+    elif not (shape == 'trapmf' and len(params) == 4):
+        raise RuleConfigError(f"Set '{name}': shape '{shape}' cần 3 (trimf) hoặc 4 (trapmf) tham số")
+    if not params[0] <= params[1] <= params[2] <= params[3]:
+        raise RuleConfigError(f"Set '{name}': breakpoints phải tăng dần, nhận {params}")
+    return tuple(params)
+
+
+def _compile_variable(section: Dict, expected: Sequence[str], label: str):
+    sets = section.get('sets') if section else None
+    if not sets or set(sets) != set(expected):
+        raise RuleConfigError(f"'{label}.sets' phải gồm đúng các tập {list(expected)}")
+    names = tuple(sets.keys())
+    params = np.array([_set_params(n, sets[n]) for n in names], dtype=float)
+    risk = np.array([float(sets[n].get('risk', 0.0)) for n in names], dtype=float)
+    return names, params, risk
+
+
+def _vector(names: Sequence[str], values: Dict[str, float], default: float, label: str) -> np.ndarray:
+    unknown = set(values) - set(names)
+    if unknown:
+        raise RuleConfigError(f"'{label}' tham chiếu tập không tồn tại: {sorted(unknown)}")
+    return np.array([float(values.get(n, default)) for n in names], dtype=float)
+
+
+@dataclass
+class RuleEvaluation:
+    """Kết quả đánh giá vectorized - mỗi mảng có N phần tử theo trục đầu"""
+    temperature_membership: np.ndarray   # (N, 5)
+    humidity_membership: np.ndarray      # (N, 5)
+    pet_membership: np.ndarray           # (N, 5)
+    risks: np.ndarray                    # (N, 3): temperature, humidity, pet
+    combined_risk: np.ndarray            # (N,)
+    alert_codes: np.ndarray              # (N,) index vào ALERT_LEVEL_ORDER
+    hot_degree: np.ndarray               # (N,) đã gồm trend_boost
+    trend_boost: np.ndarray              # (N,) phần hot_degree đến từ xu hướng nhiệt độ
+    hot_forecast: np.ndarray             # (N,) hot_degree tính trên nhiệt độ dự báo
+    needs_cooling: np.ndarray            # (N,) bool
+    fan_on: np.ndarray                   # (N,) bool - max(hiện tại, dự báo) > fan_on_threshold
+    fan_off: np.ndarray                  # (N,) bool - max(hiện tại, dự báo) < fan_off_threshold
+    emergency: np.ndarray                # (N,) bool
+    notify_risk: np.ndarray              # (N,) bool - rule 2 (không emergency)
+    notify_pet: np.ndarray               # (N,) bool - rule 3
+
+    def __len__(self):
+        return len(self.combined_risk)
+
+    @property
+    def temperature_risk(self) -> np.ndarray:
+        return self.risks[:, 0]
+
+    @property
+    def humidity_risk(self) -> np.ndarray:
+        return self.risks[:, 1]
+
+    @property
+    def pet_risk(self) -> np.ndarray:
+        return self.risks[:, 2]
+
+
+@dataclass(frozen=True, eq=False)
+class CompiledRuleSet:
+    """Rule set đã compile thành ma trận NumPy"""
+    version: str
+    name: str
+    config: Dict
+    temperature_sets: Tuple[str, ...]
+    temperature_params: np.ndarray
+    temperature_risk: np.ndarray
+    cooling_thresholds: np.ndarray
+    humidity_sets: Tuple[str, ...]
+    humidity_params: np.ndarray
+    humidity_risk: np.ndarray
+    pet_sets: Tuple[str, ...]
+    pet_risk: np.ndarray
+    sleeping_factor: float
+    restless_threshold: float
+    aspect_weights: np.ndarray           # (3,) temperature, humidity, pet
+    aspect_weight_sum: float
+    hot_weights: np.ndarray              # (5,) theo temperature_sets
+    fan_on_threshold: float
+    fan_off_threshold: float
+    emergency_threshold: float
+    notify_threshold: float
+    notify_pet_mask: np.ndarray          # (5,) bool theo pet_sets
+    alert_thresholds: np.ndarray         # (3,) warning, danger, critical
+    rate_sets: Tuple[str, ...] = ()
+    rate_params: Optional[np.ndarray] = None       # (4, 4) membership của slope °C/phút
+    rate_hot_weights: Optional[np.ndarray] = None  # (4,) đóng góp vào hot_degree
+    rate_gate: Tuple[float, float] = (0.0, 0.0)    # Nhiệt độ bắt đầu / đầy đủ tác dụng trend
+    forecast_horizon: float = 0.0                  # Giây - 0 = không dùng dự báo
+    forecast_weight: float = 0.0
+
+    @property
+    def weight_matrix(self) -> Dict[str, float]:
+        return dict(self.config['weights'])
+
+    def temperature_membership(self, temp) -> np.ndarray:
+        x = np.asarray(temp, dtype=float)
+        return trapmf_vec(x[..., None], self.temperature_params)
+
+    def humidity_membership(self, humidity) -> np.ndarray:
+        x = np.asarray(humidity, dtype=float)
+        return trapmf_vec(x[..., None], self.humidity_params)
+
+    def pet_membership(self, presence, movement) -> np.ndarray:
+        """Membership trạng thái thú cưng - cùng công thức với bản scalar ban đầu"""
+        presence = np.asarray(presence, dtype=float)
+        p_norm = presence / 100.0
+        m_norm = np.asarray(movement, dtype=float) / 100.0
+        detected = presence > 0
+        active = p_norm * m_norm
+        restless = (p_norm > self.restless_threshold) & (m_norm > self.restless_threshold)
+        return np.stack([
+            np.where(presence == 0, 1.0, 0.0),
+            np.where(detected, np.clip(p_norm, 0.0, 1.0) * (1 - m_norm), 0.0),
+            p_norm * (1 - m_norm) * self.sleeping_factor,
+            active,
+            np.where(restless, active, 0.0),
+        ], axis=-1)
+
+    def hot_degree(self, temperature_membership: np.ndarray) -> np.ndarray:
+        return ordered_dot(temperature_membership, self.hot_weights)
+
+    def rate_membership(self, rate) -> np.ndarray:
+        """Membership của slope nhiệt độ; NaN (chưa đủ dữ liệu) → 0 ở mọi tập"""
+        x = np.asarray(rate, dtype=float)[..., None]
+        return np.where(np.isnan(x), 0.0, trapmf_vec(x, self.rate_params))
+
+    def trend_boost(self, temperature, rate) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Phần hot_degree do nhiệt độ đang tăng: chỉ có tác dụng khi nhiệt độ đã
+        vào vùng gate (ví dụ 26-30°C) để không bật quạt khi chuồng còn mát.
+        """
+        temperature = np.asarray(temperature, dtype=float)
+        if self.rate_params is None or rate is None:
+            return np.zeros_like(temperature), None
+        rate_m = self.rate_membership(np.broadcast_to(rate, temperature.shape))
+        low, high = self.rate_gate
+        span = high - low
+        gate = np.clip((temperature - low) / span, 0.0, 1.0) if span > 0 else (temperature >= low) * 1.0
+        return gate * ordered_dot(rate_m, self.rate_hot_weights), rate_m
+
+    def alert_codes(self, combined_risk) -> np.ndarray:
+        return np.searchsorted(self.alert_thresholds, combined_risk, side='right')
+
+    def forecast_hot_degree(self, forecast_temperature) -> np.ndarray:
+        """hot_degree của nhiệt độ dự báo (NaN = chưa có dự báo → 0)"""
+        fc = np.asarray(forecast_temperature, dtype=float)
+        hot = self.hot_degree(self.temperature_membership(np.nan_to_num(fc)))
+        return np.where(np.isnan(fc), 0.0, hot * self.forecast_weight)
+
+    def evaluate(self, temperature, humidity, presence, movement,
+                 temperature_rate=None, forecast_temperature=None) -> RuleEvaluation:
+        """
+        Đánh giá toàn bộ rule base cho 1 hoặc N readings.
+        temperature_rate: slope nhiệt độ (°C/phút) từ trend features, None/NaN = không có
+        forecast_temperature: nhiệt độ dự báo sau forecast_horizon giây, None/NaN = không có
+        """
+        temperature = np.atleast_1d(np.asarray(temperature, dtype=float))
+        temp_m = self.temperature_membership(temperature)
+        hum_m = self.humidity_membership(np.atleast_1d(humidity))
+        pet_m = self.pet_membership(np.atleast_1d(presence), np.atleast_1d(movement))
+
+        risks = np.stack([
+            ordered_dot(temp_m, self.temperature_risk),
+            ordered_dot(hum_m, self.humidity_risk),
+            ordered_dot(pet_m, self.pet_risk),
+        ], axis=-1)
+        combined = ordered_dot(risks, self.aspect_weights) / self.aspect_weight_sum
+        boost, _ = self.trend_boost(
+            temperature, None if temperature_rate is None else np.atleast_1d(temperature_rate))
+        hot = self.hot_degree(temp_m) + boost
+        if forecast_temperature is None or self.forecast_weight <= 0:
+            hot_fc = np.zeros_like(hot)
+        else:
+            hot_fc = self.forecast_hot_degree(np.atleast_1d(forecast_temperature))
+        # Quạt điều khiển theo giá trị xấu hơn giữa hiện tại và dự báo
+        hot_control = np.maximum(hot, hot_fc)
+
+        emergency = ((risks[:, 0] > self.emergency_threshold) |
+                     (risks[:, 2] > self.emergency_threshold))
+        notify_risk = ~emergency & (risks > self.notify_threshold).any(axis=1)
+        notify_pet = self.notify_pet_mask[np.argmax(pet_m, axis=1)]
+
+        return RuleEvaluation(
+            temperature_membership=temp_m,
+            humidity_membership=hum_m,
+            pet_membership=pet_m,
+            risks=risks,
+            combined_risk=combined,
+            alert_codes=self.alert_codes(combined),
+            hot_degree=hot,
+            trend_boost=boost,
+            hot_forecast=hot_fc,
+            needs_cooling=(temp_m > self.cooling_thresholds).any(axis=1),
+            fan_on=hot_control > self.fan_on_threshold,
+            fan_off=hot_control < self.fan_off_threshold,
+            emergency=emergency,
+            notify_risk=notify_risk,
+            notify_pet=notify_pet,
+        )
+
+    def membership_dict(self, variable: str, row: np.ndarray) -> Dict[str, float]:
+        names = {
+            'temperature': self.temperature_sets,
+            'humidity': self.humidity_sets,
+            'pet_status': self.pet_sets,
+            'temperature_rate': self.rate_sets,
+        }[variable]
+        return dict(zip(names, row.tolist()))
+
+
+def config_hash(config: Dict) -> str:
+    """Content hash của rule config (giữ thứ tự key vì thứ tự tập ảnh hưởng tie-break)"""
+    canonical = json.dumps(config, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+_compiled_cache: 'OrderedDict[str, CompiledRuleSet]' = OrderedDict()
+_cache_lock = Lock()
+COMPILED_CACHE_SIZE = 8  # Rule set compile giữ lại (LRU) - hot-reload/candidate cũ không giữ mãi
+cache_stats = {'hits': 0, 'misses': 0}
+
+
+def compile_rule_set(config: Dict) -> CompiledRuleSet:
+    """Compile rule config thành ma trận - cache theo content hash"""
+    digest = config_hash(config)
+    with _cache_lock:
+        cached = _compiled_cache.get(digest)
+        if cached is not None:
+            _compiled_cache.move_to_end(digest)
+            cache_stats['hits'] += 1
+            return cached
+        cache_stats['misses'] += 1
+
+    temp_names, temp_params, temp_risk = _compile_variable(
+        config.get('temperature'), TEMPERATURE_SETS, 'temperature')
+    hum_names, hum_params, hum_risk = _compile_variable(
+        config.get('humidity'), HUMIDITY_SETS, 'humidity')
+
+    pet = config.get('pet_status', {})
+    pet_risk_cfg = pet.get('risk', {})
+    if set(pet_risk_cfg) != set(PET_STATUS_SETS):
+        raise RuleConfigError(f"'pet_status.risk' phải gồm đúng các tập {list(PET_STATUS_SETS)}")
+
+    weights = config.get('weights', {})
+    aspect = np.array([
+        float(weights.get('temperature_critical', 0.0)),
+        float(weights.get('humidity_critical', 0.0)),
+        float(weights.get('pet_presence_critical', 0.0)),
+    ])
+    if aspect.sum() <= 0:
+        raise RuleConfigError("'weights' phải có tổng trọng số dương")
+
+    inference = config.get('inference', {})
+    levels = config.get('alert_levels', {})
+    alert_thresholds = np.array([float(levels[k]) for k in ('warning', 'danger', 'critical')])
+    if np.any(np.diff(alert_thresholds) < 0):
+        raise RuleConfigError("'alert_levels' phải tăng dần: warning <= danger <= critical")
+
+    notify_states = inference.get('notify_pet_states', [])
+
+    forecast = config.get('forecast') or {}
+    horizon = float(forecast.get('horizon_seconds', 0))
+    if horizon < 0:
+        raise RuleConfigError("'forecast.horizon_seconds' không được âm")
+
+    trend = config.get('trend')
+    rate_fields = {}
+    if trend:
+        rate_names, rate_params, _ = _compile_variable(
+            trend.get('temperature_rate'), TEMPERATURE_RATE_SETS, 'trend.temperature_rate')
+        gate = [float(v) for v in trend.get('gate', [0, 0])]
+        if len(gate) != 2 or gate[0] > gate[1]:
+            raise RuleConfigError("'trend.gate' phải là [bắt đầu, đầy đủ] tăng dần")
+        rate_fields = dict(
+            rate_sets=rate_names,
+            rate_params=rate_params,
+            rate_hot_weights=_vector(rate_names, trend.get('hot_degree', {}), 0.0, 'trend.hot_degree'),
+            rate_gate=tuple(gate),
+        )
+    compiled = CompiledRuleSet(
+        version=digest[:12],
+        name=config.get('name', 'unnamed'),
+        config=config,
+        temperature_sets=temp_names,
+        temperature_params=temp_params,
+        temperature_risk=temp_risk,
+        cooling_thresholds=_vector(temp_names, config['temperature'].get('needs_cooling', {}),
+                                   np.inf, 'temperature.needs_cooling'),
+        humidity_sets=hum_names,
+        humidity_params=hum_params,
+        humidity_risk=hum_risk,
+        pet_sets=PET_STATUS_SETS,
+        pet_risk=_vector(PET_STATUS_SETS, pet_risk_cfg, 0.0, 'pet_status.risk'),
+        sleeping_factor=float(pet.get('sleeping_factor', 0.8)),
+        restless_threshold=float(pet.get('restless_threshold', 0.8)),
+        aspect_weights=aspect,
+        aspect_weight_sum=sum(aspect.tolist()),
+        hot_weights=_vector(temp_names, inference.get('hot_degree', {}), 0.0, 'inference.hot_degree'),
+        fan_on_threshold=float(inference.get('fan_on_threshold', 0.4)),
+        fan_off_threshold=float(inference.get('fan_off_threshold', 0.2)),
+        emergency_threshold=float(inference.get('emergency_threshold', 0.8)),
+        notify_threshold=float(inference.get('notify_threshold', 0.5)),
+        notify_pet_mask=np.array([s in notify_states for s in PET_STATUS_SETS]),
+        alert_thresholds=alert_thresholds,
+        forecast_horizon=horizon,
+        forecast_weight=float(forecast.get('weight', 1.0)) if horizon > 0 else 0.0,
+        **rate_fields
+    )
+
+    with _cache_lock:
+        _compiled_cache[digest] = compiled
+        while len(_compiled_cache) > COMPILED_CACHE_SIZE:
+            _compiled_cache.popitem(last=False)
+    return compiled
+
+
+# ========== DECISION SURFACE ==========
+
+# Bit trong mảng flags của decision surface
+SURFACE_FLAG_BITS = {'fan_on': 1, 'emergency': 2, 'notify': 4}
+SURFACE_MAX_STEPS = 500
+
+_surface_cache: 'OrderedDict[Tuple, bytes]' = OrderedDict()
+_surface_lock = Lock()
+SURFACE_CACHE_SIZE = 32
+surface_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def _axis(start: float, stop: float, steps: int, label: str) -> np.ndarray:
+    if not 2 <= steps <= SURFACE_MAX_STEPS:
+        raise ValueError(f"Lưới {label}: số bước phải trong khoảng 2..{SURFACE_MAX_STEPS}, nhận {steps}")
+    if not stop > start:
+        raise ValueError(f"Lưới {label}: max phải lớn hơn min")
+    return np.linspace(start, stop, steps)
+
+
+def _encode_surface(array: np.ndarray, encoding: str):
+    if encoding == 'base64':
+        return base64.b64encode(np.ascontiguousarray(array, dtype=np.uint8).tobytes()).decode('ascii')
+    return array.ravel().tolist()
+
+
+def decision_surface(rules: CompiledRuleSet, temperature: Tuple[float, float, int],
+                     humidity: Tuple[float, float, int], presence: float, movement: float,
+                     encoding: str = 'base64') -> Tuple[bytes, bool]:
+    """
+    Đánh giá rule set trên lưới nhiệt độ x độ ẩm (một lần vectorized, không trend/forecast)
+    cho một trạng thái presence/movement cố định. Trả về (JSON bytes, cache hit).
+
+    Kết quả được cache theo (rule set version, lưới, presence, movement, encoding):
+    rule set đổi → version đổi → tự tính lại. Mảng theo thứ tự row-major,
+    hàng = độ ẩm, cột = nhiệt độ. encoding='base64': uint8 (risk lượng tử hoá /255),
+    encoding='list': mảng JSON.
+    """
+    if encoding not in ('base64', 'list'):
+        raise ValueError("'encoding' phải là 'base64' hoặc 'list'")
+    key = (rules.version, tuple(temperature), tuple(humidity), float(presence), float(movement), encoding)
+    with _surface_lock:
+        cached = _surface_cache.get(key)
+        if cached is not None:
+            _surface_cache.move_to_end(key)
+            surface_cache_stats['hits'] += 1
+            return cached, True
+        surface_cache_stats['misses'] += 1
+
+    temps = _axis(*temperature, 'temperature')
+    hums = _axis(*humidity, 'humidity')
+    grid_t, grid_h = np.meshgrid(temps, hums)
+    n = grid_t.size
+    evaluation = rules.evaluate(grid_t.ravel(), grid_h.ravel(),
+                                np.full(n, float(presence)), np.full(n, float(movement)))
+    shape = (len(hums), len(temps))
+
+    flags = (evaluation.fan_on * SURFACE_FLAG_BITS['fan_on'] +
+             evaluation.emergency * SURFACE_FLAG_BITS['emergency'] +
+             (evaluation.notify_risk | evaluation.notify_pet) * SURFACE_FLAG_BITS['notify'])
+    if encoding == 'base64':
+        risk = np.rint(np.clip(evaluation.combined_risk, 0.0, 1.0) * 255)
+        risk_scale = 1 / 255
+    else:
+        risk = np.round(evaluation.combined_risk, 3)
+        risk_scale = 1.0
+
+    payload = {
+        "rule_set_version": rules.version,
+        "temperature": {"min": temperature[0], "max": temperature[1], "steps": temperature[2]},
+        "humidity": {"min": humidity[0], "max": humidity[1], "steps": humidity[2]},
+        "presence_energy": presence,
+        "movement_energy": movement,
+        "shape": list(shape),
+        "layout": "row-major: rows = humidity, columns = temperature",
+        "encoding": encoding,
+        "alert_levels": list(ALERT_LEVEL_ORDER),
+        "alert_codes": _encode_surface(evaluation.alert_codes.reshape(shape), encoding),
+        "combined_risk": _encode_surface(risk.reshape(shape), encoding),
+        "combined_risk_scale": risk_scale,
+        "flags": _encode_surface(flags.reshape(shape), encoding),
+        "flag_bits": SURFACE_FLAG_BITS,
+    }
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+    with _surface_lock:
+        _surface_cache[key] = body
+        while len(_surface_cache) > SURFACE_CACHE_SIZE:
+            _surface_cache.popitem(last=False)
+    return body, False
+
+
+def load_rule_config(path: str) -> Dict:
+    """Đọc rule config từ file JSON"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class RuleSetSource:
+    """
+    Nguồn rule set có hot-reload: kiểm tra mtime của file JSON tối đa mỗi
+    `check_interval` giây, compile lại khi file thay đổi. Nếu file mới lỗi
+    thì giữ rule set cũ đang chạy.
+    """
+
+    def __init__(self, path: Optional[str] = None, check_interval: float = 2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = Lock()
+        self._stamp = None
+        self._last_check = 0.0
+        self.last_error: Optional[str] = None
+        self.reload_count = 0
+        self._current = compile_rule_set(DEFAULT_RULE_CONFIG)
+        if path:
+            self.reload()
+
+    def get(self) -> CompiledRuleSet:
+        if self.path:
+            now = time.monotonic()
+            if now - self._last_check >= self.check_interval:
+                self._last_check = now
+                self._reload_if_changed()
+        return self._current
+
+    def _file_stamp(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _reload_if_changed(self):
+        try:
+            stamp = self._file_stamp()
+        except OSError:
+            return
+        if stamp != self._stamp:
+            self.reload()
+
+    def reload(self) -> CompiledRuleSet:
+        """Đọc lại file và compile (bỏ qua nếu không có path)"""
+        if not self.path:
+            return self._current
+        with self._lock:
+            try:
+                stamp = self._file_stamp()
+            except OSError:
+                self.last_error = f"Rule file not found: {self.path}"
+                print(f"⚠️ {self.last_error} - dùng rule set hiện tại ({self._current.version})")
+                return self._current
+            try:
+                compiled = compile_rule_set(load_rule_config(self.path))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                # Ghi nhận stamp để không parse lại file lỗi cho tới khi nó đổi tiếp
+                self._stamp = stamp
+                self.last_error = str(e)
+                print(f"❌ Rule config lỗi, giữ rule set {self._current.version}: {e}")
+                return self._current
+
+            self._stamp = stamp
+            self.last_error = None
+            if compiled is not self._current:
+                self.reload_count += 1
+                print(f"🔁 Loaded rule set '{compiled.name}' (version {compiled.version})")
+            self._current = compiled
+            return compiled
+
+    def set_config(self, config: Dict) -> CompiledRuleSet:
+        """Áp dụng rule config trực tiếp (không qua file)"""
+        compiled = compile_rule_set(config)
+        with self._lock:
+            self._current = compiled
+        return compiled
+
+    def info(self) -> Dict:
+        current = self._current
+        return {
+            "version": current.version,
+            "name": current.name,
+            "path": self.path,
+            "reload_count": self.reload_count,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,171 @@
+"""
+PetZone HTTP Client - requests.Session dùng chung có connection pool
+====================================================================
+Gọi requests.get/post ở module level mở một kết nối TCP mới mỗi lần (vài lần mỗi
+tick tới backend, một lần mỗi lệnh ESP32). Mọi module gửi request qua client này:
+một Session với HTTPAdapter giữ keep-alive pool cho từng host, timeout mặc định
+(connect, read) cấu hình tập trung, và thống kê tái sử dụng kết nối theo host.
+Mỗi host có một circuit breaker: host lỗi liên tiếp (ESP32 offline, backend down) bị
+ngắt mạch và request tới nó fail fast bằng CircuitOpen thay vì đợi hết timeout.
+"""
+
+import time
+from threading import Lock
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import (
+    CircuitBreaker, CircuitOpen, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT
+)
+from metrics import get_metrics
+
+# Cấu hình mặc định
+HTTP_POOL_CONNECTIONS = 16   # Số host giữ pool (backend, mỗi ESP32, ...)
+HTTP_POOL_MAXSIZE = 16       # Kết nối keep-alive tối đa mỗi host (≥ số I/O worker song song)
+HTTP_TIMEOUT = (2.0, 5.0)    # (connect, read) giây - dùng khi call không truyền timeout
+
+Timeout = Union[float, Tuple[float, float]]
+
+_responses = get_metrics().counter(
+    'petzone_http_responses_total', 'HTTP responses theo downstream host và status (error, circuit_open)',
+    ('host', 'status'))
+_request_seconds = get_metrics().histogram(
+    'petzone_http_request_duration_seconds', 'Thời gian request HTTP theo downstream host', ('host',))
+
+
+class HTTPClient:
+    """
+    Session dùng chung (thread-safe cho request đồng thời nhờ urllib3 pool).
+    Thống kê theo host: số request, lỗi, độ trễ; số kết nối mới/tái sử dụng lấy từ pool.
+    Lỗi kết nối, timeout và HTTP 5xx tính là lỗi của breaker; 4xx là host vẫn sống.
+    """
+
+    def __init__(self, pool_connections: int = HTTP_POOL_CONNECTIONS,
+                 pool_maxsize: int = HTTP_POOL_MAXSIZE, timeout: Timeout = HTTP_TIMEOUT,
+                 breaker_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 breaker_reset: float = BREAKER_RESET_TIMEOUT):
+        self.timeout = timeout
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        self._lock = Lock()
+        self._hosts: Dict[str, Dict] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        parts = urlsplit(url)
+        host = f"{parts.hostname}:{parts.port or (443 if parts.scheme == 'https' else 80)}"
+        breaker = self.breaker(host)
+        if not breaker.allow():
+            _responses.labels(host, 'circuit_open').inc()
+            raise CircuitOpen(host, breaker.retry_in())
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            breaker.record_failure(type(e).__name__)
+            _responses.labels(host, 'error').inc()
+            self._record(host, started, error=True)
+            raise
+        if response.status_code >= 500:
+            breaker.record_failure(f"HTTP {response.status_code}")
+        else:
+            breaker.record_success()
+        _responses.labels(host, response.status_code).inc()
+        self._record(host, started, error=False)
+        return response
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        """Circuit breaker của host ("hostname:port"), tạo khi gặp lần đầu"""
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    host, CircuitBreaker(host, self.breaker_threshold, self.breaker_reset))
+        return breaker
+
+    def breaker_states(self) -> Dict[str, Dict]:
+        return {host: breaker.to_dict() for host, breaker in list(self._breakers.items())}
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def _record(self, host: str, started: float, error: bool):
+        elapsed = time.perf_counter() - started
+        _request_seconds.labels(host).observe(elapsed)
+        elapsed_ms = elapsed * 1000.0
+        with self._lock:
+            stats = self._hosts.setdefault(host, {'requests': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['requests'] += 1
+            stats['errors'] += error
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+    def _pool_counts(self) -> Dict[str, Tuple[int, int]]:
+        """(kết nối mới, request) theo host từ các urllib3 pool đang giữ"""
+        counts = {}
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.host}:{pool.port}"
+            new, total = counts.get(host, (0, 0))
+            counts[host] = (new + pool.num_connections, total + pool.num_requests)
+        return counts
+
+    def stats(self) -> Dict:
+        pools = self._pool_counts()
+        hosts = {}
+        with self._lock:
+            items = [(host, dict(s)) for host, s in self._hosts.items()]
+        for host, s in items:
+            new, pooled_requests = pools.get(host, (None, None))
+            entry = {
+                'requests': s['requests'],
+                'errors': s['errors'],
+                'mean_ms': round(s['total_ms'] / s['requests'], 3) if s['requests'] else None,
+                'max_ms': round(s['max_ms'], 3),
+            }
+            if new is not None:
+                entry['new_connections'] = new
+                entry['reused_connections'] = max(pooled_requests - new, 0)
+                entry['reuse_ratio'] = round(entry['reused_connections'] / pooled_requests, 3) if pooled_requests else None
+            hosts[host] = entry
+        return {
+            'pool_connections': self.pool_connections,
+            'pool_maxsize': self.pool_maxsize,
+            'timeout': self.timeout,
+            'hosts': hosts,
+            'circuit_breakers': self.breaker_states()
+        }
+
+    def close(self):
+        self.session.close()
+
+
+# Singleton instance
+_http_client = None
+
+def get_http_client(pool_connections: int = HTTP_POOL_CONNECTIONS, pool_maxsize: int = HTTP_POOL_MAXSIZE,
+                    timeout: Optional[Timeout] = None,
+                    breaker_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                    breaker_reset: float = BREAKER_RESET_TIMEOUT) -> HTTPClient:
+    """Get hoặc tạo HTTP client dùng chung (tham số chỉ có hiệu lực ở lần gọi đầu)"""
+    global _http_client
+    if _http_client is None:
+        _http_client = HTTPClient(pool_connections, pool_maxsize, timeout or HTTP_TIMEOUT,
+                                  breaker_threshold, breaker_reset)
+    return _http_client
@@ -0,0 +1,153 @@
+"""
+PetZone Ingest Queue - Hàng đợi có giới hạn cho readings được push tới AI service
+================================================================================
+Backend/ESP32 POST readings vào /ingest → hàng đợi bounded → decision loop lấy ra
+ngay khi có dữ liệu (không đợi hết CHECK_INTERVAL). Khi đầy, drop policy quyết định:
+
+- drop_oldest:  bỏ readings cũ nhất trong hàng đợi (ưu tiên dữ liệu mới - mặc định)
+- drop_newest:  chỉ nhận phần còn chỗ, bỏ phần mới tới
+- reject:       từ chối cả request (HTTP 429 + Retry-After) để bên gửi tự retry
+"""
+
+import math
+import time
+from collections import deque
+from threading import Condition
+from typing import Dict, List, Sequence, Tuple
+
+from ai_decision_engine import SensorData
+
+DROP_POLICIES = ('drop_oldest', 'drop_newest', 'reject')
+
+
+class QueueFull(Exception):
+    """Hàng đợi đầy với policy 'reject'"""
+
+    def __init__(self, depth: int, retry_after: int):
+        super().__init__(f"Ingest queue full ({depth} readings)")
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+class IngestQueue:
+    """
+    Hàng đợi FIFO bounded, thread-safe (nhiều request Flask put, một decision loop drain).
+    Mỗi phần tử giữ thời điểm enqueue để đo độ trễ từ lúc nhận tới lúc đánh giá.
+    """
+
+    def __init__(self, capacity: int = 10000, policy: str = 'drop_oldest'):
+        if capacity < 1:
+            raise ValueError("capacity phải >= 1")
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Drop policy không hợp lệ: {policy} (chọn {', '.join(DROP_POLICIES)})")
+        self.capacity = capacity
+        self.policy = policy
+        self._items = deque()
+        self._cond = Condition()
+        self.last_put = None  # time.monotonic() của lần push gần nhất
+        self._drain_rate = None  # readings/giây (EWMA) - ước lượng Retry-After
+        self.stats = {
+            'enqueued': 0,
+            'drained': 0,
+            'dropped_oldest': 0,
+            'dropped_newest': 0,
+            'rejected': 0,
+            'high_watermark': 0,
+            'last_wait_ms': None,
+            'max_wait_ms': 0.0
+        }
+
+    def __len__(self):
+        return len(self._items)
+
+    def put_many(self, readings: Sequence[SensorData]) -> Tuple[int, int]:
+        """
+        Thêm readings theo drop policy, trả về (accepted, dropped).
+        Policy 'reject' là all-or-nothing: raise QueueFull nếu không đủ chỗ.
+        """
+        now = time.monotonic()
+        with self._cond:
+            items, stats = self._items, self.stats
+            free = self.capacity - len(items)
+            dropped = 0
+            if len(readings) > free:
+                if self.policy == 'reject':
+                    stats['rejected'] += len(readings)
+                    raise QueueFull(len(items), self.retry_after())
+                if self.policy == 'drop_newest':
+                    dropped = len(readings) - free
+                    stats['dropped_newest'] += dropped
+                    readings = readings[:free]
+                else:
+                    # Batch lớn hơn cả hàng đợi: chỉ giữ phần mới nhất của batch
+                    overflow = len(readings) - self.capacity
+                    if overflow > 0:
+                        readings = readings[overflow:]
+                    evict = len(items) + len(readings) - self.capacity
+                    for _ in range(evict):
+                        items.popleft()
+                    dropped = max(overflow, 0) + evict
+                    stats['dropped_oldest'] += dropped
+
+            items.extend((now, reading) for reading in readings)
+            stats['enqueued'] += len(readings)
+            stats['high_watermark'] = max(stats['high_watermark'], len(items))
+            self.last_put = now
+            if readings:
+                self._cond.notify()
+            return len(readings), dropped
+
+    def split_accepted(self, batch: Sequence, accepted: int) -> Tuple[list, list]:
+        """
+        Tách batch vừa put_many thành (phần đã vào hàng đợi, phần bị bỏ) theo policy:
+        drop_newest bỏ phần cuối batch, drop_oldest (batch lớn hơn hàng đợi) bỏ phần đầu
+        """
+        batch = list(batch)
+        if self.policy == 'drop_newest':
+            return batch[:accepted], batch[accepted:]
+        cut = len(batch) - accepted
+        return batch[cut:], batch[:cut]
+
+    def drain(self, max_items: int, timeout: float) -> List[SensorData]:
+        """Đợi tối đa `timeout` giây tới khi có dữ liệu, lấy ra tối đa `max_items` readings"""
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            if not self._items:
+                return []
+            count = min(max_items, len(self._items))
+            batch = [self._items.popleft() for _ in range(count)]
+
+        now = time.monotonic()
+        wait_ms = (now - batch[0][0]) * 1000.0
+        stats = self.stats
+        stats['drained'] += count
+        stats['last_wait_ms'] = round(wait_ms, 3)
+        stats['max_wait_ms'] = round(max(stats['max_wait_ms'], wait_ms), 3)
+        return [reading for _, reading in batch]
+
+    def record_throughput(self, count: int, seconds: float):
+        """Ghi nhận tốc độ xử lý của decision loop (dùng để ước lượng Retry-After)"""
+        if count and seconds > 0:
+            rate = count / seconds
+            self._drain_rate = rate if self._drain_rate is None else 0.8 * self._drain_rate + 0.2 * rate
+
+    def retry_after(self) -> int:
+        """Số giây nên đợi trước khi gửi lại (ước lượng thời gian xử lý hết hàng đợi)"""
+        if not self._drain_rate:
+            return 1
+        return max(1, math.ceil(len(self._items) / self._drain_rate))
+
+    def idle_for(self) -> float:
+        """Số giây kể từ lần push gần nhất (inf nếu chưa có push nào)"""
+        if self.last_put is None:
+            return math.inf
+        return time.monotonic() - self.last_put
+
+    def to_dict(self) -> Dict:
+        return {
+            'depth': len(self._items),
+            'capacity': self.capacity,
+            'policy': self.policy,
+            **self.stats
+        }
@@ -6,11 +6,18 @@ PetZone IoT Controller - Intelligent Device Control
 
 import requests
 import json
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from datetime import datetime
 from dataclasses import dataclass
 from enum import Enum
 
+from http_client import HTTPClient, get_http_client
+from tracing import get_tracer
+from event_stream import get_event_broker
+
+tracer = get_tracer()
+events = get_event_broker()
+
 
 class DeviceType(Enum):
     """Các loại thiết bị IoT"""
@@ -36,6 +43,7 @@ class DeviceCommand:
     duration: Optional[int] = None   # Thời gian hoạt động (seconds)
     reason: str = ""
     timestamp: datetime = None
+    trace_id: Optional[str] = None   # Trace của reading dẫn tới lệnh này (None: lệnh thủ công)
     
     def __post_init__(self):
         if self.timestamp is None:
@@ -48,6 +56,7 @@ class DeviceCommand:
             "intensity": self.intensity,
             "duration": self.duration,
             "reason": self.reason,
+            "trace_id": self.trace_id,
             "timestamp": self.timestamp.isoformat()
         }
 
@@ -58,16 +67,22 @@ class IoTController:
     Hỗ trợ nhiều protocols: HTTP, MQTT, WebSocket
     """
     
-    def __init__(self, esp32_ip: str = "192.168.1.100", backend_url: str = "http://localhost:5019"):
+    def __init__(self, esp32_ip: str = "192.168.1.100", backend_url: str = "http://localhost:5019",
+                 http_client: HTTPClient = None, outbox=None):
         """
         Initialize IoT Controller
         
         Args:
             esp32_ip: IP address của ESP32
-            backend_url: URL của backend .NET API
+            backend_url: URL của backend .NET API (có hoặc không có hậu tố /api)
+            http_client: HTTP client dùng chung (keep-alive pool), mặc định get_http_client()
+            outbox: Outbox bền vững cho log hoạt động thiết bị (None → POST trực tiếp)
         """
         self.esp32_ip = esp32_ip
-        self.backend_url = backend_url
+        backend_url = backend_url.rstrip('/')
+        self.backend_url = backend_url[:-len('/api')] if backend_url.endswith('/api') else backend_url
+        self.http = http_client or get_http_client()
+        self.outbox = outbox
         self.device_states = {
             DeviceType.FAN: DeviceState.OFF,
             DeviceType.HEATER: DeviceState.OFF,
@@ -75,6 +90,9 @@ class IoTController:
             DeviceType.HUMIDIFIER: DeviceState.OFF
         }
         self.command_history = []
+        # Lệnh mới nhất của mỗi thiết bị mà ESP32 chưa xác nhận (gửi lại khi reconcile)
+        self.unsynced: Dict[DeviceType, DeviceCommand] = {}
+        self._latest_command: Dict[DeviceType, DeviceCommand] = {}
     
     def execute_command(self, command: DeviceCommand) -> Dict:
         """
@@ -90,21 +108,21 @@ class IoTController:
         print(f"Action: {command.action.value.upper()}")
         print(f"Reason: {command.reason}")
         
+        with tracer.span(command.trace_id, 'iot.execute_command', device=command.device_type.value,
+                         action=command.action.value):
+            return self._execute(command)
+    
+    def _execute(self, command: DeviceCommand) -> Dict:
         try:
-            # 1. Send command to ESP32
+            # 1-2. Update local state + history (trạng thái mong muốn, dùng khi reconcile)
+            self._record_command(command)
+            
+            # 3. Send command to ESP32
             esp32_result = self._send_to_esp32(command)
             
-            # 2. Log to backend
+            # 4. Log to backend
             backend_result = self._log_to_backend(command)
             
-            # 3. Update local state
-            self.device_states[command.device_type] = command.action
-            
-            # 4. Add to history
-            self.command_history.append(command)
-            if len(self.command_history) > 100:
-                self.command_history.pop(0)
-            
             result = {
                 "success": True,
                 "device": command.device_type.value,
@@ -130,7 +148,51 @@ class IoTController:
             print(f"{'='*60}\n")
             return error_result
     
+    def command_calls(self, command: DeviceCommand) -> List[Tuple[str, Callable[[], Dict]]]:
+        """
+        Chuẩn bị lệnh để chạy bất đồng bộ: cập nhật state/history ngay (như execute_command)
+        và trả về các I/O call độc lập (ESP32, log backend) để bên gọi chạy song song có deadline
+        """
+        print(f"🎮 {command.device_type.value.upper()} → {command.action.value.upper()} ({command.reason})")
+        self._record_command(command)
+        return [
+            ("esp32", lambda: self._send_to_esp32(command)),
+            ("backend.device_log", lambda: self._log_to_backend(command)),
+        ]
+    
+    def reconcile_calls(self) -> List[Tuple[str, Callable[[], Dict]]]:
+        """I/O call gửi lại lệnh mới nhất cho các thiết bị mà ESP32 chưa nhận (offline, lỗi)"""
+        return [("esp32", lambda command=command: self._send_to_esp32(command))
+                for command in list(self.unsynced.values())]
+    
+    def _record_command(self, command: DeviceCommand):
+        """Cập nhật trạng thái thiết bị và lịch sử lệnh"""
+        previous = self._latest_command.get(command.device_type)
+        changed = self.device_states.get(command.device_type) != command.action or \
+            (previous is not None and previous.intensity != command.intensity)
+        self.device_states[command.device_type] = command.action
+        if changed:
+            # /events: chỉ khi trạng thái (hoặc cường độ) thực sự đổi, không phải mỗi lệnh lặp lại
+            events.publish('device_state', {'esp32_ip': self.esp32_ip, **command.to_dict()})
+        self._latest_command[command.device_type] = command
+        self.command_history.append(command)
+        if len(self.command_history) > 100:
+            self.command_history.pop(0)
+    
     def _send_to_esp32(self, command: DeviceCommand) -> Dict:
+        """Gửi lệnh tới ESP32 và ghi nhận thiết bị đã đồng bộ hay chưa (chỉ theo lệnh mới nhất)"""
+        with tracer.span(command.trace_id, 'esp32', device=command.device_type.value,
+                         action=command.action.value, esp32_ip=self.esp32_ip) as span:
+            result = self._post_to_esp32(command)
+            span['status'] = result["status"]
+        if self._latest_command.get(command.device_type) is command:
+            if result["status"] == "success":
+                self.unsynced.pop(command.device_type, None)
+            else:
+                self.unsynced[command.device_type] = command
+        return result
+    
+    def _post_to_esp32(self, command: DeviceCommand) -> Dict:
         """
         Gửi lệnh tới ESP32 qua HTTP
         ESP32 cần expose endpoint như: http://192.168.1.100/control
@@ -150,11 +212,13 @@ class IoTController:
             print(f"   Payload: {payload}")
             
             # Send HTTP POST request
-            response = requests.post(
+            headers = {'Content-Type': 'application/json'}
+            if command.trace_id:
+                headers['X-Trace-Id'] = command.trace_id
+            response = self.http.post(
                 esp32_url,
                 json=payload,
-                timeout=5,
-                headers={'Content-Type': 'application/json'}
+                headers=headers
             )
             
             if response.status_code == 200:
@@ -194,17 +258,25 @@ class IoTController:
                 "reason": command.reason,
                 "timestamp": command.timestamp.isoformat()
             }
+            if command.trace_id:
+                payload["traceId"] = command.trace_id
+            
+            if self.outbox is not None:
+                # Ghi vào outbox, sender thread gửi batch tới backend (không mất log khi backend down)
+                with tracer.span(command.trace_id, 'device_log.enqueue', device=command.device_type.value):
+                    key = self.outbox.enqueue("device/activity", payload)
+                return {"status": "queued", "key": key}
             
             backend_endpoint = f"{self.backend_url}/api/device/activity"
             
             print(f"📡 Logging to Backend: {backend_endpoint}")
             
-            response = requests.post(
-                backend_endpoint,
-                json=payload,
-                timeout=5,
-                headers={'Content-Type': 'application/json'}
-            )
+            with tracer.span(command.trace_id, 'device_log', device=command.device_type.value):
+                response = self.http.post(
+                    backend_endpoint,
+                    json=payload,
+                    headers={'Content-Type': 'application/json'}
+                )
             
             if response.status_code in [200, 201]:
                 print(f"   ✅ Backend logged successfully")
@@ -294,11 +366,13 @@ class IoTController:
 _iot_controller = None
 
 def get_iot_controller(esp32_ip: str = "192.168.1.100", 
-                       backend_url: str = "http://localhost:5019") -> IoTController:
+                       backend_url: str = "http://localhost:5019",
+                       http_client: HTTPClient = None,
+                       outbox=None) -> IoTController:
     """Get hoặc tạo IoT controller instance"""
     global _iot_controller
     if _iot_controller is None:
-        _iot_controller = IoTController(esp32_ip, backend_url)
+        _iot_controller = IoTController(esp32_ip, backend_url, http_client, outbox)
     return _iot_controller
 
 
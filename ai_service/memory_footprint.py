@@ -0,0 +1,88 @@
+"""
+PetZone Memory Footprint - Đo bộ nhớ của decision history
+=========================================================
+So sánh bộ nhớ giữ lại cho N decisions ở ba dạng:
+list AIDecision (dataclass + reasoning dict), list CompactDecision (__slots__)
+và DecisionColumns (các mảng NumPy song song - dạng engine đang dùng).
+
+Cách dùng:
+    python memory_footprint.py [số decisions]
+"""
+
+import copy
+import sys
+import tracemalloc
+from datetime import datetime
+from typing import Dict
+
+import numpy as np
+
+from ai_decision_engine import (
+    CompactDecision,
+    CompactSensorData,
+    DecisionColumns,
+    IntelligentDecisionEngine,
+    SensorData,
+)
+
+
+def _retained_bytes(build) -> int:
+    """Bộ nhớ còn giữ lại sau khi build() trả về (tracemalloc)"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del kept
+    return size
+
+
+def measure_footprint(n: int = 10000) -> Dict[str, float]:
+    """So sánh bộ nhớ của n decisions: list AIDecision vs list CompactDecision vs DecisionColumns"""
+    engine = IntelligentDecisionEngine()
+    rng = np.random.default_rng(0)
+    start = datetime.now().timestamp()
+    readings = [
+        SensorData(
+            temperature=round(float(t), 1), humidity=round(float(h), 1),
+            presence_energy=int(p), movement_energy=int(m),
+            timestamp=datetime.fromtimestamp(start + 5 * i)
+        )
+        for i, (t, h, p, m) in enumerate(zip(
+            rng.uniform(15, 38, n), rng.uniform(30, 95, n),
+            rng.integers(0, 100, n), rng.integers(0, 100, n)))
+    ]
+    decisions = [engine.analyze(r) for r in readings]
+
+    def full():
+        # Copy sâu decision (kèm reasoning) để đo đúng phần mà history giữ lại
+        return copy.deepcopy(decisions)
+
+    def compact():
+        return [CompactDecision.from_decision(d) for d in decisions]
+
+    def columnar():
+        columns = DecisionColumns(n)
+        for d, r in zip(decisions, readings):
+            columns.append(d, r)
+        return columns
+
+    result = {'decisions': n}
+    for name, build in (('dataclass', full), ('slots', compact), ('columnar', columnar)):
+        result[f'{name}_bytes_per_decision'] = round(_retained_bytes(build) / n, 1)
+    result['sensor_dataclass_bytes'] = sys.getsizeof(readings[0]) + sys.getsizeof(readings[0].__dict__)
+    result['sensor_slots_bytes'] = sys.getsizeof(CompactSensorData.from_sensor_data(readings[0]))
+    return result
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(f"📏 Measuring decision history footprint ({n} decisions)...\n")
+    stats = measure_footprint(n)
+    full = stats['dataclass_bytes_per_decision']
+    for name in ('dataclass', 'slots', 'columnar'):
+        per = stats[f'{name}_bytes_per_decision']
+        print(f"   {name:<10} {per:>10.1f} bytes/decision  ({full / per:.0f}x)")
+    print(f"\n   SensorData dataclass {stats['sensor_dataclass_bytes']} bytes"
+          f" → slots {stats['sensor_slots_bytes']} bytes (không tính giá trị)")
@@ -0,0 +1,213 @@
+"""
+PetZone Metrics - Counter/Histogram kiểu Prometheus cho /metrics
+================================================================
+/stats chỉ có bộ đếm tổng, không thấy thời gian của một tick đi đâu. Module này giữ
+metrics trong bộ nhớ và xuất theo text exposition format của Prometheus (0.0.4):
+
+- Counter / Histogram có label, ghi nhận trong hot path (một bisect + vài phép cộng)
+- Callback metrics: giá trị lấy lúc scrape (độ sâu hàng đợi, cache hit/miss...) nên
+  không tốn gì giữa các lần scrape
+
+Không phụ thuộc prometheus_client; registry dùng chung qua get_metrics().
+"""
+
+import math
+from bisect import bisect_left
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bucket (giây) cho latency: từ 0.1 ms (analyze một reading) tới 10s (timeout mạng)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Samples = Iterable[Tuple[Tuple[str, ...], float]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    """Counter có label: counter.labels('backend', '200').inc()"""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = Lock()
+
+    def labels(self, *values) -> '_CounterChild':
+        key = tuple(str(v) for v in values)
+        cell = self._values.get(key)
+        if cell is None:
+            with self._lock:
+                cell = self._values.setdefault(key, [0.0])
+        return _CounterChild(cell, self._lock)
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, cell in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(cell[0])}")
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('_cell', '_lock')
+
+    def __init__(self, cell: List[float], lock: Lock):
+        self._cell = cell
+        self._lock = lock
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._cell[0] += amount
+
+
+class Histogram:
+    """Histogram có label với bucket cố định (mặc định LATENCY_BUCKETS, đơn vị giây)"""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[Tuple[str, ...], '_HistogramChild'] = {}
+        self._lock = Lock()
+
+    def labels(self, *values) -> '_HistogramChild':
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, _HistogramChild(self.buckets))
+        return child
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, child in sorted(self._children.items()):
+            counts, total, count = child.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(round(total, 9))}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ('_buckets', '_counts', '_sum', '_count', '_lock')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)  # Bucket cuối là +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self._counts), self._sum, self._count
+
+
+class CallbackMetric:
+    """Metric (gauge/counter) có giá trị lấy từ callback lúc scrape"""
+
+    def __init__(self, name: str, help: str, kind: str, labelnames: Sequence[str],
+                 fn: Callable[[], Samples]):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self.fn():
+            if value is None:
+                continue
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Tập metrics của process; tạo lại metric cùng tên trả về metric đã có"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = Lock()
+
+    def _get_or_create(self, name: str, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(name, lambda: Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(name, lambda: Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, fn: Callable[[], Samples],
+                 labelnames: Sequence[str] = (), kind: str = 'gauge'):
+        """Đăng ký (hoặc thay) metric lấy giá trị lúc scrape; fn trả về [(label values, value)]"""
+        with self._lock:
+            self._metrics[name] = CallbackMetric(name, help, kind, labelnames, fn)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name}: collection failed ({e})")
+        return '\n'.join(lines) + '\n'
+
+
+# Singleton instance
+_metrics = None
+
+def get_metrics() -> MetricsRegistry:
+    """Get hoặc tạo metrics registry dùng chung"""
+    global _metrics
+    if _metrics is None:
+        _metrics = MetricsRegistry()
+    return _metrics
@@ -0,0 +1,175 @@
+"""
+PetZone Mock Backend - Backend giả lập cho test và phát triển
+==============================================================
+Thay thế PetZone (.NET + PostgreSQL) khi test AI service: lưu readings trong bộ nhớ
+và mô phỏng các endpoint sensor/AI mà AI service gọi tới.
+
+    python mock_backend.py          # chạy trên port 5019 như backend thật
+
+Hoặc trong test: MockBackend().start() chạy trên port ngẫu nhiên trong thread nền.
+"""
+
+import time
+from datetime import datetime, timezone
+from threading import Lock, Thread
+from typing import Dict, List
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class MockBackend:
+    """
+    Backend giả lập: /api/sensor (POST, latest, since), /api/ai/* và /api/device/activity
+    (ghi nhận, kể cả /batch với idempotency key), /control (thay ESP32).
+    `delay` giả lập mạng chậm (giây, mọi request); `fail_status` (ví dụ 503) giả lập
+    backend down cho mọi route /api/ai và /api/device.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.readings: List[Dict] = []
+        self.alerts: List[Dict] = []
+        self.requests: List[str] = []  # Path của các request đã nhận (kiểm tra số lần gọi)
+        self.commands: List[Dict] = []
+        self.delay = 0.0
+        self.fail_status = None
+        self.seen_keys = set()
+        self.duplicates = 0
+        self._lock = Lock()
+        self._server = None
+        self.app = self._create_app()
+
+    @property
+    def api_url(self) -> str:
+        return f"http://{self.host}:{self.port}/api"
+
+    def add_reading(self, temperature: float, humidity: float, presence_energy: int = 0,
+                    movement_energy: int = 0, created_at: datetime = None, **extra) -> Dict:
+        """Thêm reading như ESP32 POST /api/sensor (id tăng dần)"""
+        with self._lock:
+            reading = {
+                "id": len(self.readings) + 1,
+                "temperature": temperature,
+                "humidity": humidity,
+                "presenceEnergy": presence_energy,
+                "movementEnergy": movement_energy,
+                "distance": None,
+                "createdAt": (created_at or datetime.now(timezone.utc)).isoformat(),
+                **extra
+            }
+            self.readings.append(reading)
+            return reading
+
+    def _create_app(self) -> Flask:
+        app = Flask("mock_backend")
+
+        @app.before_request
+        def record_request():
+            self.requests.append(request.path)
+            if self.delay:
+                time.sleep(self.delay)
+            if self.fail_status and request.path.startswith(('/api/ai', '/api/device')):
+                return jsonify({"error": "Service unavailable"}), self.fail_status
+
+        @app.route('/api/sensor', methods=['POST'])
+        def post_sensor():
+            data = request.get_json(silent=True) or {}
+            reading = self.add_reading(
+                data.get('temperature'), data.get('humidity'),
+                data.get('presenceEnergy', 0), data.get('movementEnergy', 0),
+                **({'cageId': data['cageId']} if 'cageId' in data else {})
+            )
+            return jsonify({"message": "Server đã nhận OK", "id": reading["id"]})
+
+        @app.route('/api/sensor/latest')
+        def latest():
+            with self._lock:
+                if not self.readings:
+                    return "Chưa có dữ liệu nào", 404
+                return jsonify(self.readings[-1])
+
+        @app.route('/api/sensor/since')
+        def since():
+            after_id = request.args.get('afterId', type=int)
+            limit = min(max(request.args.get('limit', 500, type=int), 1), 5000)
+            with self._lock:
+                items = [r for r in self.readings if after_id is None or r["id"] > after_id]
+            page = items[:limit]
+            return jsonify({
+                "readings": page,
+                "lastId": page[-1]["id"] if page else after_id,
+                "hasMore": len(items) > limit
+            })
+
+        @app.route('/api/ai/<kind>', methods=['POST'])
+        def ai_alert(kind):
+            data = request.get_json(silent=True) or {}
+            with self._lock:
+                if self._is_duplicate(data.get('idempotencyKey') or request.headers.get('Idempotency-Key')):
+                    return jsonify({"message": "Duplicate alert ignored", "duplicate": True})
+                self.alerts.append({"kind": kind, **data})
+                return jsonify({"message": "Alert received", "id": len(self.alerts)})
+
+        @app.route('/api/ai/<kind>/batch', methods=['POST'])
+        def ai_alert_batch(kind):
+            events = request.get_json(silent=True) or []
+            with self._lock:
+                fresh = [e for e in events if not self._is_duplicate(e.get('idempotencyKey'))]
+                self.alerts.extend({"kind": kind, **e} for e in fresh)
+            return jsonify({"accepted": len(fresh), "duplicates": len(events) - len(fresh)})
+
+        @app.route('/api/device/activity', methods=['POST'])
+        @app.route('/control', methods=['POST'])
+        def device_command():
+            data = request.get_json(silent=True) or {}
+            with self._lock:
+                if self._is_duplicate(data.get('idempotencyKey') or request.headers.get('Idempotency-Key')):
+                    return jsonify({"status": "ok", "duplicate": True})
+                self.commands.append({"path": request.path, **data})
+                return jsonify({"status": "ok"})
+
+        @app.route('/api/device/activity/batch', methods=['POST'])
+        def device_activity_batch():
+            events = request.get_json(silent=True) or []
+            with self._lock:
+                fresh = [e for e in events if not self._is_duplicate(e.get('idempotencyKey'))]
+                self.commands.extend({"path": '/api/device/activity', **e} for e in fresh)
+            return jsonify({"accepted": len(fresh), "duplicates": len(events) - len(fresh)})
+
+        return app
+
+    def _is_duplicate(self, key) -> bool:
+        """Ghi nhận idempotency key (gọi trong self._lock), True nếu đã nhận trước đó"""
+        if not key:
+            return False
+        if key in self.seen_keys:
+            self.duplicates += 1
+            return True
+        self.seen_keys.add(key)
+        return False
+
+    def start(self) -> 'MockBackend':
+        """Chạy server trong thread nền (port=0 → port ngẫu nhiên)"""
+        self._server = make_server(self.host, self.port, self.app, threaded=True,
+                                   request_handler=_QuietHandler)
+        self.port = self._server.server_port
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server = None
+
+
+if __name__ == "__main__":
+    backend = MockBackend(host="0.0.0.0", port=5019)
+    print(f"🧪 Mock backend: http://localhost:5019/api")
+    backend.app.run(host="0.0.0.0", port=5019, threaded=True)
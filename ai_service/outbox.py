@@ -0,0 +1,247 @@
+"""
+PetZone Outbox - Hàng đợi bền vững cho alert và log thiết bị gửi tới backend
+============================================================================
+Khi backend .NET down, alert/emergency/log hoạt động thiết bị trước đây chỉ được in lỗi
+rồi mất. Outbox ghi mỗi event vào SQLite (WAL, chỉ vài chục µs, không chờ mạng) kèm
+idempotency key; một thread nền gửi theo batch tới `<kind>/batch` của backend,
+retry với exponential backoff (+ jitter) cho tới khi backend xác nhận.
+
+- Batch được xoá khỏi outbox chỉ khi backend trả 2xx (at-least-once)
+- Backend bỏ qua event có idempotency key đã nhận → không bị ghi trùng khi retry
+- Backend cũ chưa có endpoint /batch (404) → gửi từng event tới endpoint đơn
+- 4xx khác (payload hỏng) → event chuyển sang trạng thái dead, không chặn các event sau
+"""
+
+import json
+import random
+import sqlite3
+import time
+import uuid
+from threading import Event, Lock, Thread
+from typing import Dict, List, Optional
+
+import requests
+
+from http_client import HTTPClient, get_http_client
+from metrics import get_metrics
+from tracing import get_tracer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    dead INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS events_due ON events (dead, next_attempt, id);
+"""
+
+# Mã lỗi đáng retry (backend quá tải / tạm thời không xử lý được)
+RETRYABLE_STATUS = (408, 425, 429)
+
+# Stage của pipeline AI (cùng histogram với fetch/analyze/execute trong ai_service_main)
+STAGE_OF_KIND = {'ai/alert': 'alert', 'ai/emergency': 'alert', 'device/activity': 'log'}
+_stage_seconds = get_metrics().histogram(
+    'petzone_stage_duration_seconds', 'Thời gian mỗi stage của tick (fetch, analyze, execute, alert, log)',
+    ('stage',))
+tracer = get_tracer()
+
+
+class Outbox:
+    """
+    Outbox trên SQLite: enqueue() từ bất kỳ thread nào, một sender thread gửi batch.
+    kind là đường dẫn endpoint dưới base_url (ví dụ "ai/alert", "device/activity").
+    """
+
+    def __init__(self, path: str, base_url: str, http_client: HTTPClient = None,
+                 batch_size: int = 100, base_backoff: float = 1.0, max_backoff: float = 60.0,
+                 linger: float = 0.2):
+        self.path = path
+        self.base_url = base_url.rstrip('/')
+        self.http = http_client or get_http_client()
+        self.batch_size = batch_size
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.linger = linger  # Đợi gom thêm event trước khi gửi (trừ event urgent)
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._lock = Lock()
+        self._wake = Event()
+        self._urgent = False
+        self._running = False
+        self._batch_supported: Dict[str, bool] = {}
+        self.stats = {
+            'enqueued': 0,
+            'delivered': 0,
+            'batches_sent': 0,
+            'failures': 0,
+            'dead': 0,
+            'last_error': None
+        }
+
+    # ---------- producer ----------
+
+    def enqueue(self, kind: str, payload: Dict, key: Optional[str] = None, urgent: bool = False) -> str:
+        """Ghi event vào outbox (không chờ mạng), trả về idempotency key"""
+        key = key or uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO events (key, kind, payload, created_at) VALUES (?, ?, ?, ?)",
+                (key, kind, json.dumps(payload, ensure_ascii=False, default=str), time.time()))
+            self.stats['enqueued'] += 1
+        if urgent:
+            self._urgent = True
+        self._wake.set()
+        return key
+
+    # ---------- sender ----------
+
+    def start(self) -> 'Outbox':
+        if not self._running:
+            self._running = True
+            Thread(target=self._run, daemon=True, name="outbox-sender").start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+
+    def _run(self):
+        while self._running:
+            wait = self._next_due_in()
+            if wait is None or wait > 0:
+                self._wake.wait(timeout=wait if wait is not None else self.max_backoff)
+                self._wake.clear()
+                if not self._urgent and self.linger:
+                    time.sleep(self.linger)
+            self._urgent = False
+            try:
+                while self._running and self.flush_once():
+                    pass
+            except Exception as e:
+                self.stats['last_error'] = str(e)
+                print(f"❌ Outbox sender error: {e}")
+                time.sleep(self.base_backoff)
+
+    def _next_due_in(self) -> Optional[float]:
+        """Số giây tới event đến hạn sớm nhất (None nếu outbox trống)"""
+        with self._lock:
+            row = self._db.execute("SELECT MIN(next_attempt) FROM events WHERE dead = 0").fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def flush_once(self) -> int:
+        """Gửi một batch event đến hạn (cùng kind), trả về số event đã giao thành công"""
+        now = time.time()
+        with self._lock:
+            first = self._db.execute(
+                "SELECT kind FROM events WHERE dead = 0 AND next_attempt <= ? ORDER BY id LIMIT 1",
+                (now,)).fetchone()
+            if first is None:
+                return 0
+            rows = self._db.execute(
+                "SELECT id, key, payload, attempts FROM events "
+                "WHERE dead = 0 AND next_attempt <= ? AND kind = ? ORDER BY id LIMIT ?",
+                (now, first[0], self.batch_size)).fetchall()
+
+        kind = first[0]
+        events = [{**json.loads(payload), "idempotencyKey": key} for _, key, payload, _ in rows]
+        ids = [row[0] for row in rows]
+        start = time.time()
+        started = time.perf_counter()
+        try:
+            status = self._deliver(kind, events)
+        except requests.exceptions.RequestException as e:
+            status, error = None, str(e)
+        else:
+            error = f"HTTP {status}"
+        elapsed = time.perf_counter() - started
+        _stage_seconds.labels(STAGE_OF_KIND.get(kind, kind)).observe(elapsed)
+
+        if status is not None and 200 <= status < 300:
+            # Span "delivered" của mỗi event có traceId: backend đã xác nhận (điểm cuối của trace)
+            for event, (_, _, _, attempts) in zip(events, rows):
+                tracer.record(event.get('traceId'), f"{kind}.delivered", start, elapsed * 1000.0,
+                              batch=len(events), attempts=attempts + 1)
+            self._delete(ids)
+            self.stats['delivered'] += len(ids)
+            self.stats['batches_sent'] += 1
+            return len(ids)
+
+        self.stats['failures'] += 1
+        self.stats['last_error'] = f"{kind}: {error}"
+        if status is not None and 400 <= status < 500 and status not in RETRYABLE_STATUS:
+            self._mark_dead(ids, error)
+            print(f"⚠️ Outbox: backend từ chối {len(ids)} event {kind} ({error}) - chuyển sang dead")
+        else:
+            attempts = max(row[3] for row in rows) + 1
+            delay = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+            self._reschedule(ids, attempts, time.time() + delay, error)
+            print(f"⚠️ Outbox: gửi {len(ids)} event {kind} lỗi ({error}), thử lại sau {delay:.1f}s")
+        return 0
+
+    def _deliver(self, kind: str, events: List[Dict]) -> int:
+        """POST batch (hoặc từng event nếu backend chưa có /batch), trả về HTTP status"""
+        if self._batch_supported.get(kind, True):
+            response = self.http.post(f"{self.base_url}/{kind}/batch", json=events)
+            if response.status_code != 404:
+                return response.status_code
+            self._batch_supported[kind] = False
+            print(f"⚠️ Backend has no /{kind}/batch - delivering events one by one")
+
+        for event in events:
+            response = self.http.post(f"{self.base_url}/{kind}", json=event,
+                                      headers={'Idempotency-Key': event['idempotencyKey']})
+            if not 200 <= response.status_code < 300:
+                return response.status_code
+        return 200
+
+    def _delete(self, ids: List[int]):
+        with self._lock:
+            self._db.executemany("DELETE FROM events WHERE id = ?", [(i,) for i in ids])
+
+    def _reschedule(self, ids: List[int], attempts: int, next_attempt: float, error: str):
+        with self._lock:
+            self._db.executemany(
+                "UPDATE events SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                [(attempts, next_attempt, error, i) for i in ids])
+
+    def _mark_dead(self, ids: List[int], error: str):
+        with self._lock:
+            self._db.executemany("UPDATE events SET dead = 1, last_error = ? WHERE id = ?",
+                                 [(error, i) for i in ids])
+            self.stats['dead'] += len(ids)
+
+    # ---------- stats ----------
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM events WHERE dead = 0").fetchone()[0]
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            pending, oldest, retrying = self._db.execute(
+                "SELECT COUNT(*), MIN(created_at), SUM(attempts > 0) FROM events WHERE dead = 0").fetchone()
+            dead = self._db.execute("SELECT COUNT(*) FROM events WHERE dead = 1").fetchone()[0]
+        return {
+            'path': self.path,
+            'pending': pending,
+            'retrying': retrying or 0,
+            'dead_events': dead,
+            'oldest_pending_age_s': round(time.time() - oldest, 1) if oldest else None,
+            **self.stats
+        }
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self._db.close()
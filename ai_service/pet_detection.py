@@ -15,6 +15,8 @@ from flask import Flask, Response
 from threading import Thread
 import datetime
 
+from http_client import get_http_client
+
 # ============ CẤU HÌNH ============
 BACKEND_API_URL = "http://localhost:5000/api/ai/status"  # Thay đổi theo Backend của bạn
 CAMERA_INDEX = 0  # 0 = Webcam mặc định
@@ -112,7 +114,8 @@ def send_status_to_backend(has_pet_status):
             "confidence": 0.85 if has_pet_status else 0.95
         }
         
-        response = requests.post(BACKEND_API_URL, json=payload, timeout=5)
+        # Session dùng chung: giữ kết nối keep-alive tới backend giữa các lần gửi
+        response = get_http_client().post(BACKEND_API_URL, json=payload)
         
         if response.status_code == 200:
             print(f"✅ Đã gửi API: hasPet={has_pet_status}")
@@ -196,6 +199,7 @@ def get_status():
     return {
         "hasPet": has_pet,
         "lastMotionTime": last_motion_time,
+        "circuitBreakers": get_http_client().breaker_states(),
         "timestamp": time.time()
     }
 
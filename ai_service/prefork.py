@@ -0,0 +1,168 @@
+"""
+PetZone Prefork Serving - Nhiều HTTP worker process, một process monitoring
+===========================================================================
+`app.run(threaded=True)` chạy request và monitoring loop trong cùng một process nên
+tranh nhau GIL. Chế độ này (HTTP_WORKERS > 1 trong ai_service_main.py):
+
+    supervisor (không thread, chỉ fork/giám sát)
+      ├── primary: AIService + toàn bộ Flask app trên 127.0.0.1:INTERNAL_PORT,
+      │            publish status/stats/command_history vào SharedState
+      └── N worker: cùng accept trên socket public (bind một lần trong supervisor,
+                   truyền fd cho werkzeug make_server), phục vụ /status, /stats,
+                   /command_history từ shared memory; route khác proxy tới primary
+
+Monitoring loop và điều khiển thiết bị chỉ chạy ở primary (không nhân đôi lệnh ESP32).
+Process con chết → supervisor fork lại. Cần os.fork (Linux/macOS).
+"""
+
+import os
+import signal
+import socket
+import time
+from typing import Callable, Dict, Optional
+
+import requests
+from flask import Flask, Response, request
+from werkzeug.serving import make_server
+
+from shared_state import SharedState
+
+SHARED_ROUTES = ('status', 'stats', 'command_history')
+# Header không chuyển tiếp qua proxy (hop-by-hop, hoặc do server tự đặt lại)
+HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te',
+               'trailers', 'transfer-encoding', 'upgrade', 'host', 'content-length', 'content-encoding'}
+PROXY_TIMEOUT = (2.0, 90.0)  # (connect, read) - read đủ cho /admin/profile tối đa 60s
+STREAMING_PATHS = ('/events',)  # Response không giới hạn thời gian (không đặt read timeout)
+RESPAWN_DELAY = 1.0  # Giây chờ trước khi fork lại process con vừa chết
+
+
+def supports_prefork() -> bool:
+    return hasattr(os, 'fork')
+
+
+def create_worker_app(shared: SharedState, upstream: str) -> Flask:
+    """Flask app của worker: đọc shared memory cho các route chia sẻ, còn lại proxy tới primary"""
+    app = Flask('petzone-worker')
+    session = requests.Session()
+
+    def proxy(path: str = ''):
+        timeout = (PROXY_TIMEOUT[0], None) if request.path in STREAMING_PATHS else PROXY_TIMEOUT
+        try:
+            upstream_response = session.request(
+                request.method, upstream + request.full_path.rstrip('?'),
+                headers={**{k: v for k, v in request.headers
+                            if k.lower() not in HOP_HEADERS and k.lower() != 'x-forwarded-for'},
+                         # Primary chỉ thấy 127.0.0.1: chuyển địa chỉ client thật (kiểm tra /admin/*)
+                         'X-Forwarded-For': request.remote_addr},
+                data=request.get_data(), stream=True, timeout=timeout, allow_redirects=False)
+        except requests.exceptions.RequestException as e:
+            return Response(f'{{"error": "Primary process unavailable: {type(e).__name__}"}}',
+                            status=502, mimetype='application/json')
+
+        def body():
+            try:
+                yield from upstream_response.iter_content(chunk_size=None)
+            finally:
+                upstream_response.close()
+
+        headers = [(k, v) for k, v in upstream_response.headers.items() if k.lower() not in HOP_HEADERS]
+        return Response(body(), status=upstream_response.status_code, headers=headers)
+
+    def serve_slot(name: str):
+        value = shared.read(name)
+        if value is None:
+            return proxy()  # Primary chưa publish lần nào
+        if name == 'status':
+            # Slot status: "<etag>\n<body>" (snapshot của status_snapshot.py)
+            etag, _, body = value.body.partition(b'\n')
+            etag = etag.decode('ascii')
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = Response(body, mimetype='application/json')
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            response.headers['X-Status-Version'] = str(value.version)
+        else:
+            response = Response(value.body, mimetype='application/json')
+        response.headers['X-State-Age'] = f"{time.time() - value.published_at:.3f}"
+        response.headers['X-Worker-Pid'] = str(os.getpid())
+        return response
+
+    for name in SHARED_ROUTES:
+        app.add_url_rule(f'/{name}', name, lambda name=name: serve_slot(name))
+    methods = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'HEAD']
+    app.add_url_rule('/', 'proxy_root', proxy, methods=methods)
+    app.add_url_rule('/<path:path>', 'proxy', proxy, methods=methods)
+    return app
+
+
+def serve(host: str, port: int, workers: int, shared: SharedState, upstream: str,
+          run_primary: Callable[[], None]):
+    """
+    Supervisor: bind socket public, fork primary + `workers` HTTP worker và fork lại
+    process nào chết cho tới khi nhận SIGINT/SIGTERM. Chạy trước khi tạo bất kỳ thread nào.
+    """
+    listener = socket.create_server((host, port), backlog=128)
+    listener.set_inheritable(True)
+    children: Dict[int, str] = {}
+    stopping = False
+
+    def run_worker():
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # Supervisor điều phối shutdown
+        server = make_server(host, port, create_worker_app(shared, upstream), threaded=True,
+                             fd=listener.fileno())
+        server.serve_forever()
+
+    def spawn(role: str) -> Optional[int]:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                if role == 'primary':
+                    listener.close()
+                    run_primary()
+                else:
+                    run_worker()
+            except BaseException as e:
+                if not isinstance(e, (KeyboardInterrupt, SystemExit)):
+                    print(f"❌ {role} process {os.getpid()} crashed: {e}")
+                    code = 1
+            finally:
+                os._exit(code)
+        children[pid] = role
+        return pid
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    spawn('primary')
+    for _ in range(workers):
+        spawn('worker')
+    print(f"🧵 Prefork: primary + {workers} HTTP workers on {host}:{port} (supervisor pid {os.getpid()})")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        role = children.pop(pid, None)
+        if role is None or stopping:
+            continue
+        print(f"⚠️ {role} process {pid} exited ({status}) - respawning in {RESPAWN_DELAY}s")
+        time.sleep(RESPAWN_DELAY)
+        if not stopping:
+            spawn(role)
+    listener.close()
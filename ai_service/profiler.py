@@ -0,0 +1,204 @@
+"""
+PetZone Profiler - Profile AI service đang chạy, không cần restart
+==================================================================
+- Sampling profiler: thread nền đọc sys._current_frames() mỗi vài ms trong N giây và
+  gộp stack của mọi thread (monitoring, Flask workers, I/O) thành collapsed stacks
+  (định dạng của flamegraph.pl / speedscope)
+- cProfile trong N giây: mỗi lần chạy task của scheduler và mỗi request Flask được bọc
+  bởi một cProfile.Profile riêng (cProfile chỉ đo thread gọi enable()), cuối phiên
+  gộp lại thành báo cáo pstats
+- Span log: mỗi tick ghi một dòng JSON (task, lateness, thời gian từng stage) vào file
+  xoay vòng (RotatingFileHandler)
+
+Khi tắt, hook trong hot path chỉ là một lần kiểm tra biến module (None).
+"""
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from logging.handlers import RotatingFileHandler
+from typing import Dict, Optional
+
+MAX_PROFILE_SECONDS = 60
+SAMPLE_INTERVAL = 0.005  # Giây giữa hai lần lấy mẫu stack
+
+
+class ProfilerBusy(Exception):
+    """Đang có một phiên profiling khác"""
+
+
+_session_lock = threading.Lock()
+
+
+def _exclusive():
+    if not _session_lock.acquire(blocking=False):
+        raise ProfilerBusy("Another profiling session is running")
+
+
+# ---------- sampling ----------
+
+def _collapse(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ';'.join(reversed(parts))
+
+
+def sample_stacks(seconds: float, interval: float = SAMPLE_INTERVAL,
+                  thread_prefix: Optional[str] = None) -> Dict:
+    """
+    Lấy mẫu stack mọi thread (trừ thread gọi) trong `seconds` giây.
+    Trả về {'collapsed': "thread;frame;... count\\n...", 'samples', 'threads'}.
+    """
+    _exclusive()
+    try:
+        seconds = min(max(seconds, interval), MAX_PROFILE_SECONDS)
+        me = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                if ident == me or (thread_prefix and not name.startswith(thread_prefix)):
+                    continue
+                stacks[f"{name};{_collapse(frame)}"] += 1
+            samples += 1
+            time.sleep(interval)
+    finally:
+        _session_lock.release()
+
+    lines = [f"{stack} {count}" for stack, count in stacks.most_common()]
+    return {
+        'collapsed': '\n'.join(lines) + ('\n' if lines else ''),
+        'samples': samples,
+        'threads': len({stack.split(';', 1)[0] for stack in stacks})
+    }
+
+
+# ---------- cProfile ----------
+
+class _CProfileSession:
+    def __init__(self, seconds: float):
+        self.until = time.monotonic() + seconds
+        self.sections = 0
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def add(self, profile: cProfile.Profile):
+        with self._lock:
+            self._profiles.append(profile)
+            self.sections += 1
+
+    def report(self, sort: str, limit: int) -> str:
+        stream = io.StringIO()
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return "No profiled sections (no scheduler ticks or requests during the session)\n"
+        stats = pstats.Stats(profiles[0], stream=stream)
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+
+_cprofile: Optional[_CProfileSession] = None
+
+
+def begin_section() -> Optional[cProfile.Profile]:
+    """Bắt đầu đo một đoạn (tick, request) nếu đang có phiên cProfile; None khi tắt"""
+    session = _cprofile
+    if session is None or time.monotonic() >= session.until:
+        return None
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Python 3.12+: chỉ một Profile được bật tại một thời điểm → bỏ qua đoạn chồng lấn
+        return None
+    return profile
+
+
+def end_section(profile: Optional[cProfile.Profile]):
+    if profile is None:
+        return
+    profile.disable()
+    session = _cprofile
+    if session is not None:
+        session.add(profile)
+
+
+def run_cprofile(seconds: float, sort: str = 'cumulative', limit: int = 40) -> Dict:
+    """Bật cProfile cho các tick và request trong `seconds` giây, trả về báo cáo pstats"""
+    global _cprofile
+    _exclusive()
+    try:
+        seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+        session = _cprofile = _CProfileSession(seconds)
+        time.sleep(seconds)
+        _cprofile = None
+        return {'report': session.report(sort, limit), 'sections': session.sections}
+    finally:
+        _cprofile = None
+        _session_lock.release()
+
+
+# ---------- span log ----------
+
+_span_logger: Optional[logging.Logger] = None
+_span_path: Optional[str] = None
+
+
+def enable_span_log(path: str, max_bytes: int = 5 * 1024 * 1024, backups: int = 3):
+    """Ghi span mỗi tick vào `path` (xoay vòng khi vượt max_bytes, giữ `backups` file cũ)"""
+    global _span_logger, _span_path
+    disable_span_log()
+    logger = logging.getLogger(f"petzone.spans.{path}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.handlers = [handler]
+    _span_path = path
+    _span_logger = logger
+
+
+def disable_span_log():
+    global _span_logger, _span_path
+    logger, _span_logger, _span_path = _span_logger, None, None
+    if logger is not None:
+        for handler in logger.handlers:
+            handler.close()
+        logger.handlers = []
+
+
+def span_log_enabled() -> bool:
+    return _span_logger is not None
+
+
+def log_span(kind: str, **fields):
+    """Ghi một span (no-op khi span log tắt)"""
+    logger = _span_logger
+    if logger is None:
+        return
+    logger.info(json.dumps({'ts': round(time.time(), 6), 'span': kind, **fields},
+                           ensure_ascii=False, default=str))
+
+
+def status() -> Dict:
+    return {
+        'busy': _session_lock.locked(),
+        'cprofile_active': _cprofile is not None,
+        'span_log': _span_path
+    }
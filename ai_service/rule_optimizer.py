@@ -0,0 +1,537 @@
+"""
+PetZone Rule Optimizer - Tối ưu breakpoints và trọng số của fuzzy rule set
+==========================================================================
+Tìm breakpoints của các membership function (nhiệt độ, độ ẩm) và risk weights
+trên dữ liệu lịch sử có nhãn, thay cho việc chỉnh tay fuzzy_rules.json.
+
+- Nhãn: operator override từ /manual_control (manual_overrides.jsonl) hoặc file
+  JSONL nhãn tự viết {"timestamp": ..., "fan": true/false, "emergency": true/false}
+- Mục tiêu: ít emergency sai, ít bật/tắt quạt, khớp với quyết định của operator.
+  Ràng buộc cứng so với rule set gốc: không thêm emergency sai/bỏ sót, không thêm
+  emergency trên readings chưa gán nhãn (ít nhãn không được đổi lấy ít bật/tắt quạt)
+- Cả một thế hệ ứng viên được đánh giá cùng lúc bằng NumPy broadcasting
+  (trục ứng viên K x trục reading N), chia theo process pool
+- Kết quả là rule config JSON mà engine load được trực tiếp
+
+Cách dùng:
+    python rule_optimizer.py readings.npy --labels manual_overrides.jsonl --output tuned_rules.json
+"""
+
+import argparse
+import copy
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ai_decision_engine import ReplayState
+from backtest import DEFAULT_CHUNK_SIZE, iter_clean_chunks
+from fuzzy_rules import (
+    DEFAULT_RULES_PATH,
+    CompiledRuleSet,
+    compile_rule_set,
+    load_rule_config,
+    ordered_dot,
+    trapmf_vec,
+)
+
+# Mã nhãn trong dataset
+LABEL_UNKNOWN = -1
+
+DANGER_CODE = 2  # index 'danger' trong ALERT_LEVEL_ORDER
+
+# Trọng số mặc định của hàm mục tiêu (giá trị càng nhỏ càng tốt). Mọi số hạng cùng thang
+# tỉ lệ (~0-1) để không số hạng nào lấn át chỉ vì đơn vị
+DEFAULT_OBJECTIVE = {
+    'false_emergency': 10.0,     # Tỉ lệ emergency trên reading được gán nhãn "không khẩn cấp"
+    'missed_emergency': 50.0,    # Tỉ lệ bỏ sót trên reading được gán nhãn "khẩn cấp"
+    'fan_mismatch': 5.0,         # Tỉ lệ trạng thái quạt khác quyết định của operator
+    'fan_toggles': 1.0,          # Số lần quạt đổi trạng thái so với rule set gốc (1.0 = như gốc)
+    'false_alert': 1.0,          # Alert >= danger trên reading "không khẩn cấp"
+    'missed_alert': 5.0,         # Alert < danger trên reading "khẩn cấp"
+    'drift': 0.5,                # Khoảng cách (chuẩn hoá) so với rule set gốc - chống overfit
+}
+
+DATASET_DTYPE = np.dtype([
+    ('timestamp', 'f8'),
+    ('temperature', 'f8'),
+    ('humidity', 'f8'),
+    ('forecast', 'f8'),
+    ('trend_boost', 'f8'),
+    ('pet_risk', 'f8'),
+    ('fan_label', 'i1'),
+    ('emergency_label', 'i1'),
+])
+
+
+@dataclass
+class OptimizerConfig:
+    """Tham số tìm kiếm"""
+    population: int = 32             # Số ứng viên mỗi thế hệ
+    generations: int = 15
+    breakpoint_sigma: float = 1.0    # Độ lệch chuẩn khi đột biến breakpoint (°C / %)
+    weight_sigma: float = 0.05       # Độ lệch chuẩn khi đột biến risk weight
+    shrink: float = 0.7              # Thu nhỏ sigma khi một thế hệ không cải thiện
+    label_window: float = 60.0       # Nhãn áp cho readings trong [t - window, t] của override
+    eval_chunk: int = 8192           # Số reading mỗi lần broadcast (giới hạn bộ nhớ K x N)
+    seed: int = 0
+    objective: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_OBJECTIVE))
+
+
+# ========== LABELS ==========
+
+def _label_time(value) -> float:
+    """Epoch giây; ISO không có timezone được hiểu là UTC như CreatedAt trong backtest"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def load_labels(path: str) -> List[Tuple[float, Optional[bool], Optional[bool]]]:
+    """
+    Đọc nhãn JSONL → [(timestamp, fan, emergency)], None = không có nhãn.
+    Dòng override (device/action) của quạt: operator bật quạt → quạt nên bật;
+    operator tắt quạt → quạt nên tắt và tình huống không khẩn cấp.
+    """
+    labels = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                t = _label_time(record['timestamp'])
+            except (ValueError, KeyError) as e:
+                print(f"⚠️ {path}:{line_no} bỏ qua nhãn lỗi: {e}")
+                continue
+            if 'device' in record:
+                if record['device'] != 'fan':
+                    continue
+                fan_on = record.get('action') == 'on'
+                labels.append((t, fan_on, None if fan_on else False))
+            else:
+                fan = record.get('fan')
+                emergency = record.get('emergency')
+                labels.append((t, None if fan is None else bool(fan),
+                               None if emergency is None else bool(emergency)))
+    labels.sort(key=lambda item: item[0])
+    return labels
+
+
+def _apply_labels(t: np.ndarray, labels, window: float, fan: np.ndarray, emergency: np.ndarray):
+    """Gán nhãn cho readings trong [t_label - window, t_label] (điều kiện khiến operator can thiệp)"""
+    if not labels:
+        return
+    times = np.array([item[0] for item in labels])
+    lo = np.searchsorted(t, times - window, side='left')
+    hi = np.searchsorted(t, times, side='right')
+    for (_, fan_label, emergency_label), start, stop in zip(labels, lo.tolist(), hi.tolist()):
+        if stop <= start:
+            continue
+        if fan_label is not None:
+            fan[start:stop] = int(fan_label)
+        if emergency_label is not None:
+            emergency[start:stop] = int(emergency_label)
+
+
+# ========== DATASET ==========
+
+def build_dataset(input_path: str, labels, base: CompiledRuleSet,
+                  label_window: float = 60.0, chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+    """
+    Tính trước các phần không phụ thuộc tham số được tối ưu (slope → trend_boost,
+    forecast, pet risk) một lần cho toàn bộ file; optimizer chỉ đánh giá lại phần
+    membership nhiệt độ/độ ẩm và trọng số cho từng ứng viên.
+    """
+    state = ReplayState()
+    parts = []
+    for chunk, _ in iter_clean_chunks(input_path, chunk_size):
+        if chunk is None:
+            continue
+        t = chunk['timestamp']
+        temperature = chunk['temperature']
+        part = np.empty(len(t), dtype=DATASET_DTYPE)
+        part['timestamp'] = t
+        part['temperature'] = temperature
+        part['humidity'] = chunk['humidity']
+        rate = state.slope.update(t, temperature)
+        part['trend_boost'] = base.trend_boost(temperature, rate)[0]
+        if base.forecast_weight > 0:
+            part['forecast'] = state.forecaster.update_batch(t, temperature, base.forecast_horizon)
+        else:
+            part['forecast'] = np.nan
+        pet_m = base.pet_membership(chunk['presence_energy'], chunk['movement_energy'])
+        part['pet_risk'] = ordered_dot(pet_m, base.pet_risk)
+        parts.append(part)
+
+    data = np.concatenate(parts) if parts else np.empty(0, dtype=DATASET_DTYPE)
+    fan = np.full(len(data), LABEL_UNKNOWN, dtype=np.int8)
+    emergency = np.full(len(data), LABEL_UNKNOWN, dtype=np.int8)
+    _apply_labels(data['timestamp'], labels, label_window, fan, emergency)
+    data['fan_label'] = fan
+    data['emergency_label'] = emergency
+    return data
+
+
+# ========== PARAMETER SPACE ==========
+
+class ParameterSpace:
+    """
+    Mã hoá các tham số được tối ưu thành vector phẳng:
+    breakpoints của từng tập nhiệt độ/độ ẩm (trimf 3, trapmf 4) + 3 risk weights.
+    """
+
+    VARIABLES = ('temperature', 'humidity')
+    WEIGHT_KEYS = ('temperature_critical', 'humidity_critical', 'pet_presence_critical')
+
+    def __init__(self, config: Dict):
+        self.config = config
+        self.slots = []  # (variable, set name, shape, start, length)
+        values = []
+        for variable in self.VARIABLES:
+            for name, spec in config[variable]['sets'].items():
+                params = [float(v) for v in spec['params']]
+                self.slots.append((variable, name, spec.get('shape', 'trimf'), len(values), len(params)))
+                values.extend(params)
+        self.n_breakpoints = len(values)
+        values.extend(float(config['weights'][k]) for k in self.WEIGHT_KEYS)
+        self.base = np.array(values)
+
+    def scales(self, breakpoint_sigma: float, weight_sigma: float) -> np.ndarray:
+        return np.concatenate([np.full(self.n_breakpoints, breakpoint_sigma),
+                               np.full(len(self.WEIGHT_KEYS), weight_sigma)])
+
+    def repair(self, candidates: np.ndarray) -> np.ndarray:
+        """Đưa ứng viên về miền hợp lệ: breakpoints tăng dần trong mỗi tập, weights trong [0.05, 1]"""
+        candidates = candidates.copy()
+        for _, _, _, start, length in self.slots:
+            candidates[:, start:start + length] = np.sort(candidates[:, start:start + length], axis=1)
+        candidates[:, :self.n_breakpoints] = np.round(candidates[:, :self.n_breakpoints], 2)
+        weights = candidates[:, self.n_breakpoints:]
+        candidates[:, self.n_breakpoints:] = np.round(np.clip(weights, 0.05, 1.0), 3)
+        return candidates
+
+    def matrices(self, candidates: np.ndarray) -> Dict[str, np.ndarray]:
+        """Ứng viên (K, P) → params (K, 5, 4) cho từng biến và weights (K, 3)"""
+        k = len(candidates)
+        out = {}
+        for variable in self.VARIABLES:
+            slots = [s for s in self.slots if s[0] == variable]
+            params = np.empty((k, len(slots), 4))
+            for j, (_, _, _, start, length) in enumerate(slots):
+                p = candidates[:, start:start + length]
+                params[:, j] = p if length == 4 else p[:, [0, 1, 1, 2]]
+            out[variable] = params
+        out['weights'] = candidates[:, self.n_breakpoints:]
+        return out
+
+    def to_config(self, vector: np.ndarray, name: str) -> Dict:
+        """Vector → rule config đầy đủ (các phần không tối ưu giữ nguyên từ config gốc)"""
+        config = copy.deepcopy(self.config)
+        config['name'] = name
+        for variable, set_name, _, start, length in self.slots:
+            config[variable]['sets'][set_name]['params'] = [
+                _compact_number(v) for v in vector[start:start + length].tolist()]
+        for key, value in zip(self.WEIGHT_KEYS, vector[self.n_breakpoints:].tolist()):
+            config['weights'][key] = _compact_number(value)
+        return config
+
+
+def _compact_number(value: float):
+    return int(value) if float(value).is_integer() else round(value, 3)
+
+
+# ========== BATCH EVALUATION ==========
+
+def evaluate_candidates(data: np.ndarray, base: CompiledRuleSet, matrices: Dict[str, np.ndarray],
+                        eval_chunk: int = 8192) -> Dict[str, np.ndarray]:
+    """
+    Đánh giá K ứng viên trên toàn bộ dataset, broadcast (K, N, 5) theo từng chunk.
+    Cùng công thức với CompiledRuleSet.evaluate() và hysteresis của analyze_batch().
+    """
+    temp_params = matrices['temperature'][:, None]   # (K, 1, 5, 4)
+    hum_params = matrices['humidity'][:, None]
+    weights = matrices['weights']                     # (K, 3)
+    weight_sum = weights[:, 0] + weights[:, 1] + weights[:, 2]
+    k = len(weights)
+
+    counts = {name: np.zeros(k, dtype=np.int64) for name in (
+        'false_emergency', 'missed_emergency', 'fan_mismatch', 'fan_toggles',
+        'false_alert', 'missed_alert', 'emergencies', 'unlabeled_emergencies')}
+    fan_running = np.zeros(k, dtype=bool)
+
+    for start in range(0, len(data), eval_chunk):
+        chunk = data[start:start + eval_chunk]
+        n = len(chunk)
+        temperature = chunk['temperature']
+        temp_m = trapmf_vec(temperature[None, :, None], temp_params)          # (K, N, 5)
+        hum_m = trapmf_vec(chunk['humidity'][None, :, None], hum_params)
+        temp_risk = ordered_dot(temp_m, base.temperature_risk)               # (K, N)
+        hum_risk = ordered_dot(hum_m, base.humidity_risk)
+        pet_risk = chunk['pet_risk'][None, :]
+        combined = (temp_risk * weights[:, :1] + hum_risk * weights[:, 1:2] +
+                    pet_risk * weights[:, 2:]) / weight_sum[:, None]
+        codes = base.alert_codes(combined)
+
+        hot = ordered_dot(temp_m, base.hot_weights) + chunk['trend_boost'][None, :]
+        forecast = chunk['forecast']
+        if base.forecast_weight > 0 and not np.isnan(forecast).all():
+            fc_m = trapmf_vec(np.nan_to_num(forecast)[None, :, None], temp_params)
+            hot_fc = np.where(np.isnan(forecast)[None, :], 0.0,
+                              ordered_dot(fc_m, base.hot_weights) * base.forecast_weight)
+            hot = np.maximum(hot, hot_fc)
+
+        emergency = (temp_risk > base.emergency_threshold) | (pet_risk > base.emergency_threshold)
+
+        # Hysteresis quạt theo từng ứng viên (forward fill sự kiện bật/tắt gần nhất)
+        turn_on = hot > base.fan_on_threshold
+        off_candidate = (hot < base.fan_off_threshold) & ~turn_on
+        events = np.where(turn_on, 1, np.where(off_candidate, 0, -1))
+        index = np.where(events >= 0, np.arange(n)[None, :], -1)
+        last_event = np.maximum.accumulate(index, axis=1)
+        fired = np.take_along_axis(events, np.maximum(last_event, 0), axis=1) == 1
+        running = np.where(last_event >= 0, fired, fan_running[:, None])
+        previous = np.concatenate([fan_running[:, None], running[:, :-1]], axis=1)
+        counts['fan_toggles'] += (running != previous).sum(axis=1)
+        fan_running = running[:, -1]
+
+        fan_label = chunk['fan_label'][None, :]
+        counts['fan_mismatch'] += ((fan_label >= 0) & (running != (fan_label == 1))).sum(axis=1)
+        not_emergency = chunk['emergency_label'][None, :] == 0
+        is_emergency = chunk['emergency_label'][None, :] == 1
+        counts['false_emergency'] += (emergency & not_emergency).sum(axis=1)
+        counts['missed_emergency'] += (~emergency & is_emergency).sum(axis=1)
+        counts['false_alert'] += ((codes >= DANGER_CODE) & not_emergency).sum(axis=1)
+        counts['missed_alert'] += ((codes < DANGER_CODE) & is_emergency).sum(axis=1)
+        counts['emergencies'] += emergency.sum(axis=1)
+        counts['unlabeled_emergencies'] += (emergency & (chunk['emergency_label'][None, :] < 0)).sum(axis=1)
+
+    return counts
+
+
+# Bộ đếm ứng viên không được vượt rule set gốc (vi phạm → điểm vô cực, không bao giờ được chọn)
+EMERGENCY_CONSTRAINTS = ('false_emergency', 'missed_emergency', 'unlabeled_emergencies')
+
+
+def score(counts: Dict[str, np.ndarray], data_summary: Dict, drift: np.ndarray,
+          objective: Dict[str, float], baseline: Optional[Dict[str, int]] = None) -> np.ndarray:
+    """
+    Hàm mục tiêu: tổng có trọng số của các tỉ lệ lỗi (nhỏ hơn = tốt hơn).
+    baseline: bộ đếm của rule set gốc - chuẩn hoá số lần bật/tắt quạt và áp ràng buộc
+    EMERGENCY_CONSTRAINTS (None khi đang đánh giá chính rule set gốc).
+    """
+    em0 = max(data_summary['labeled_not_emergency'], 1)
+    em1 = max(data_summary['labeled_emergency'], 1)
+    fan = max(data_summary['labeled_fan'], 1)
+    base_toggles = max(baseline['fan_toggles'], 1) if baseline else np.maximum(counts['fan_toggles'], 1)
+    total = (objective.get('false_emergency', 0.0) * counts['false_emergency'] / em0 +
+             objective.get('missed_emergency', 0.0) * counts['missed_emergency'] / em1 +
+             objective.get('fan_mismatch', 0.0) * counts['fan_mismatch'] / fan +
+             objective.get('fan_toggles', 0.0) * counts['fan_toggles'] / base_toggles +
+             objective.get('false_alert', 0.0) * counts['false_alert'] / em0 +
+             objective.get('missed_alert', 0.0) * counts['missed_alert'] / em1 +
+             objective.get('drift', 0.0) * drift)
+    if baseline:
+        infeasible = np.zeros(len(total), dtype=bool)
+        for name in EMERGENCY_CONSTRAINTS:
+            infeasible |= counts[name] > baseline[name]
+        total = np.where(infeasible, np.inf, total)
+    return total
+
+
+def emergency_regressions(result: Dict) -> List[str]:
+    """Các bộ đếm emergency mà rule set kết quả tệ hơn rule set gốc (rỗng = an toàn để ghi)"""
+    return [f"{name} {result['baseline'][name]} → {result['best'][name]}"
+            for name in EMERGENCY_CONSTRAINTS if result['best'][name] > result['baseline'][name]]
+
+
+# ========== PROCESS POOL ==========
+
+_worker_data: Optional[np.ndarray] = None
+_worker_base: Optional[CompiledRuleSet] = None
+
+
+def _init_worker(dataset_path: str, base_config: Dict):
+    """Mỗi worker mmap dataset một lần thay vì nhận bản copy qua pickle mỗi task"""
+    global _worker_data, _worker_base
+    _worker_data = np.load(dataset_path, mmap_mode='r')
+    _worker_base = compile_rule_set(base_config)
+
+
+def _evaluate_slice(args) -> Dict[str, np.ndarray]:
+    matrices, eval_chunk = args
+    return evaluate_candidates(_worker_data, _worker_base, matrices, eval_chunk)
+
+
+class RuleOptimizer:
+    """
+    Tìm kiếm tiến hoá đơn giản quanh rule set gốc: mỗi thế hệ sinh `population`
+    ứng viên bằng đột biến Gauss từ ứng viên tốt nhất, giữ lại nếu tốt hơn,
+    thu nhỏ bước đột biến khi không cải thiện.
+    """
+
+    def __init__(self, data: np.ndarray, base_config: Dict, config: OptimizerConfig = None,
+                 workers: Optional[int] = None):
+        self.data = data
+        self.base_config = base_config
+        self.base = compile_rule_set(base_config)
+        self.config = config or OptimizerConfig()
+        self.space = ParameterSpace(base_config)
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.summary = {
+            'readings': int(len(data)),
+            'days': float(data['timestamp'][-1] - data['timestamp'][0]) / 86400 if len(data) > 1 else 0.0,
+            'labeled_fan': int((data['fan_label'] >= 0).sum()),
+            'labeled_emergency': int((data['emergency_label'] == 1).sum()),
+            'labeled_not_emergency': int((data['emergency_label'] == 0).sum()),
+        }
+        self.history: List[Dict] = []
+        self.baseline_counts: Optional[Dict[str, int]] = None  # Gán sau khi đánh giá rule set gốc
+        self._pool = None
+        self._tmpdir = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            self._tmpdir = tempfile.mkdtemp(prefix='petzone_opt_')
+            dataset_path = os.path.join(self._tmpdir, 'dataset.npy')
+            np.save(dataset_path, self.data)
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(dataset_path, self.base_config))
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool:
+            self._pool.shutdown()
+            self._pool = None
+        if self._tmpdir:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+
+    def evaluate(self, candidates: np.ndarray) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Điểm và bộ đếm cho ma trận ứng viên (K, P)"""
+        cfg = self.config
+        if self._pool is None:
+            counts = evaluate_candidates(self.data, self.base, self.space.matrices(candidates), cfg.eval_chunk)
+        else:
+            slices = np.array_split(candidates, min(self.workers, len(candidates)))
+            jobs = [(self.space.matrices(s), cfg.eval_chunk) for s in slices if len(s)]
+            parts = list(self._pool.map(_evaluate_slice, jobs))
+            counts = {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+        span = np.maximum(np.abs(self.space.base), 1.0)
+        drift = np.sqrt((((candidates - self.space.base) / span) ** 2).mean(axis=1))
+        return score(counts, self.summary, drift, cfg.objective, self.baseline_counts), counts
+
+    def run(self) -> Dict:
+        cfg = self.config
+        rng = np.random.default_rng(cfg.seed)
+        base_vector = self.space.repair(self.space.base[None, :])
+        base_scores, base_counts = self.evaluate(base_vector)
+        best, best_score = base_vector[0], float(base_scores[0])
+        best_counts = {k: int(v[0]) for k, v in base_counts.items()}
+        self.baseline_counts = best_counts
+        baseline = {'score': round(best_score, 6), **best_counts}
+        sigma = self.space.scales(cfg.breakpoint_sigma, cfg.weight_sigma)
+
+        for generation in range(cfg.generations):
+            started = time.perf_counter()
+            noise = rng.standard_normal((cfg.population, len(best))) * sigma
+            candidates = self.space.repair(best[None, :] + noise)
+            scores, counts = self.evaluate(candidates)
+            i = int(np.argmin(scores))
+            improved = scores[i] < best_score
+            if improved:
+                best, best_score = candidates[i], float(scores[i])
+                best_counts = {k: int(v[i]) for k, v in counts.items()}
+            else:
+                sigma = sigma * cfg.shrink
+            self.history.append({
+                'generation': generation,
+                'best_score': round(best_score, 6),
+                'improved': bool(improved),
+                'elapsed_seconds': round(time.perf_counter() - started, 3),
+            })
+            print(f"🧬 Gen {generation + 1}/{cfg.generations}: score {best_score:.4f}"
+                  f"{' ✨' if improved else ''} ({self.history[-1]['elapsed_seconds']}s)")
+
+        name = f"{self.base.name}-tuned"
+        tuned = self.space.to_config(best, name)
+        compile_rule_set(tuned)  # Đảm bảo engine load được
+        return {
+            'config': tuned,
+            'baseline': baseline,
+            'best': {'score': round(best_score, 6), **best_counts},
+            'dataset': self.summary,
+            'history': self.history,
+        }
+
+
+def optimize(input_path: str, labels_path: Optional[str], rules_path: str = DEFAULT_RULES_PATH,
+             config: OptimizerConfig = None, workers: Optional[int] = None) -> Dict:
+    """Đọc dữ liệu + nhãn, chạy optimizer, trả về rule config tốt nhất và báo cáo"""
+    config = config or OptimizerConfig()
+    base_config = load_rule_config(rules_path)
+    labels = load_labels(labels_path) if labels_path else []
+    data = build_dataset(input_path, labels, compile_rule_set(base_config), config.label_window)
+    if not len(data):
+        raise ValueError(f"Không có reading hợp lệ trong {input_path}")
+    with RuleOptimizer(data, base_config, config, workers) as optimizer:
+        return optimizer.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tối ưu membership breakpoints và risk weights")
+    parser.add_argument('input', help="File readings (.csv hoặc .npy)")
+    parser.add_argument('--labels', help="Nhãn JSONL (manual_overrides.jsonl hoặc {timestamp, fan, emergency})")
+    parser.add_argument('--rules', default=DEFAULT_RULES_PATH, help="Rule set gốc")
+    parser.add_argument('--output', default='tuned_rules.json', help="File rule set kết quả")
+    parser.add_argument('--population', type=int, default=OptimizerConfig.population)
+    parser.add_argument('--generations', type=int, default=OptimizerConfig.generations)
+    parser.add_argument('--label-window', type=float, default=OptimizerConfig.label_window)
+    parser.add_argument('--seed', type=int, default=OptimizerConfig.seed)
+    parser.add_argument('--workers', type=int, default=None, help="Số process (mặc định = số CPU)")
+    parser.add_argument('--objective', nargs='*', default=[], metavar='KEY=WEIGHT',
+                        help=f"Ghi đè trọng số mục tiêu ({', '.join(DEFAULT_OBJECTIVE)})")
+    args = parser.parse_args()
+
+    config = OptimizerConfig(population=args.population, generations=args.generations,
+                             label_window=args.label_window, seed=args.seed)
+    for item in args.objective:
+        key, _, value = item.partition('=')
+        if key not in DEFAULT_OBJECTIVE:
+            parser.error(f"Objective không hợp lệ: {key}")
+        config.objective[key] = float(value)
+
+    print(f"🎯 Optimizing {args.rules} trên {args.input}")
+    result = optimize(args.input, args.labels, args.rules, config, args.workers)
+
+    dataset = result['dataset']
+    print(f"\n📊 {dataset['readings']} readings, {dataset['days']:.1f} ngày, "
+          f"{dataset['labeled_fan']} nhãn quạt, "
+          f"{dataset['labeled_emergency'] + dataset['labeled_not_emergency']} nhãn emergency")
+    for key in ('score', 'false_emergency', 'missed_emergency', 'fan_mismatch', 'fan_toggles',
+                'emergencies', 'unlabeled_emergencies'):
+        print(f"   {key:<22} {result['baseline'][key]:>12} → {result['best'][key]}")
+
+    regressions = emergency_regressions(result)
+    if regressions:
+        parser.exit(1, f"❌ Rule set kết quả tăng emergency so với gốc ({', '.join(regressions)}) - "
+                       f"không ghi {args.output}\n")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result['config'], f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Tuned rule set saved to {args.output} (load bằng RULES_PATH hoặc POST /rules/reload)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+PetZone Scheduler - Lập lịch fixed-rate không trôi cho các tác vụ định kỳ
+========================================================================
+`time.sleep(CHECK_INTERVAL)` sau mỗi vòng làm chu kỳ thật = interval + thời gian xử lý
+và mạng, nên lịch trôi dần và không đều khi tải cao. Scheduler này giữ deadline tuyệt
+đối trên time.monotonic(): tick thứ k của task chạy tại start + k * interval, bất kể
+tick trước mất bao lâu.
+
+- Mỗi task có interval riêng (đánh giá sensor, rollup thống kê, đồng bộ thiết bị...)
+- Overrun (tick chạy lâu hơn interval): 'skip' bỏ các tick đã lỡ, chạy tiếp ở mốc kế tiếp
+  trên lưới; 'merge' gộp các tick đã lỡ thành một lần chạy ngay rồi quay lại lưới
+- Lateness (trễ so với deadline) của mỗi tick được ghi nhận
+- trigger(name): chạy task ngay (ví dụ khi có reading được push) mà không dời lưới
+"""
+
+import math
+import time
+import traceback
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Optional
+
+import profiler
+
+OVERRUN_POLICIES = ('skip', 'merge')
+
+
+class ScheduledTask:
+    """Một task định kỳ và thống kê của nó"""
+
+    def __init__(self, name: str, interval: float, fn: Callable[[], None],
+                 overrun: str, first_deadline: float):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.overrun = overrun
+        self.next_deadline = first_deadline
+        self.stats = {
+            'runs': 0,
+            'triggered_runs': 0,
+            'skipped_ticks': 0,
+            'merged_ticks': 0,
+            'errors': 0,
+            'last_lateness_ms': None,
+            'max_lateness_ms': 0.0,
+            'mean_lateness_ms': None,
+            'last_duration_ms': None,
+            'max_duration_ms': 0.0
+        }
+
+    def record(self, lateness_ms: Optional[float], duration_ms: float):
+        stats = self.stats
+        stats['last_duration_ms'] = round(duration_ms, 3)
+        stats['max_duration_ms'] = round(max(stats['max_duration_ms'], duration_ms), 3)
+        if lateness_ms is None:
+            stats['triggered_runs'] += 1
+            return
+        stats['runs'] += 1
+        mean = stats['mean_lateness_ms']
+        stats['last_lateness_ms'] = round(lateness_ms, 3)
+        stats['max_lateness_ms'] = round(max(stats['max_lateness_ms'], lateness_ms), 3)
+        stats['mean_lateness_ms'] = round(lateness_ms if mean is None else 0.9 * mean + 0.1 * lateness_ms, 3)
+
+    def advance(self, now: float):
+        """Dời deadline sang mốc kế tiếp trên lưới, xử lý overrun theo policy"""
+        deadline = self.next_deadline + self.interval
+        if deadline > now:
+            self.next_deadline = deadline
+            return
+        # Số mốc trên lưới đã qua (tick chạy quá lâu hoặc tiến trình bị treo)
+        missed = math.floor((now - self.next_deadline) / self.interval)
+        if self.overrun == 'merge':
+            self.next_deadline += missed * self.interval   # ≤ now → chạy ngay một lần
+            self.stats['merged_ticks'] += missed - 1
+        else:
+            self.next_deadline += (missed + 1) * self.interval
+            self.stats['skipped_ticks'] += missed
+
+    def to_dict(self, now: float) -> Dict:
+        return {
+            'interval_s': self.interval,
+            'overrun': self.overrun,
+            'next_in_s': round(self.next_deadline - now, 3),
+            **self.stats
+        }
+
+
+class FixedRateScheduler:
+    """
+    Chạy mọi task trên một thread (task không chạy chồng nhau, giữ thứ tự xử lý readings).
+    Thread ngủ tới deadline sớm nhất hoặc tới khi có trigger().
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._tasks: Dict[str, ScheduledTask] = {}
+        self._triggered: List[str] = []
+        self._lock = Lock()
+        self._wake = Event()
+        self._running = False
+
+    def add(self, name: str, interval: float, fn: Callable[[], None],
+            overrun: str = 'skip', start_delay: float = 0.0) -> ScheduledTask:
+        if interval <= 0:
+            raise ValueError("interval phải > 0")
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError(f"Overrun policy không hợp lệ: {overrun} (chọn {', '.join(OVERRUN_POLICIES)})")
+        task = ScheduledTask(name, interval, fn, overrun, self.clock() + start_delay)
+        with self._lock:
+            self._tasks[name] = task
+        self._wake.set()
+        return task
+
+    def trigger(self, name: str):
+        """Yêu cầu chạy task ngay (ngoài lịch), gọi được từ thread bất kỳ"""
+        with self._lock:
+            if name in self._tasks and name not in self._triggered:
+                self._triggered.append(name)
+        self._wake.set()
+
+    def run_pending(self) -> int:
+        """Chạy các task được trigger và các task đã tới deadline, trả về số lần chạy"""
+        with self._lock:
+            triggered, self._triggered = self._triggered, []
+            tasks = list(self._tasks.values())
+        ran = 0
+        for name in triggered:
+            self._run(self._tasks[name], lateness_ms=None)
+            ran += 1
+        for task in sorted(tasks, key=lambda t: t.next_deadline):
+            now = self.clock()
+            if task.next_deadline > now:
+                continue
+            self._run(task, lateness_ms=(now - task.next_deadline) * 1000.0)
+            task.advance(self.clock())
+            ran += 1
+        return ran
+
+    def _run(self, task: ScheduledTask, lateness_ms: Optional[float]):
+        started = self.clock()
+        profile = profiler.begin_section()
+        try:
+            task.fn()
+        except Exception as e:
+            task.stats['errors'] += 1
+            print(f"❌ Error in scheduled task {task.name}: {e}")
+            traceback.print_exc()
+        finally:
+            profiler.end_section(profile)
+        duration_ms = (self.clock() - started) * 1000.0
+        task.record(lateness_ms, duration_ms)
+        if profiler.span_log_enabled():
+            profiler.log_span('task', task=task.name, triggered=lateness_ms is None,
+                              lateness_ms=None if lateness_ms is None else round(lateness_ms, 3),
+                              duration_ms=round(duration_ms, 3))
+
+    def next_wait(self) -> Optional[float]:
+        """Số giây tới deadline sớm nhất (0 nếu có trigger đang chờ, None nếu không có task)"""
+        with self._lock:
+            if self._triggered:
+                return 0.0
+            if not self._tasks:
+                return None
+            deadline = min(task.next_deadline for task in self._tasks.values())
+        return max(0.0, deadline - self.clock())
+
+    def run(self, should_run: Callable[[], bool] = None):
+        """Vòng lặp chính (chạy trên thread của caller) tới khi stop() hoặc should_run() False"""
+        self._running = True
+        while self._running and (should_run is None or should_run()):
+            wait = self.next_wait()
+            if wait is None or wait > 0:
+                self._wake.wait(wait)
+            self._wake.clear()
+            self.run_pending()
+
+    def start(self) -> Thread:
+        thread = Thread(target=self.run, daemon=True, name="scheduler")
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+
+    def stats(self) -> Dict:
+        now = self.clock()
+        with self._lock:
+            tasks = list(self._tasks.values())
+        return {task.name: task.to_dict(now) for task in tasks}
@@ -0,0 +1,379 @@
+"""
+PetZone Sensor Anomaly - Phát hiện dữ liệu cảm biến bất thường (streaming)
+==========================================================================
+DHT bị treo vẫn gửi cùng một giá trị, field thiếu trở thành 0 qua data.get(..., 0)...
+Stage này chạy trước fuzzy inference, bộ nhớ cố định cho mỗi tín hiệu:
+
+- out_of_range: ngoài giới hạn vật lý của cảm biến
+- zero:         đúng 0.0 ở tín hiệu không thể bằng 0 (thường là field bị thiếu)
+- jump:         thay đổi nhanh hơn mức vật lý cho phép so với giá trị tin cậy gần nhất
+- stuck:        cả reading đứng im quá lâu (mọi kênh cùng giá trị - ESP32 gửi lại gói cũ),
+                hoặc một kênh vốn có nhiễu lại đứng im tuyệt đối. Nhiệt độ thật đứng yên
+                (DHT11 độ phân giải 1°C trong đợt nóng) không bị coi là stuck
+- outlier:      robust z-score lớn (median/MAD xấp xỉ online)
+- stale:        timestamp không tăng qua nhiều lần poll (ESP32 ngừng gửi)
+
+Kết quả là data quality (0-1) để giảm confidence, cờ chặn điều khiển quạt khi nhiệt độ
+không đáng tin (out_of_range, zero, jump), và cờ invalid_value khi giá trị nhiệt độ không
+phải số đo thật (out_of_range, zero) - chỉ khi đó emergency/alert level mới bị hạ.
+"""
+
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+FLAGS = ('out_of_range', 'zero', 'jump', 'stuck', 'outlier', 'stale')
+
+# Hệ số quality cho mỗi loại bất thường (nhân dồn, 1.0 = không ảnh hưởng)
+QUALITY_FACTORS = {
+    'out_of_range': 0.1,
+    'zero': 0.1,
+    'jump': 0.3,
+    'stuck': 0.4,
+    'outlier': 0.7,
+    'stale': 0.5,
+}
+
+# Bất thường của nhiệt độ làm quyết định bật/tắt quạt không đáng tin
+SEVERE_FLAGS = ('out_of_range', 'zero', 'jump')
+# Giá trị nhiệt độ không phải số đo thật → emergency/alert level từ giá trị đó bị hạ.
+# Giá trị trong giới hạn (kể cả jump, stuck) không bao giờ làm mất emergency
+INVALID_FLAGS = ('out_of_range', 'zero')
+
+
+@dataclass
+class SignalLimits:
+    """Giới hạn vật lý và tham số phát hiện cho một tín hiệu"""
+    low: float
+    high: float
+    max_jump: Optional[float] = None        # Thay đổi tối đa giữa 2 reading liên tiếp
+    max_rate_per_min: float = 0.0           # Cộng thêm theo khoảng thời gian giữa 2 reading
+    stuck_seconds: Optional[float] = None   # Kênh đứng im lâu hơn → stuck khi có nhiễu (None = không kiểm tra)
+    noise_floor: Optional[float] = None     # MAD trước khi đứng im ≥ mức này → kênh vốn nhiễu, đứng im là treo
+    zero_suspect: bool = False              # 0.0 đúng tuyệt đối là đáng ngờ
+    mad_floor: float = 0.1                  # MAD tối thiểu (tránh z-score lớn khi tín hiệu rất ổn định)
+    z_threshold: Optional[float] = 6.0      # Robust z-score tối đa (None = không kiểm tra)
+
+
+def _default_limits() -> Dict[str, SignalLimits]:
+    return {
+        # DHT11/22: -40..80°C, 0..100%RH, độ phân giải 0.1
+        'temperature': SignalLimits(-20.0, 60.0, max_jump=3.0, max_rate_per_min=2.0,
+                                    stuck_seconds=1800.0, noise_floor=0.2, zero_suspect=True,
+                                    mad_floor=0.3),
+        'humidity': SignalLimits(0.0, 100.0, max_jump=15.0, max_rate_per_min=10.0,
+                                 stuck_seconds=1800.0, noise_floor=1.0, zero_suspect=True,
+                                 mad_floor=1.0),
+        # Radar presence/movement: 0 là giá trị hợp lệ (không có thú cưng)
+        'presence_energy': SignalLimits(0.0, 100.0, z_threshold=None),
+        'movement_energy': SignalLimits(0.0, 100.0, z_threshold=None),
+    }
+
+
+@dataclass
+class AnomalyConfig:
+    """Cấu hình anomaly stage"""
+    signals: Dict[str, SignalLimits] = field(default_factory=_default_limits)
+    warmup: int = 20                # Số reading đầu dùng để khởi tạo median/MAD chính xác
+    median_step: float = 0.05       # Bước cập nhật median/MAD (tỉ lệ theo MAD)
+    rebaseline_after: int = 3       # Số jump liên tiếp đồng ý với nhau → chấp nhận mức mới
+    outlier_rebaseline: int = 12    # Số outlier liên tiếp → coi là mức mới, khởi tạo lại median/MAD
+    stale_readings: int = 6         # Số lần poll liên tiếp không có reading mới → stale
+    frozen_seconds: float = 1800.0  # Mọi kênh cùng đứng im lâu hơn → reading bị treo (stuck)
+
+
+@dataclass
+class AnomalyReport:
+    """Kết quả kiểm tra một reading"""
+    flags: Dict[str, List[str]]             # tín hiệu → danh sách bất thường
+    quality: float                          # 0.0 - 1.0
+    suppress_actuation: bool
+    z_scores: Dict[str, float] = field(default_factory=dict)
+    invalid_value: bool = False             # Nhiệt độ không phải số đo thật (out_of_range, zero)
+
+    @property
+    def ok(self) -> bool:
+        return not self.flags
+
+    def to_dict(self) -> Dict:
+        return {
+            "quality": round(self.quality, 3),
+            "flags": self.flags,
+            "suppress_actuation": self.suppress_actuation,
+            "invalid_value": self.invalid_value,
+            "z_scores": {k: round(v, 2) for k, v in self.z_scores.items()}
+        }
+
+
+class _SignalState:
+    """Trạng thái O(1) của một tín hiệu"""
+
+    __slots__ = ('limits', 'reference', 'reference_t', 'pending', 'pending_count',
+                 'run_value', 'run_start', 'run_noise', 'median', 'mad', 'count', 'warmup',
+                 'outlier_run')
+
+    def __init__(self, limits: SignalLimits, warmup: int):
+        self.limits = limits
+        self.reference = None       # Giá trị tin cậy gần nhất (cho kiểm tra jump)
+        self.reference_t = None
+        self.pending = None         # Mức mới đang chờ xác nhận sau jump
+        self.pending_count = 0
+        self.run_value = None       # Giá trị của run hiện tại (stuck)
+        self.run_start = None
+        self.run_noise = 0.0        # MAD lúc run bắt đầu
+        self.median = None
+        self.mad = None
+        self.count = 0
+        self.warmup = [] if warmup > 0 else None
+        self.outlier_run = 0
+
+    def check(self, t: float, x: float, config: AnomalyConfig,
+              update: bool) -> Tuple[List[str], Optional[float], float]:
+        """(flags, robust z, số giây giá trị đã đứng im - reading treo do detector quyết định)"""
+        limits = self.limits
+        flags = []
+        if x < limits.low or x > limits.high:
+            return ['out_of_range'], None, 0.0
+        if limits.zero_suspect and x == 0.0:
+            return ['zero'], None, 0.0
+
+        # Jump so với giá trị tin cậy gần nhất; nhiều jump liên tiếp cùng mức → mức mới thật
+        jumped = False
+        if limits.max_jump is not None and self.reference is not None:
+            dt = max(t - self.reference_t, 0.0)
+            allowance = limits.max_jump + limits.max_rate_per_min * dt / 60.0
+            if abs(x - self.reference) > allowance:
+                jumped = True
+                confirmed = (self.pending is not None and abs(x - self.pending) <= limits.max_jump
+                             and self.pending_count + 1 >= config.rebaseline_after)
+                if not confirmed:
+                    flags.append('jump')
+                if update:
+                    if confirmed:
+                        self.pending, self.pending_count = None, 0
+                        self._restart_baseline(x, config)
+                    elif self.pending is not None and abs(x - self.pending) <= limits.max_jump:
+                        self.pending, self.pending_count = x, self.pending_count + 1
+                    else:
+                        self.pending, self.pending_count = x, 1
+                if not confirmed:
+                    return flags, None, 0.0
+        if update and not jumped:
+            self.pending, self.pending_count = None, 0
+
+        # Run: cùng giá trị trong khi thời gian vẫn trôi. Chỉ là stuck khi kênh vốn có nhiễu
+        # (MAD trước run ≥ noise_floor) - DHT11 độ phân giải 1°C đứng yên là bình thường
+        if x == self.run_value:
+            run = t - self.run_start
+            if (limits.stuck_seconds is not None and limits.noise_floor is not None
+                    and run >= limits.stuck_seconds and self.run_noise >= limits.noise_floor):
+                flags.append('stuck')
+        else:
+            run = 0.0
+            if update:
+                self.run_value, self.run_start = x, t
+                self.run_noise = self.mad or 0.0
+
+        if limits.z_threshold is None:
+            z = None
+        else:
+            z = self._robust_z(x)
+            outlier = z is not None and abs(z) > limits.z_threshold
+            if outlier:
+                flags.append('outlier')
+            if update:
+                # Outlier kéo dài = mức mới (ví dụ bật máy sưởi), không phải nhiễu
+                self.outlier_run = self.outlier_run + 1 if outlier else 0
+                if self.outlier_run >= config.outlier_rebaseline:
+                    self._restart_baseline(x, config)
+
+        if update:
+            self.reference, self.reference_t = x, t
+            if limits.z_threshold is not None:
+                self._update_median(x, config)
+        return flags, z, run
+
+    def _restart_baseline(self, x: float, config: AnomalyConfig):
+        self.median, self.mad, self.count, self.outlier_run = x, None, 0, 0
+        self.warmup = [] if config.warmup > 0 else None
+
+    def _robust_z(self, x: float) -> Optional[float]:
+        if self.mad is None:
+            return None
+        return 0.6745 * (x - self.median) / max(self.mad, self.limits.mad_floor)
+
+    def _update_median(self, x: float, config: AnomalyConfig):
+        """
+        Median/MAD xấp xỉ online: khởi tạo chính xác từ `warmup` reading đầu,
+        sau đó mỗi reading dịch median/MAD một bước cố định (tỉ lệ MAD) về phía x
+        (stochastic quantile estimation - bộ nhớ O(1)).
+        """
+        self.count += 1
+        if self.warmup is not None:
+            self.warmup.append(x)
+            if len(self.warmup) >= config.warmup:
+                values = sorted(self.warmup)
+                self.median = values[len(values) // 2]
+                deviations = sorted(abs(v - self.median) for v in values)
+                self.mad = deviations[len(deviations) // 2]
+                self.warmup = None
+            return
+        if self.mad is None:
+            # Vừa re-baseline và không có warmup
+            self.median = x if self.median is None else self.median
+            self.mad = self.limits.mad_floor
+            return
+        step = config.median_step * max(self.mad, self.limits.mad_floor)
+        if x > self.median:
+            self.median += step
+        elif x < self.median:
+            self.median -= step
+        deviation = abs(x - self.median)
+        if deviation > self.mad:
+            self.mad += step
+        elif deviation < self.mad:
+            self.mad = max(self.mad - step, 0.0)
+
+
+class SensorAnomalyDetector:
+    """Anomaly stage cho một chuồng - gọi check() với mỗi SensorData trước khi phân tích"""
+
+    def __init__(self, config: AnomalyConfig = None):
+        self.config = config or AnomalyConfig()
+        self._signals = {name: _SignalState(limits, self.config.warmup)
+                         for name, limits in self.config.signals.items()}
+        self._lock = Lock()
+        self._last_t = None
+        self._stale_run = 0
+        self.counters = {
+            'readings': 0,
+            'anomalous_readings': 0,
+            'suppressed_actuations': 0,
+            'by_signal': {name: {flag: 0 for flag in FLAGS} for name in self._signals},
+        }
+
+    def check(self, sensor_data, update: bool = True) -> AnomalyReport:
+        """
+        Kiểm tra một reading. update=False: chỉ đánh giá với trạng thái hiện tại
+        (không cập nhật thống kê và counters) - đánh giá thử độc lập với lịch sử dùng check_stateless.
+        """
+        t = sensor_data.timestamp.timestamp()
+        flags: Dict[str, List[str]] = {}
+        z_scores: Dict[str, float] = {}
+        with self._lock:
+            stale = self._last_t is not None and t <= self._last_t
+            stale_run = self._stale_run + 1 if stale else 0
+            runs = []
+            for name, state in self._signals.items():
+                value = getattr(sensor_data, name, None)
+                if value is None:
+                    continue
+                if stale:
+                    # Cùng reading được poll lại: chỉ kiểm tra phần không phụ thuộc lịch sử
+                    signal_flags, z, run = state.check(t, float(value), self.config, update=False)
+                    signal_flags = [f for f in signal_flags if f in ('out_of_range', 'zero')]
+                else:
+                    signal_flags, z, run = state.check(t, float(value), self.config, update)
+                runs.append(run)
+                if signal_flags:
+                    flags[name] = signal_flags
+                if z is not None:
+                    z_scores[name] = z
+            # Mọi kênh cùng đứng im (timestamp vẫn tăng) → reading bị treo
+            if runs and min(runs) >= self.config.frozen_seconds:
+                for name, state in self._signals.items():
+                    if state.limits.stuck_seconds is None or getattr(sensor_data, name, None) is None:
+                        continue
+                    signal_flags = flags.setdefault(name, [])
+                    if 'stuck' not in signal_flags:
+                        signal_flags.append('stuck')
+            if stale_run >= self.config.stale_readings:
+                flags.setdefault('reading', []).append('stale')
+
+            quality = 1.0
+            for signal_flags in flags.values():
+                quality *= min(QUALITY_FACTORS[f] for f in signal_flags)
+            # Quạt chỉ phụ thuộc nhiệt độ: chặn điều khiển khi chính nhiệt độ hỏng
+            suppress = any(f in SEVERE_FLAGS for f in flags.get('temperature', []))
+            invalid = any(f in INVALID_FLAGS for f in flags.get('temperature', []))
+
+            if update:
+                self._stale_run = stale_run
+                if not stale:
+                    self._last_t = t
+                self._count(flags, suppress)
+        return AnomalyReport(flags=flags, quality=quality, suppress_actuation=suppress, z_scores=z_scores,
+                             invalid_value=invalid)
+
+    def check_stateless(self, sensor_data) -> AnomalyReport:
+        """
+        Kiểm tra một reading chỉ với phần không phụ thuộc lịch sử (như check_static) -
+        dùng cho đánh giá thử: kết quả không phụ thuộc reading thật trước đó của cage.
+        """
+        columns = {name: np.array([float(getattr(sensor_data, name))]) for name in self._signals
+                   if getattr(sensor_data, name, None) is not None}
+        if not columns:
+            return AnomalyReport(flags={}, quality=1.0, suppress_actuation=False)
+        quality, suppress, flags = self.check_static(columns)
+        # check_static chỉ có out_of_range/zero → chặn quạt đồng nghĩa giá trị không hợp lệ
+        return AnomalyReport(flags=flags[0] or {}, quality=float(quality[0]),
+                             suppress_actuation=bool(suppress[0]), invalid_value=bool(suppress[0]))
+
+    def check_static(self, columns: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray, List[Optional[Dict]]]:
+        """
+        Kiểm tra không phụ thuộc lịch sử (out_of_range, zero) cho N readings độc lập -
+        dùng cho batch /test_analysis. Trả về (quality, suppress_actuation, flags),
+        flags[i] là None khi reading i không có bất thường.
+        """
+        n = len(next(iter(columns.values())))
+        quality = np.ones(n)
+        suppress = np.zeros(n, dtype=bool)
+        flags: List[Optional[Dict]] = [None] * n
+        for name, limits in self.config.signals.items():
+            x = columns.get(name)
+            if x is None:
+                continue
+            x = np.asarray(x, dtype=float)
+            checks = [('out_of_range', (x < limits.low) | (x > limits.high))]
+            if limits.zero_suspect:
+                checks.append(('zero', (x == 0.0) & ~checks[0][1]))
+            for flag, mask in checks:
+                if not mask.any():
+                    continue
+                quality[mask] *= QUALITY_FACTORS[flag]
+                if name == 'temperature' and flag in SEVERE_FLAGS:
+                    suppress |= mask
+                for i in np.flatnonzero(mask).tolist():
+                    if flags[i] is None:
+                        flags[i] = {}
+                    flags[i].setdefault(name, []).append(flag)
+        return quality, suppress, flags
+
+    def _count(self, flags: Dict[str, List[str]], suppress: bool):
+        counters = self.counters
+        counters['readings'] += 1
+        if flags:
+            counters['anomalous_readings'] += 1
+        if suppress:
+            counters['suppressed_actuations'] += 1
+        for name, signal_flags in flags.items():
+            bucket = counters['by_signal'].setdefault(name, {flag: 0 for flag in FLAGS})
+            for flag in signal_flags:
+                bucket[flag] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            by_signal = {name: {f: n for f, n in flags.items() if n}
+                         for name, flags in self.counters['by_signal'].items()}
+            return {
+                'readings': self.counters['readings'],
+                'anomalous_readings': self.counters['anomalous_readings'],
+                'suppressed_actuations': self.counters['suppressed_actuations'],
+                'by_signal': {name: flags for name, flags in by_signal.items() if flags},
+                'baseline': {
+                    name: {'median': round(s.median, 3), 'mad': round(s.mad, 3)}
+                    for name, s in self._signals.items() if s.mad is not None
+                },
+            }
@@ -0,0 +1,112 @@
+"""
+PetZone Shared State - Vùng nhớ chia sẻ giữa process monitoring và các HTTP worker
+==================================================================================
+Chế độ nhiều worker (prefork.py): chỉ một process chạy monitoring loop và điều khiển
+thiết bị; các worker process phục vụ /status, /stats, /command_history bằng cách đọc
+bản serialize sẵn mà process đó publish vào đây.
+
+Vùng nhớ là một mmap ẩn danh (MAP_SHARED) tạo trước khi fork, nên mọi process con
+dùng chung mà không cần tên/file. Mỗi slot có dung lượng cố định và được bảo vệ bằng
+seqlock (một writer, nhiều reader, reader không bao giờ chặn writer):
+
+    writer: seq += 1 (lẻ) → ghi body + header → seq += 1 (chẵn)
+    reader: đọc seq (chẵn) → copy → đọc lại seq; khác nhau → đọc lại
+
+Layout mỗi slot: seq (u64) | version (u64) | published_at (f64) | length (u32) | body.
+"""
+
+import mmap
+import struct
+import time
+from threading import Lock
+from typing import Dict, NamedTuple, Optional
+
+HEADER = struct.Struct('<QQdI')
+SEQ = struct.Struct('<Q')
+READ_RETRIES = 1000  # Số lần thử đọc lại khi đụng lúc writer đang ghi
+
+
+class SlotValue(NamedTuple):
+    version: int
+    published_at: float
+    body: bytes
+
+
+class SharedSlot:
+    """Một slot seqlock trong vùng nhớ chia sẻ"""
+
+    def __init__(self, buf: mmap.mmap, offset: int, capacity: int):
+        self._buf = buf
+        self._offset = offset
+        self._body = offset + HEADER.size
+        self.capacity = capacity
+        self._lock = Lock()  # Nhiều thread của process writer (scheduler, request) cùng publish
+        self.oversize = 0
+
+    def write(self, body: bytes, version: int) -> bool:
+        """Ghi body (False nếu vượt dung lượng slot - giữ bản cũ)"""
+        if len(body) > self.capacity:
+            self.oversize += 1
+            return False
+        with self._lock:
+            seq = SEQ.unpack_from(self._buf, self._offset)[0]
+            SEQ.pack_into(self._buf, self._offset, seq + 1)  # Lẻ: đang ghi
+            self._buf[self._body:self._body + len(body)] = body
+            HEADER.pack_into(self._buf, self._offset, seq + 1, version, time.time(), len(body))
+            SEQ.pack_into(self._buf, self._offset, seq + 2)  # Chẵn: xong
+        return True
+
+    def read(self) -> Optional[SlotValue]:
+        """Bản nhất quán mới nhất (None nếu chưa từng được ghi)"""
+        for attempt in range(READ_RETRIES):
+            seq, version, published_at, length = HEADER.unpack_from(self._buf, self._offset)
+            if seq & 1 == 0:
+                if seq == 0:
+                    return None
+                body = self._buf[self._body:self._body + length]
+                if SEQ.unpack_from(self._buf, self._offset)[0] == seq:
+                    return SlotValue(version, published_at, body)
+            if attempt > 10:
+                time.sleep(0)  # Nhường CPU cho writer
+        raise RuntimeError("Shared state slot is being rewritten too often to read")
+
+
+class SharedState:
+    """Các slot đặt tên trong một mmap ẩn danh (tạo trước khi fork worker)"""
+
+    def __init__(self, slots: Dict[str, int]):
+        offsets, size = {}, 0
+        for name, capacity in slots.items():
+            offsets[name] = (size, capacity)
+            size += HEADER.size + capacity
+        self._buf = mmap.mmap(-1, size)
+        self.slots = {name: SharedSlot(self._buf, offset, capacity)
+                      for name, (offset, capacity) in offsets.items()}
+        self._versions = {name: 0 for name in slots}
+
+    def publish(self, name: str, body: bytes, version: Optional[int] = None) -> bool:
+        """Ghi body vào slot; version mặc định tự tăng, version đã ghi rồi → bỏ qua"""
+        if version is None:
+            version = self._versions[name] + 1
+        elif version == self._versions[name]:
+            return True
+        self._versions[name] = version
+        return self.slots[name].write(body, version)
+
+    def read(self, name: str) -> Optional[SlotValue]:
+        return self.slots[name].read()
+
+    def to_dict(self) -> Dict:
+        now = time.time()
+        info = {}
+        for name, slot in self.slots.items():
+            # Chỉ đọc header (không copy body); số liệu giám sát nên không cần seqlock
+            seq, version, published_at, length = HEADER.unpack_from(slot._buf, slot._offset)
+            info[name] = {
+                'capacity': slot.capacity,
+                'bytes': length,
+                'version': version,
+                'age_s': round(now - published_at, 3) if seq else None,
+                'oversize': slot.oversize
+            }
+        return info
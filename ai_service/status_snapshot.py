@@ -0,0 +1,72 @@
+"""
+PetZone Status Snapshot - /status pre-serialized, đọc không cần lock
+====================================================================
+Trước đây mỗi request /status lấy `state_lock` và serialize decision, sensor data, trạng
+thái thiết bị → nhiều trình duyệt poll cùng lúc tranh lock với monitoring loop.
+
+Giờ monitoring loop (writer) publish một snapshot bất biến (bytes JSON + version) sau
+mỗi tick; request chỉ đọc tham chiếu hiện tại (gán tham chiếu là atomic trong CPython)
+và trả nguyên bytes - không lock, không JSON encode. Version chỉ tăng khi nội dung đổi
+nên ETag ổn định giữa các tick không có gì mới → client gửi If-None-Match nhận 304.
+"""
+
+import json
+import time
+import uuid
+from datetime import datetime
+from threading import Lock
+from typing import Dict, NamedTuple
+
+
+class Snapshot(NamedTuple):
+    """Snapshot bất biến: body là JSON đã encode sẵn"""
+    version: int
+    body: bytes
+    etag: str
+    published_at: float
+
+
+class SnapshotPublisher:
+    """Một writer-side lock cho publish(); current() không lock"""
+
+    def __init__(self, initial: Dict = None):
+        # ETag kèm id của instance: version bắt đầu lại từ 0 sau restart không trùng ETag cũ
+        self._instance = uuid.uuid4().hex[:8]
+        self._lock = Lock()
+        self._content = None
+        self._current = Snapshot(0, b'{}', f"{self._instance}-0", time.time())
+        self.stats = {'published': 0, 'unchanged': 0}
+        if initial is not None:
+            self.publish(initial)
+
+    def publish(self, state: Dict, stamp_key: str = 'timestamp') -> Snapshot:
+        """
+        Serialize `state` và swap snapshot nếu nội dung khác snapshot hiện tại.
+        `stamp_key` (thời điểm publish) được thêm vào body nhưng không tính khi so sánh.
+        """
+        content = json.dumps(state, ensure_ascii=False, sort_keys=True, default=str)
+        with self._lock:
+            if content == self._content:
+                self.stats['unchanged'] += 1
+                return self._current
+            now = time.time()
+            stamped = {**state, stamp_key: datetime.fromtimestamp(now).isoformat()} if stamp_key else state
+            version = self._current.version + 1
+            self._content = content
+            self._current = Snapshot(version, json.dumps(stamped, ensure_ascii=False, default=str).encode('utf-8'),
+                                     f"{self._instance}-{version}", now)
+            self.stats['published'] += 1
+            return self._current
+
+    def current(self) -> Snapshot:
+        return self._current
+
+    def to_dict(self) -> Dict:
+        snapshot = self._current
+        return {
+            'version': snapshot.version,
+            'bytes': len(snapshot.body),
+            'age_s': round(time.time() - snapshot.published_at, 3),
+            **self.stats
+        }
+
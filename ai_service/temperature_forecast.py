@@ -0,0 +1,137 @@
+"""
+PetZone Temperature Forecast - Online Holt linear smoothing
+===========================================================
+Dự báo nhiệt độ 1-5 phút tới để điều khiển quạt chủ động (bật trước khi
+chuồng quá nóng thay vì đợi nhiệt độ vượt ngưỡng). Cập nhật incremental,
+vài phép tính float mỗi reading (cỡ micro giây), bộ nhớ O(1).
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+
+
+@dataclass
+class ForecastConfig:
+    """Tham số Holt linear smoothing"""
+    alpha: float = 0.5              # Smoothing cho level (ứng với nominal_interval)
+    beta: float = 0.2               # Smoothing cho trend
+    nominal_interval: float = 5.0   # Khoảng cách sample danh nghĩa (giây)
+    min_samples: int = 4            # Số sample tối thiểu trước khi tin dự báo
+    max_rate_per_min: float = 3.0   # Giới hạn trend khi ngoại suy (°C/phút)
+    max_gap: float = 600.0          # Mất dữ liệu lâu hơn → khởi động lại model
+
+
+class HoltForecaster:
+    """
+    Holt linear trend cho chuỗi lấy mẫu không đều.
+    level/trend được cập nhật với alpha, beta quy đổi theo dt thực tế,
+    trend tính theo đơn vị/giây.
+    """
+
+    def __init__(self, config: ForecastConfig = None):
+        self.config = config or ForecastConfig()
+        self.reset()
+
+    def reset(self):
+        self.level = None
+        self.trend = 0.0
+        self.samples = 0
+        self._last_t = None
+
+    def update(self, t: float, x: float) -> None:
+        """Cập nhật với sample (t giây epoch, giá trị x); sample cũ/trùng bị bỏ qua"""
+        cfg = self.config
+        if self._last_t is not None:
+            dt = t - self._last_t
+            if dt <= 0:
+                return
+            if dt > cfg.max_gap:
+                self.reset()
+
+        if self.level is None:
+            self.level = x
+            self.trend = 0.0
+        else:
+            steps = dt / cfg.nominal_interval
+            alpha = 1.0 - (1.0 - cfg.alpha) ** steps
+            beta = 1.0 - (1.0 - cfg.beta) ** steps
+            previous = self.level
+            self.level = alpha * x + (1.0 - alpha) * (previous + self.trend * dt)
+            self.trend = beta * (self.level - previous) / dt + (1.0 - beta) * self.trend
+
+        self.samples += 1
+        self._last_t = t
+
+    @property
+    def ready(self) -> bool:
+        return self.level is not None and self.samples >= self.config.min_samples
+
+    def predict(self, horizon: float) -> Optional[float]:
+        """Giá trị dự báo sau `horizon` giây (None nếu chưa đủ dữ liệu)"""
+        if not self.ready:
+            return None
+        limit = self.config.max_rate_per_min / 60.0
+        trend = max(-limit, min(limit, self.trend))
+        return self.level + trend * horizon
+
+    def update_batch(self, t: np.ndarray, x: np.ndarray, horizon: float) -> np.ndarray:
+        """
+        Cập nhật tuần tự cả chunk (replay/backtest), trả về dự báo sau mỗi sample
+        (NaN khi chưa đủ dữ liệu). Cùng kết quả với gọi update()/predict() từng sample;
+        vòng lặp chỉ giữ phần đệ quy bắt buộc, alpha/beta chỉ tính lại khi dt đổi
+        và phần clamp/ngoại suy được vectorized sau vòng lặp.
+        """
+        cfg = self.config
+        one_minus_alpha = 1.0 - cfg.alpha
+        one_minus_beta = 1.0 - cfg.beta
+        nominal = cfg.nominal_interval
+        max_gap = cfg.max_gap
+        level, trend, samples, last_t = self.level, self.trend, self.samples, self._last_t
+
+        n = len(t)
+        levels = [0.0] * n
+        trends = [0.0] * n
+        counts = [0] * n
+        cached_dt = alpha = beta = None
+        for i, (ti, xi) in enumerate(zip(np.asarray(t, dtype=float).tolist(),
+                                         np.asarray(x, dtype=float).tolist())):
+            if last_t is None:
+                level, trend, samples, last_t = xi, 0.0, 1, ti
+            else:
+                dt = ti - last_t
+                if dt > 0:
+                    if dt > max_gap:
+                        level, trend, samples = xi, 0.0, 1
+                    else:
+                        if dt != cached_dt:
+                            steps = dt / nominal
+                            alpha = 1.0 - one_minus_alpha ** steps
+                            beta = 1.0 - one_minus_beta ** steps
+                            cached_dt = dt
+                        previous = level
+                        level = alpha * xi + (1.0 - alpha) * (previous + trend * dt)
+                        trend = beta * (level - previous) / dt + (1.0 - beta) * trend
+                        samples += 1
+                    last_t = ti
+            levels[i] = level
+            trends[i] = trend
+            counts[i] = samples
+
+        self.level, self.trend, self.samples, self._last_t = level, trend, samples, last_t
+
+        limit = cfg.max_rate_per_min / 60.0
+        out = np.array(levels) + np.clip(np.array(trends), -limit, limit) * horizon
+        out[np.array(counts) < cfg.min_samples] = np.nan
+        return out
+
+    def to_dict(self, horizon: float) -> Dict:
+        predicted = self.predict(horizon)
+        return {
+            "predicted_temperature": round(predicted, 2) if predicted is not None else None,
+            "horizon_seconds": horizon,
+            "level": round(self.level, 3) if self.level is not None else None,
+            "trend_per_min": round(self.trend * 60.0, 4),
+            "samples": self.samples
+        }
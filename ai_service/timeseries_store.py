@@ -0,0 +1,371 @@
+"""
+PetZone Time-series Store - Lịch sử readings/decisions nhúng, có rollup 1 phút / 1 giờ
+======================================================================================
+AI service chỉ giữ reading mới nhất và 100 decision, nên biểu đồ xu hướng luôn phải
+query SQL của backend. Store này ghi mọi reading + decision vào các segment nhị phân
+bản ghi cố định (np.memmap, append-only) và tính rollup tăng dần:
+
+- raw:        timestamp, cage, nhiệt độ, độ ẩm, presence/movement, alert, actions, risk
+- rollup 1m:  mỗi (phút, cage): count, min/max/sum nhiệt độ & độ ẩm, risk max,
+              số decision theo alert level, số lần bật quạt
+- rollup 1h:  như trên theo giờ
+
+Bucket đang mở nằm trong bộ nhớ; khi reading sang bucket mới (hoặc bucket đã hết giờ,
+xem flush_stale) nó được ghi thành một bản ghi rollup. Reading tới trễ (bucket đã ghi)
+thành một bản ghi rollup riêng - query gộp theo bucket nên kết quả vẫn đúng.
+Query /history chỉ đọc rollup (và bucket đang mở), không quét raw.
+
+Segment là file dung lượng cố định; đầy → mở segment mới, quá số segment giữ lại →
+xoá segment cũ nhất. Dữ liệu nằm trong page cache của mmap nên process crash không
+mất bản ghi đã append; bucket đang mở được dựng lại từ đuôi raw khi mở lại store.
+"""
+
+import json
+import math
+import os
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ai_decision_engine import ALERT_CODES, ALERT_LEVELS_BY_CODE, ActionType, decode_actions, encode_actions
+
+RAW_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('cage', '<u2'),
+    ('alert_code', 'u1'),
+    ('actions', '<u2'),
+    ('temperature', '<f4'),
+    ('humidity', '<f4'),
+    ('presence_energy', '<i2'),
+    ('movement_energy', '<i2'),
+    ('confidence', '<f4'),
+    ('combined_risk', '<f4'),
+])
+
+ROLLUP_DTYPE = np.dtype([
+    ('bucket', '<f8'),
+    ('cage', '<u2'),
+    ('count', '<u4'),
+    ('temp_min', '<f4'),
+    ('temp_max', '<f4'),
+    ('temp_sum', '<f8'),
+    ('hum_min', '<f4'),
+    ('hum_max', '<f4'),
+    ('hum_sum', '<f8'),
+    ('risk_max', '<f4'),
+    ('alerts', '<u4', (len(ALERT_LEVELS_BY_CODE),)),
+    ('fan_on', '<u4'),
+])
+
+RESOLUTIONS = {'1m': 60, '1h': 3600}
+SEGMENT_RECORDS = 65536  # Bản ghi mỗi file segment (raw ~2 MB, rollup ~3.5 MB)
+STEP_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+AUTO_STEPS = (60, 300, 900, 3600, 6 * 3600, 86400)
+
+
+def parse_step(value) -> int:
+    """'300', '5m', '1h', '1d' → giây"""
+    text = str(value).strip().lower()
+    unit = STEP_UNITS.get(text[-1:]) if text else None
+    seconds = float(text[:-1]) * unit if unit else float(text)
+    return int(seconds)
+
+
+class SegmentLog:
+    """Log append-only của một structured dtype, chia thành các file segment np.memmap"""
+
+    def __init__(self, directory: str, name: str, dtype: np.dtype, key: str,
+                 records_per_segment: int = SEGMENT_RECORDS, max_segments: int = 16):
+        self.directory = directory
+        self.name = name
+        self.dtype = dtype
+        self.key = key
+        self.records_per_segment = records_per_segment
+        self.max_segments = max_segments
+        self._segments: List[Dict] = []
+        for filename in sorted(f for f in os.listdir(directory)
+                               if f.startswith(f"{name}-") and f.endswith('.seg')):
+            self._open_segment(os.path.join(directory, filename))
+
+    def _open_segment(self, path: str, create: bool = False):
+        data = np.memmap(path, dtype=self.dtype, mode='w+' if create else 'r+',
+                         shape=(self.records_per_segment,) if create else None)
+        keys = data[self.key]
+        empty = np.flatnonzero(keys == 0)  # Key (timestamp/bucket) không bao giờ bằng 0
+        count = int(empty[0]) if len(empty) else len(data)
+        used = keys[:count]
+        self._segments.append({
+            'path': path,
+            'data': data,
+            'count': count,
+            'min': float(used.min()) if count else math.inf,
+            'max': float(used.max()) if count else -math.inf
+        })
+
+    def append(self, row: Tuple):
+        segment = self._segments[-1] if self._segments else None
+        if segment is None or segment['count'] >= len(segment['data']):
+            if segment is not None:
+                segment['data'].flush()
+            index = int(os.path.basename(segment['path'])[len(self.name) + 1:-4]) + 1 if segment else 1
+            self._open_segment(os.path.join(self.directory, f"{self.name}-{index:06d}.seg"), create=True)
+            self._expire()
+            segment = self._segments[-1]
+        i = segment['count']
+        segment['data'][i] = row
+        segment['count'] = i + 1
+        key = row[0]
+        segment['min'] = min(segment['min'], key)
+        segment['max'] = max(segment['max'], key)
+
+    def _expire(self):
+        while len(self._segments) > self.max_segments:
+            oldest = self._segments.pop(0)
+            path = oldest['path']
+            del oldest['data']
+            os.remove(path)
+
+    def select(self, start: float, end: float) -> np.ndarray:
+        """Bản ghi có key trong [start, end) - chỉ đọc các segment có khoảng key giao với range"""
+        parts = []
+        for segment in self._segments:
+            if segment['count'] == 0 or segment['max'] < start or segment['min'] >= end:
+                continue
+            used = segment['data'][:segment['count']]
+            keys = used[self.key]
+            parts.append(np.array(used[(keys >= start) & (keys < end)]))
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=self.dtype)
+
+    def last_key(self) -> Optional[float]:
+        used = [s['max'] for s in self._segments if s['count']]
+        return max(used) if used else None
+
+    def __len__(self):
+        return sum(s['count'] for s in self._segments)
+
+    def flush(self):
+        if self._segments:
+            self._segments[-1]['data'].flush()
+
+    def to_dict(self) -> Dict:
+        return {
+            'records': len(self),
+            'segments': len(self._segments),
+            'bytes': sum(s['data'].nbytes for s in self._segments)
+        }
+
+
+class TimeSeriesStore:
+    """Raw + rollup 1m/1h, thread-safe (worker của các shard cùng append)"""
+
+    def __init__(self, directory: str, records_per_segment: int = SEGMENT_RECORDS,
+                 raw_segments: int = 16, rollup_segments: int = 64):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._lock = Lock()
+        self._cages_path = os.path.join(directory, 'cages.json')
+        self._cage_ids: List[str] = []
+        if os.path.exists(self._cages_path):
+            with open(self._cages_path, encoding='utf-8') as f:
+                self._cage_ids = json.load(f)
+        self._cage_index = {cage_id: i for i, cage_id in enumerate(self._cage_ids)}
+        self.raw = SegmentLog(directory, 'raw', RAW_DTYPE, 'timestamp', records_per_segment, raw_segments)
+        self.rollups = {name: SegmentLog(directory, f"rollup_{name}", ROLLUP_DTYPE, 'bucket',
+                                         records_per_segment, rollup_segments)
+                        for name in RESOLUTIONS}
+        # (resolution, cage) → bản ghi rollup của bucket đang mở (mảng 1 phần tử)
+        self._open: Dict[Tuple[str, int], np.ndarray] = {}
+        self.stats = {'appended': 0, 'late_readings': 0, 'recovered': 0}
+        self._recover_open_buckets()
+
+    def _cage(self, cage_id: str) -> int:
+        index = self._cage_index.get(cage_id)
+        if index is None:
+            index = self._cage_index[cage_id] = len(self._cage_ids)
+            self._cage_ids.append(cage_id)
+            with open(self._cages_path, 'w', encoding='utf-8') as f:
+                json.dump(self._cage_ids, f)
+        return index
+
+    def append(self, sensor_data, decision):
+        """Ghi một reading + decision vào raw và cập nhật bucket đang mở của mỗi rollup"""
+        row = (sensor_data.timestamp.timestamp(), 0, ALERT_CODES[decision.alert_level],
+               encode_actions(decision.actions), sensor_data.temperature, sensor_data.humidity,
+               sensor_data.presence_energy, sensor_data.movement_energy, decision.confidence,
+               decision.reasoning.get('combined_risk_score', 0.0))
+        fan_on = ActionType.TURN_ON_FAN in decision.actions
+        with self._lock:
+            cage = self._cage(sensor_data.cage_id)
+            row = (row[0], cage) + row[2:]
+            self.raw.append(row)
+            self._accumulate(row, fan_on)
+            self.stats['appended'] += 1
+
+    def _accumulate(self, row: Tuple, fan_on: bool):
+        for name, seconds in RESOLUTIONS.items():
+            self._accumulate_into(name, seconds, row, fan_on)
+
+    def _accumulate_into(self, name: str, seconds: int, row: Tuple, fan_on: bool):
+        ts, cage, alert_code = row[0], row[1], row[2]
+        bucket = math.floor(ts / seconds) * seconds
+        acc = self._open.get((name, cage))
+        if acc is not None and acc['bucket'][0] != bucket:
+            if bucket < acc['bucket'][0]:
+                # Bucket đã đóng: một bản ghi rollup riêng cho reading trễ
+                late = self._new_bucket(bucket, cage)
+                self._add(late, row[4], row[5], row[9], alert_code, fan_on)
+                self.rollups[name].append(late[0].item())
+                self.stats['late_readings'] += 1
+                return
+            self.rollups[name].append(acc[0].item())
+            acc = None
+        if acc is None:
+            acc = self._open[(name, cage)] = self._new_bucket(bucket, cage)
+        self._add(acc, row[4], row[5], row[9], alert_code, fan_on)
+
+    @staticmethod
+    def _new_bucket(bucket: float, cage: int) -> np.ndarray:
+        acc = np.zeros(1, dtype=ROLLUP_DTYPE)
+        acc['bucket'], acc['cage'] = bucket, cage
+        acc['temp_min'] = acc['hum_min'] = np.inf
+        acc['temp_max'] = acc['hum_max'] = acc['risk_max'] = -np.inf
+        return acc
+
+    @staticmethod
+    def _add(acc: np.ndarray, temperature: float, humidity: float, risk: float,
+             alert_code: int, fan_on: bool):
+        r = acc[0]
+        r['count'] += 1
+        r['temp_min'] = min(r['temp_min'], temperature)
+        r['temp_max'] = max(r['temp_max'], temperature)
+        r['temp_sum'] += temperature
+        r['hum_min'] = min(r['hum_min'], humidity)
+        r['hum_max'] = max(r['hum_max'], humidity)
+        r['hum_sum'] += humidity
+        r['risk_max'] = max(r['risk_max'], risk)
+        r['alerts'][alert_code] += 1
+        r['fan_on'] += fan_on
+
+    def _recover_open_buckets(self):
+        """Dựng lại bucket đang mở (chưa ghi rollup lúc process dừng) từ đuôi raw"""
+        last_raw = self.raw.last_key()
+        if last_raw is None:
+            return
+        for name, seconds in RESOLUTIONS.items():
+            start = math.floor(last_raw / seconds) * seconds - seconds
+            rollup_tail = self.rollups[name].select(start, math.inf)
+            done = {}
+            for cage, bucket in zip(rollup_tail['cage'], rollup_tail['bucket']):
+                done[int(cage)] = max(done.get(int(cage), -math.inf), float(bucket))
+            rows = self.raw.select(start, math.inf)
+            for row in np.sort(rows, order='timestamp'):
+                values = row.item()
+                if math.floor(values[0] / seconds) * seconds <= done.get(values[1], -math.inf):
+                    continue
+                fan_on = ActionType.TURN_ON_FAN in decode_actions(values[3])
+                self._accumulate_into(name, seconds, values, fan_on)
+                self.stats['recovered'] += 1
+
+    def flush_stale(self, now: float):
+        """Ghi rollup cho các bucket đã hết giờ (cage không còn gửi reading) và flush mmap"""
+        with self._lock:
+            for (name, cage), acc in list(self._open.items()):
+                if acc['bucket'][0] + RESOLUTIONS[name] <= now:
+                    self.rollups[name].append(acc[0].item())
+                    del self._open[(name, cage)]
+            self.raw.flush()
+            for log in self.rollups.values():
+                log.flush()
+
+    def close(self):
+        """Ghi mọi bucket đang mở (kể cả chưa hết giờ) - reading sau đó vào cùng bucket được gộp khi query"""
+        with self._lock:
+            for (name, cage), acc in self._open.items():
+                self.rollups[name].append(acc[0].item())
+            self._open.clear()
+            self.raw.flush()
+            for log in self.rollups.values():
+                log.flush()
+
+    def query(self, start: float, end: float, step: Optional[int] = None,
+              cage_id: Optional[str] = None, max_points: int = 1000) -> Dict:
+        """
+        Rollup trong [start, end) gộp theo `step` giây (bội số của 60; None → tự chọn để
+        không quá max_points điểm). Bucket căn theo epoch (UTC).
+        """
+        if end <= start:
+            raise ValueError("'to' phải sau 'from'")
+        if step is None:
+            step = next((s for s in AUTO_STEPS if (end - start) / s <= max_points), AUTO_STEPS[-1])
+        if step < 60 or step % 60:
+            raise ValueError("step phải là bội số của 60 giây (rollup nhỏ nhất là 1 phút)")
+        if (end - start) / step > max_points:
+            raise ValueError(f"Quá {max_points} điểm - tăng step")
+        name = '1h' if step % 3600 == 0 else '1m'
+        seconds = RESOLUTIONS[name]
+        lo = math.floor(start / seconds) * seconds
+
+        with self._lock:
+            cage = self._cage_index.get(cage_id) if cage_id is not None else None
+            rows = self.rollups[name].select(lo, end)
+            pending = [acc for (res, _), acc in self._open.items()
+                       if res == name and lo <= acc['bucket'][0] < end]
+        if pending:
+            rows = np.concatenate([rows] + pending)
+        if cage_id is not None:
+            rows = rows[rows['cage'] == cage] if cage is not None else rows[:0]
+
+        points = []
+        if len(rows):
+            groups = np.floor(rows['bucket'] / step).astype(np.int64)
+            keys, inverse = np.unique(groups, return_inverse=True)
+            n = len(keys)
+            count = np.bincount(inverse, rows['count'], n)
+            temp_sum = np.bincount(inverse, rows['temp_sum'], n)
+            hum_sum = np.bincount(inverse, rows['hum_sum'], n)
+            mins = {f: np.full(n, np.inf) for f in ('temp_min', 'hum_min')}
+            maxs = {f: np.full(n, -np.inf) for f in ('temp_max', 'hum_max', 'risk_max')}
+            for f, out in mins.items():
+                np.minimum.at(out, inverse, rows[f])
+            for f, out in maxs.items():
+                np.maximum.at(out, inverse, rows[f])
+            alerts = np.zeros((n, rows['alerts'].shape[1]), dtype=np.int64)
+            np.add.at(alerts, inverse, rows['alerts'])
+            fan_on = np.bincount(inverse, rows['fan_on'], n)
+            for i, key in enumerate(keys):
+                points.append({
+                    't': int(key) * step,
+                    'count': int(count[i]),
+                    'temperature': {'min': round(float(mins['temp_min'][i]), 2),
+                                    'max': round(float(maxs['temp_max'][i]), 2),
+                                    'mean': round(float(temp_sum[i] / count[i]), 2)},
+                    'humidity': {'min': round(float(mins['hum_min'][i]), 2),
+                                 'max': round(float(maxs['hum_max'][i]), 2),
+                                 'mean': round(float(hum_sum[i] / count[i]), 2)},
+                    'risk_max': round(float(maxs['risk_max'][i]), 3),
+                    'alerts': {level.value: int(alerts[i][code])
+                               for code, level in enumerate(ALERT_LEVELS_BY_CODE)},
+                    'fan_on': int(fan_on[i])
+                })
+            points = [p for p in points if start - step < p['t'] < end]
+        return {
+            'from': start,
+            'to': end,
+            'step': step,
+            'resolution': name,
+            'cage_id': cage_id,
+            'points': points
+        }
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'cages': len(self._cage_ids),
+                'open_buckets': len(self._open),
+                'raw': self.raw.to_dict(),
+                **{f"rollup_{name}": log.to_dict() for name, log in self.rollups.items()},
+                **self.stats
+            }
+
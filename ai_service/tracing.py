@@ -0,0 +1,124 @@
+"""
+PetZone Tracing - Trace ID cho mỗi reading, span qua fetch → analyze → lệnh → backend
+===================================================================================
+Mỗi reading nhận một trace ID khi vào AI service (fetch hoặc /ingest, hoặc giữ `traceId`
+bên gửi đã có). ID đi theo SensorData → AIDecision → DeviceCommand → payload alert/log,
+và mỗi bước ghi một span (tên, thời điểm bắt đầu, thời lượng, thuộc tính) vào buffer
+bounded trong bộ nhớ. Từ đó biết reading nào gây ra lệnh ESP32/alert nào và độ trễ
+phản ứng end-to-end (span đầu tiên → span cuối cùng của trace).
+
+Span chỉ được ghi khi có trace ID (đánh giá thử, /test_analysis không tạo span).
+"""
+
+import json
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterator, List, Optional
+
+TRACE_BUFFER_SIZE = 20000  # Số span tối đa giữ trong bộ nhớ (span cũ nhất bị bỏ trước)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class Tracer:
+    """Buffer span bounded, thread-safe (shard worker, I/O worker, outbox sender cùng ghi)"""
+
+    def __init__(self, capacity: int = TRACE_BUFFER_SIZE):
+        self.capacity = capacity
+        self._spans = deque(maxlen=capacity)
+        self._lock = Lock()
+        self.recorded = 0
+
+    def record(self, trace_id: Optional[str], name: str, start: float, duration_ms: float, **attrs):
+        """Ghi span (start = epoch giây); bỏ qua nếu không có trace_id"""
+        if trace_id is None:
+            return
+        span = {'trace_id': trace_id, 'name': name, 'start': round(start, 6),
+                'duration_ms': round(duration_ms, 3)}
+        if attrs:
+            span['attrs'] = attrs
+        with self._lock:
+            self._spans.append(span)
+            self.recorded += 1
+
+    @contextmanager
+    def span(self, trace_id: Optional[str], name: str, **attrs):
+        """Đo một đoạn code; yield dict attrs để bổ sung thuộc tính (status...) trong đoạn"""
+        if trace_id is None:
+            yield attrs
+            return
+        start = time.time()
+        started = time.perf_counter()
+        try:
+            yield attrs
+        except Exception as e:
+            attrs['error'] = str(e)
+            raise
+        finally:
+            self.record(trace_id, name, start, (time.perf_counter() - started) * 1000.0, **attrs)
+
+    def spans(self, trace_id: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+        with self._lock:
+            spans = list(self._spans)
+        if trace_id is not None:
+            spans = [s for s in spans if s['trace_id'] == trace_id]
+        if limit is not None:
+            spans = spans[-limit:]
+        return spans
+
+    def export(self, trace_id: Optional[str] = None, limit: Optional[int] = None) -> Iterator[str]:
+        """Các span dạng JSON lines (mỗi dòng một span, thứ tự ghi nhận)"""
+        for span in self.spans(trace_id, limit):
+            yield json.dumps(span, ensure_ascii=False, default=str) + '\n'
+
+    @staticmethod
+    def summarize(spans: List[Dict]) -> Optional[Dict]:
+        """Tóm tắt một trace: các span theo thời gian và độ trễ phản ứng end-to-end"""
+        if not spans:
+            return None
+        spans = sorted(spans, key=lambda s: s['start'])
+        first = spans[0]['start']
+        end = max(s['start'] + s['duration_ms'] / 1000.0 for s in spans)
+        return {
+            'trace_id': spans[0]['trace_id'],
+            'reaction_ms': round((end - first) * 1000.0, 3),
+            'spans': [{**s, 'offset_ms': round((s['start'] - first) * 1000.0, 3)} for s in spans]
+        }
+
+    def trace(self, trace_id: str) -> Optional[Dict]:
+        return self.summarize(self.spans(trace_id))
+
+    def stats(self) -> Dict:
+        """Độ trễ phản ứng của các trace có lệnh thiết bị/alert trong buffer"""
+        traces: Dict[str, List[Dict]] = {}
+        for span in self.spans():
+            traces.setdefault(span['trace_id'], []).append(span)
+        reactions = sorted(
+            self.summarize(spans)['reaction_ms'] for spans in traces.values()
+            if any(s['name'] not in ('fetch', 'ingest', 'analyze') for s in spans))
+        percentile = (lambda q: reactions[min(len(reactions) - 1, int(q * len(reactions)))]) if reactions else None
+        return {
+            'capacity': self.capacity,
+            'buffered_spans': len(self._spans),
+            'recorded_spans': self.recorded,
+            'traces': len(traces),
+            'traces_with_actions': len(reactions),
+            'reaction_ms_p50': percentile(0.5) if percentile else None,
+            'reaction_ms_p95': percentile(0.95) if percentile else None
+        }
+
+
+# Singleton instance
+_tracer = None
+
+def get_tracer(capacity: int = TRACE_BUFFER_SIZE) -> Tracer:
+    """Get hoặc tạo tracer dùng chung (capacity chỉ có hiệu lực ở lần gọi đầu)"""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(capacity)
+    return _tracer
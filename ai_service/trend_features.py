@@ -0,0 +1,240 @@
+"""
+PetZone Trend Features - Streaming EWMA, slope và rate-of-change
+================================================================
+Tính đặc trưng xu hướng cho từng tín hiệu cảm biến theo kiểu streaming:
+mỗi reading cập nhật O(1) (amortized), bộ nhớ cố định theo kích thước cửa sổ.
+Các đặc trưng này là input bổ sung cho fuzzy inference (nhiệt độ đang tăng nhanh
+→ bật quạt sớm hơn) mà không cần query thêm backend.
+"""
+
+import math
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+@dataclass
+class TrendConfig:
+    """Cấu hình cửa sổ cho trend features"""
+    ewma_halflife: float = 60.0           # Half-life của EWMA (giây)
+    slope_window: int = 12                # Số sample cho linear slope (12 x 5s = 1 phút)
+    minmax_windows: Tuple[int, ...] = (12, 120)  # Các cửa sổ min/max (số sample)
+    rebase_after: float = 3600.0          # Rebase gốc thời gian để giữ độ chính xác float
+
+
+@dataclass
+class TrendSnapshot:
+    """Đặc trưng xu hướng tại một thời điểm của một tín hiệu"""
+    value: float
+    ewma: float
+    slope_per_min: Optional[float]        # Linear slope trên slope_window (đơn vị/phút)
+    rate_per_min: Optional[float]         # Rate-of-change so với sample trước (đơn vị/phút)
+    window_min: Dict[int, float] = field(default_factory=dict)
+    window_max: Dict[int, float] = field(default_factory=dict)
+    samples: int = 0
+
+    def to_dict(self) -> Dict:
+        return {
+            "value": self.value,
+            "ewma": round(self.ewma, 3),
+            "slope_per_min": round(self.slope_per_min, 4) if self.slope_per_min is not None else None,
+            "rate_per_min": round(self.rate_per_min, 4) if self.rate_per_min is not None else None,
+            "min": {str(w): v for w, v in self.window_min.items()},
+            "max": {str(w): v for w, v in self.window_max.items()},
+            "samples": self.samples
+        }
+
+
+class _MonotonicWindow:
+    """Min hoặc max trên N sample gần nhất - monotonic deque, O(1) amortized"""
+
+    def __init__(self, size: int, is_max: bool):
+        self.size = size
+        self.is_max = is_max
+        self._items = deque()  # (index, value)
+
+    def push(self, index: int, value: float) -> float:
+        items = self._items
+        if self.is_max:
+            while items and items[-1][1] <= value:
+                items.pop()
+        else:
+            while items and items[-1][1] >= value:
+                items.pop()
+        items.append((index, value))
+        while items[0][0] <= index - self.size:
+            items.popleft()
+        return items[0][1]
+
+
+class SignalTrend:
+    """Trend features streaming cho một tín hiệu (ví dụ nhiệt độ)"""
+
+    def __init__(self, config: TrendConfig = None):
+        self.config = config or TrendConfig()
+        self._tau = self.config.ewma_halflife / math.log(2)
+        self._window = deque(maxlen=self.config.slope_window)  # (t - t0, x)
+        self._t0 = None
+        self._sum_t = self._sum_x = self._sum_tt = self._sum_tx = 0.0
+        self._mins = {w: _MonotonicWindow(w, is_max=False) for w in self.config.minmax_windows}
+        self._maxs = {w: _MonotonicWindow(w, is_max=True) for w in self.config.minmax_windows}
+        self._count = 0
+        self._last_t = None
+        self._last_x = None
+        self.snapshot: Optional[TrendSnapshot] = None
+
+    def update(self, t: float, x: float) -> TrendSnapshot:
+        """
+        Cập nhật với sample (t giây epoch, giá trị x).
+        Sample không mới hơn sample trước (poll lại cùng reading) bị bỏ qua.
+        """
+        if self._last_t is not None and t <= self._last_t:
+            return self.snapshot
+
+        # EWMA với alpha theo khoảng thời gian thực (sample không đều)
+        if self._last_t is None:
+            ewma = x
+            rate = None
+        else:
+            dt = t - self._last_t
+            alpha = 1.0 - math.exp(-dt / self._tau)
+            ewma = self.snapshot.ewma + alpha * (x - self.snapshot.ewma)
+            rate = (x - self._last_x) / dt * 60.0
+
+        slope = self._push_slope(t, x)
+
+        index = self._count
+        mins = {w: m.push(index, x) for w, m in self._mins.items()}
+        maxs = {w: m.push(index, x) for w, m in self._maxs.items()}
+
+        self._count += 1
+        self._last_t = t
+        self._last_x = x
+        self.snapshot = TrendSnapshot(
+            value=x, ewma=ewma, slope_per_min=slope, rate_per_min=rate,
+            window_min=mins, window_max=maxs, samples=self._count
+        )
+        return self.snapshot
+
+    def _push_slope(self, t: float, x: float) -> Optional[float]:
+        """Least-squares slope trên cửa sổ trượt bằng running sums"""
+        if self._t0 is None:
+            self._t0 = t
+        elif t - self._t0 > self.config.rebase_after:
+            self._rebase()
+
+        window = self._window
+        if len(window) == window.maxlen:
+            old_t, old_x = window[0]
+            self._sum_t -= old_t
+            self._sum_x -= old_x
+            self._sum_tt -= old_t * old_t
+            self._sum_tx -= old_t * old_x
+
+        rt = t - self._t0
+        window.append((rt, x))
+        self._sum_t += rt
+        self._sum_x += x
+        self._sum_tt += rt * rt
+        self._sum_tx += rt * x
+
+        n = len(window)
+        if n < 2:
+            return None
+        denom = n * self._sum_tt - self._sum_t * self._sum_t
+        if denom <= 1e-12:
+            return None
+        return (n * self._sum_tx - self._sum_t * self._sum_x) / denom * 60.0
+
+    def _rebase(self):
+        """Dời gốc thời gian về sample cũ nhất, tính lại sums (amortized O(1))"""
+        if not self._window:
+            self._t0 = None
+            return
+        shift = self._window[0][0]
+        self._t0 += shift
+        points = [(rt - shift, x) for rt, x in self._window]
+        self._window.clear()
+        self._window.extend(points)
+        self._sum_t = sum(rt for rt, _ in points)
+        self._sum_x = sum(x for _, x in points)
+        self._sum_tt = sum(rt * rt for rt, _ in points)
+        self._sum_tx = sum(rt * x for rt, x in points)
+
+
+class TrendFeatureStage:
+    """Trend features cho một chuồng: nhiệt độ và độ ẩm"""
+
+    SIGNALS = ('temperature', 'humidity')
+
+    def __init__(self, config: TrendConfig = None):
+        self.config = config or TrendConfig()
+        self.signals = {name: SignalTrend(self.config) for name in self.SIGNALS}
+
+    def update(self, sensor_data) -> Dict[str, TrendSnapshot]:
+        """Cập nhật từ SensorData, trả về snapshot mới của từng tín hiệu"""
+        t = sensor_data.timestamp.timestamp()
+        result = {}
+        for name, trend in self.signals.items():
+            value = getattr(sensor_data, name)
+            if value is None:
+                result[name] = trend.snapshot
+            else:
+                result[name] = trend.update(t, float(value))
+        return result
+
+    def temperature_rate(self) -> Optional[float]:
+        """Slope nhiệt độ (°C/phút) - input cho fuzzy inference"""
+        snapshot = self.signals['temperature'].snapshot
+        return snapshot.slope_per_min if snapshot else None
+
+
+class BatchSlope:
+    """
+    Phiên bản vectorized của linear slope trong SignalTrend cho replay/backtest:
+    xử lý từng chunk bằng sliding_window_view, giữ lại (window - 1) sample cuối
+    giữa các chunk nên bộ nhớ chỉ phụ thuộc kích thước chunk.
+    """
+
+    def __init__(self, window: int = TrendConfig.slope_window):
+        self.window = window
+        self._tail_t = np.empty(0)
+        self._tail_x = np.empty(0)
+
+    def update(self, t: np.ndarray, x: np.ndarray) -> np.ndarray:
+        """Slope (đơn vị/phút) tại mỗi sample của chunk, NaN khi chưa đủ 2 điểm"""
+        t = np.asarray(t, dtype=float)
+        x = np.asarray(x, dtype=float)
+        if len(t) == 0:
+            return np.empty(0)
+        w = self.window
+        pad = max(0, w - 1 - len(self._tail_t))
+        all_t = np.concatenate([np.full(pad, np.nan), self._tail_t, t])
+        all_x = np.concatenate([np.full(pad, np.nan), self._tail_x, x])
+        # Gốc thời gian là sample đầu chunk để giữ độ chính xác float
+        all_t = all_t - t[0]
+
+        wt = sliding_window_view(all_t, w)
+        wx = sliding_window_view(all_x, w)
+        valid = ~np.isnan(wt)
+        n = valid.sum(axis=1)
+        safe_n = np.maximum(n, 1)
+        mean_t = np.where(valid, wt, 0.0).sum(axis=1) / safe_n
+        mean_x = np.where(valid, wx, 0.0).sum(axis=1) / safe_n
+        dt = np.where(valid, wt - mean_t[:, None], 0.0)
+        dx = np.where(valid, wx - mean_x[:, None], 0.0)
+        sxx = (dt * dt).sum(axis=1)
+        sxy = (dt * dx).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = np.where((n >= 2) & (sxx > 1e-12), sxy / sxx * 60.0, np.nan)
+
+        keep = w - 1
+        self._tail_t = (all_t[len(all_t) - keep:] + t[0]) if keep else np.empty(0)
+        self._tail_x = all_x[len(all_x) - keep:] if keep else np.empty(0)
+        valid_tail = ~np.isnan(self._tail_t)
+        self._tail_t = self._tail_t[valid_tail]
+        self._tail_x = self._tail_x[valid_tail]
+        return slope
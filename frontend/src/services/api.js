@@ -72,4 +72,24 @@ api.interceptors.response.use(
   }
 );
 
+// AI service (Flask) - stream decision / trạng thái thiết bị / alert thay cho polling
+export const AI_SERVICE_URL = 'http://localhost:5001';
+
+// handlers: { status, decision, device_state, alert, emergency } → mỗi handler nhận data đã parse.
+// EventSource tự kết nối lại và gửi Last-Event-ID → service replay các event đã lỡ.
+// Trả về hàm để đóng stream (gọi trong cleanup của useEffect).
+export const subscribeAIEvents = (handlers = {}) => {
+  const source = new EventSource(`${AI_SERVICE_URL}/events`);
+
+  Object.entries(handlers).forEach(([type, handler]) => {
+    source.addEventListener(type, (event) => handler(JSON.parse(event.data)));
+  });
+
+  source.onerror = () => {
+    console.warn('⚠️ [AI EVENTS] Mất kết nối stream, đang kết nối lại...');
+  };
+
+  return () => source.close();
+};
+
 export default api;